@@ -0,0 +1,275 @@
+""" Non-interactive batch mode. Processes every paper in the papers directory
+with a fixed set of configuration selections, one BcoRag instance per worker
+process.
+"""
+
+import glob
+import logging
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from bcorag import misc_functions as misc_fns
+from bcorag.option_picker import parse_repo_url
+from typing import Any
+
+CONF_PATH = "./bcorag/conf.json"
+SUMMARY_FILE = "batch_summary.json"
+# per paper log directory, next to the batch summary in the output directory
+LOG_DIR = "batch_logs"
+
+
+def build_selections(overrides: dict, conf_path: str = CONF_PATH) -> dict:
+    """Builds the headless configuration selections. Each option starts at its
+    default in the configuration file and is replaced by the override value if
+    one is supplied.
+
+    Parameters
+    ----------
+    overrides : dict
+        The option overrides, keyed by option name (e.g. "llm"). The optional
+        "repo" key holds a Github repository URL or a list of them.
+    conf_path : str (default: CONF_PATH)
+        Path to the configuration file with the option presets.
+
+    Returns
+    -------
+    dict
+        The configuration selections, minus the paper specific "filename" and
+        "filepath" entries.
+    """
+    presets = misc_fns.load_json(conf_path)
+    selections: dict[str, Any] = {}
+    for option, option_info in presets["options"].items():
+        value = overrides.get(option)
+        if value is None:
+            value = option_info.get("default", option_info["list"][0])
+        value = str(value)
+        if value not in option_info["list"]:
+            raise ValueError(
+                f"Invalid value `{value}` for option `{option}`, expected one of {option_info['list']}."
+            )
+        selections[option] = value
+
+    repo_urls = overrides.get("repo") or []
+    if isinstance(repo_urls, str):
+        repo_urls = [repo_urls]
+    selections["git_data"] = []
+    for repo_url in repo_urls:
+        git_data = parse_repo_url(repo_url)
+        if git_data is None:
+            raise ValueError(f"Error parsing repository URL `{repo_url}`.")
+        if git_data not in selections["git_data"]:
+            selections["git_data"].append(git_data)
+
+    return selections
+
+
+def collect_papers(paper_directory: str, filetype: str = "pdf") -> list[tuple[str, str]]:
+    """Expands the papers directory into the list of papers to process.
+
+    Parameters
+    ----------
+    paper_directory : str
+        The directory containing the papers.
+    filetype : str (default: pdf)
+        The filetype to filter on.
+
+    Returns
+    -------
+    list[tuple[str, str]]
+        The name and path of each paper, sorted by name.
+    """
+    target_files = sorted(glob.glob(os.path.join(paper_directory, f"*.{filetype}")))
+    return [(os.path.basename(filepath), filepath) for filepath in target_files]
+
+
+def run_batch(
+    selections: dict,
+    papers: list[tuple[str, str]],
+    domains: list[str] | str = "all",
+    max_workers: int | None = None,
+    max_concurrency: int | None = None,
+    output_dir: str = "./output",
+    bypass_response_cache: bool = False,
+) -> list[dict]:
+    """Fans the papers out across a process pool and collects a summary for each
+    paper. A failure on one paper is recorded in its summary and does not stop
+    the rest of the batch.
+
+    Parameters
+    ----------
+    selections : dict
+        The configuration selections shared by every paper (see build_selections).
+    papers : list[tuple[str, str]]
+        The name and path of each paper to process.
+    domains : list[str] or str (default: "all")
+        The domains to generate for each paper.
+    max_workers : int or None (default: None)
+        Number of worker processes, defaults to the number of processors.
+    max_concurrency : int or None (default: None)
+        The per paper cap on concurrent domain queries, defaults to the BcoRag
+        default.
+    output_dir : str (default: "./output")
+        The directory to dump the outputs and the batch summary.
+    bypass_response_cache : bool (default: False)
+        Whether to bypass the LLM response cache lookups.
+
+    Returns
+    -------
+    list[dict]
+        The per paper summaries in the same order as the papers.
+    """
+    logger = logging.getLogger("bcorag")
+    summaries: dict[str, dict] = {}
+    # created up front, the workers would race to create it
+    os.makedirs(os.path.join(output_dir, LOG_DIR), exist_ok=True)
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_init_worker
+    ) as executor:
+        futures = {
+            executor.submit(
+                _process_paper,
+                {**selections, "filename": name, "filepath": path},
+                domains,
+                max_concurrency,
+                output_dir,
+                bypass_response_cache,
+            ): name
+            for name, path in papers
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                summary = future.result()
+            except Exception as e:
+                # the worker process itself died (e.g. killed or out of memory)
+                summary = {"paper": name, "status": "failed", "error": repr(e)}
+            summaries[name] = summary
+            logger.info(f"Batch paper `{name}` finished with status `{summary['status']}`.")
+            print(f"[{len(summaries)}/{len(papers)}] {name}: {summary['status']}")
+
+    ordered_summaries = [summaries[name] for name, _ in papers]
+    misc_fns.write_json(os.path.join(output_dir, SUMMARY_FILE), ordered_summaries)
+    total_cost = sum(
+        summary["usage"]["total"]["cost"]
+        for summary in ordered_summaries
+        if summary.get("usage") is not None
+    )
+    logger.info(f"Batch finished with a total cost of ${total_cost:.4f}.")
+    print(f"Total cost: ${total_cost:.4f}")
+    return ordered_summaries
+
+
+def _init_worker():
+    """Worker initializer, drops the log handlers inherited from the parent
+    process so concurrent workers don't interleave writes (each paper logs to
+    its own file, see _process_paper).
+    """
+    _remove_log_handlers(logging.getLogger("bcorag"))
+
+
+def _remove_log_handlers(logger: logging.Logger):
+    """Removes and closes a logger's handlers.
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        The logger.
+    """
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def _process_paper(
+    user_selections: dict,
+    domains: list[str] | str,
+    max_concurrency: int | None,
+    output_dir: str,
+    bypass_response_cache: bool,
+) -> dict:
+    """Worker entry point, indexes one paper and generates its domains. The
+    paper is logged to its own file in the batch log directory of the output
+    directory, overwritten on reruns.
+
+    Parameters
+    ----------
+    user_selections : dict
+        The full configuration selections for the paper.
+    domains : list[str] or str
+        The domains to generate.
+    max_concurrency : int or None
+        The cap on concurrent domain queries.
+    output_dir : str
+        The directory to dump the outputs.
+    bypass_response_cache : bool
+        Whether to bypass the LLM response cache lookups.
+
+    Returns
+    -------
+    dict
+        The paper summary with the status ("partial" if only some domains
+        failed), the time spent in each stage, the token usage and cost (in
+        total and per domain), the schema validation pass/fail for each
+        domain, the trace and log file paths, the error of each failed domain
+        and the error (if any).
+    """
+    # imported in the worker so the parent process stays light
+    from bcorag.bcorag import BcoRag, DEFAULT_MAX_CONCURRENCY
+
+    log_path = os.path.join(
+        output_dir, LOG_DIR, f"{os.path.splitext(user_selections['filename'])[0]}.log"
+    )
+    logger = misc_fns.setup_root_logger(log_path)
+
+    summary: dict[str, Any] = {
+        "paper": user_selections["filename"],
+        "status": "success",
+        "domains": [],
+        "timings": {},
+        "usage": None,
+        "validation": {},
+        "trace": None,
+        "log": log_path,
+        "failed_domains": {},
+        "error": None,
+    }
+    start = time.perf_counter()
+    bco_rag = None
+    try:
+        bco_rag = BcoRag(
+            user_selections,
+            output_dir=output_dir,
+            bypass_response_cache=bypass_response_cache,
+        )
+        results = bco_rag.generate_domains(
+            domains,
+            max_concurrency if max_concurrency is not None else DEFAULT_MAX_CONCURRENCY,
+        )
+        summary["domains"] = list(results.keys())
+        if bco_rag.domain_errors:
+            summary["failed_domains"] = dict(bco_rag.domain_errors)
+            summary["status"] = "partial" if results else "failed"
+    except Exception as e:
+        summary["status"] = "failed"
+        summary["error"] = f"{e!r}\n{traceback.format_exc()}"
+        logger.error(
+            f"Batch processing failed for `{user_selections['filename']}`.\n{summary['error']}"
+        )
+    if bco_rag is not None:
+        summary["timings"] = dict(bco_rag.timings)
+        ledger_summary = bco_rag.ledger.summary()
+        summary["usage"] = {
+            "total": ledger_summary["total"],
+            "scopes": ledger_summary["scopes"],
+            "ledger": bco_rag.ledger_path,
+        }
+        summary["trace"] = bco_rag.tracer.trace_path
+        summary["validation"] = {
+            domain: result["valid"]
+            for domain, result in bco_rag.validation_results.items()
+        }
+    summary["timings"]["total"] = time.perf_counter() - start
+    _remove_log_handlers(logger)
+    return summary
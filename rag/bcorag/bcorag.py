@@ -1,55 +1,169 @@
 """ Handles the RAG implementation using the llama-index library.
+
+Imports only needed by some configurations (the OpenAI embedding model, the
+semantic chunker, the Github loader and the generic directory reader) are
+deferred until the stage that needs them.
 """
 
 from llama_index.core import (
     VectorStoreIndex,
-    SimpleDirectoryReader,
     Settings,
-    download_loader,
+    StorageContext,
     get_response_synthesizer,
+    load_index_from_storage,
+)
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.llms import LLM
+from llama_index.core.schema import (
+    BaseNode,
+    Document,
+    MetadataMode,
+    NodeWithScore,
+    QueryBundle,
 )
-from llama_index.core.callbacks import CallbackManager, TokenCountingHandler
 from llama_index.core.retrievers import VectorIndexRetriever
 from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.core.response import Response
-from llama_index.llms.openai import OpenAI  # type: ignore
-from llama_index.embeddings.openai import OpenAIEmbedding  # type: ignore
-from llama_index.core.node_parser import SemanticSplitterNodeParser
-from llama_index.readers.github import GithubRepositoryReader, GithubClient  # type: ignore
+from llama_index.core.base.response.schema import RESPONSE_TYPE, StreamingResponse
+from llama_index.core.response_synthesizers import BaseSynthesizer, ResponseMode
 from dotenv import load_dotenv
-import tiktoken
-from pathlib import Path
 import os
-from contextlib import contextmanager, redirect_stderr, redirect_stdout
+import shutil
+from contextlib import contextmanager
 import json
+import copy
+import asyncio
+import time
+import traceback
+from typing import TYPE_CHECKING
 import bcorag.misc_functions as misc_fns
+from bcorag.validation import build_validator, validation_errors
+from bcorag.tracing import Span, Tracer, TracingCallbackHandler, annotate
+from bcorag.metering import MeteringHandler, MeteringLedger, metered_scope
+from bcorag.pdf_loader import load_pdf
+from bcorag.embedding_cache import EmbeddingCache
+from bcorag.corpus import CorpusIndex, paper_filters
+from bcorag.hybrid_retriever import HybridRetriever, reciprocal_rank_fusion
+from bcorag.node_merger import merge_nodes
+from bcorag.schema_slicer import (
+    minify_domain_prompt,
+    build_supplement_prompt,
+    count_tokens,
+    token_report,
+)
+from bcorag.response_cache import (
+    ResponseCache,
+    CachedOpenAI,
+    DEFAULT_MAX_BYTES as DEFAULT_RESPONSE_CACHE_BYTES,
+)
 from bcorag.prompts import (
     QUERY_PROMPT,
-    SUPPLEMENT_PROMPT,
+    REPAIR_PROMPT,
     USABILITY_DOMAIN,
     IO_DOMAIN,
     DESCRIPTION_DOMAIN,
     EXECUTION_DOMAIN,
     PARAMETRIC_DOMAIN,
     ERROR_DOMAIN,
+    USABILITY_RETRIEVAL,
+    IO_RETRIEVAL,
+    DESCRIPTION_RETRIEVAL,
+    EXECUTION_RETRIEVAL,
+    PARAMETRIC_RETRIEVAL,
+    ERROR_RETRIEVAL,
 )
 
+if TYPE_CHECKING:
+    from bcorag.semantic_chunker import SemanticChunker
+    from bcorag.github_loader import GithubLoader
+    from bcorag.bm25_index import BM25Index
+
 # git branch to read repositories from
 GIT_BRANCH = "master"
+# default cap on the number of domain queries in flight at once
+DEFAULT_MAX_CONCURRENCY = 3
+# default max number of repair calls for a response that fails schema validation
+DEFAULT_MAX_REPAIR_ATTEMPTS = 2
+# response synthesizer mode of the compact synthesis, also part of the response
+# cache key
+RESPONSE_MODE = ResponseMode.COMPACT
+
+# mapping for each domain to its standardized prompt and retrieval queries
+DOMAIN_MAP = {
+    "usability": {
+        "prompt": USABILITY_DOMAIN,
+        "retrieval": USABILITY_RETRIEVAL,
+        "top_level": False,
+        "user_prompt": "[u]sability",
+        "code": "u",
+    },
+    "io": {
+        "prompt": IO_DOMAIN,
+        "retrieval": IO_RETRIEVAL,
+        "top_level": True,
+        "user_prompt": "[i]o",
+        "code": "i",
+    },
+    "description": {
+        "prompt": DESCRIPTION_DOMAIN,
+        "retrieval": DESCRIPTION_RETRIEVAL,
+        "top_level": True,
+        "user_prompt": "[d]escription",
+        "code": "d",
+    },
+    "execution": {
+        "prompt": EXECUTION_DOMAIN,
+        "retrieval": EXECUTION_RETRIEVAL,
+        "top_level": True,
+        "user_prompt": "[e]xecution",
+        "code": "e",
+    },
+    "parametric": {
+        "prompt": PARAMETRIC_DOMAIN,
+        "retrieval": PARAMETRIC_RETRIEVAL,
+        "top_level": False,
+        "user_prompt": "[p]arametric",
+        "code": "p",
+    },
+    "error": {
+        "prompt": ERROR_DOMAIN,
+        "retrieval": ERROR_RETRIEVAL,
+        "top_level": False,
+        "user_prompt": "[err]or",
+        "code": "err",
+    },
+}
 
 
-@contextmanager
-def supress_stdout_stderr():
-    """Context manager that redirects stdout and stderr to devnull."""
-    with open(os.devnull, "w") as fnull:
-        with redirect_stderr(fnull), redirect_stdout(fnull):
-            yield
+def _ivf_build_params() -> dict:
+    """Loads the IVF build parameters (nprobe only applies at query time)."""
+    ivf_params = misc_fns.load_json("./bcorag/conf.json")["ivf"]
+    return {param: value for param, value in ivf_params.items() if param != "nprobe"}
+
+
+def _strip_fences(response: str) -> str:
+    """Strips the markdown JSON code fence from a response, if present."""
+    if response.startswith("```json\n"):
+        response = response.replace("```json\n", "").replace("```", "")
+    return response
 
 
 class BcoRag:
     """Class to handle the RAG implementation."""
 
-    def __init__(self, user_selections: dict, output_dir: str = "./output"):
+    def __init__(
+        self,
+        user_selections: dict,
+        output_dir: str = "./output",
+        cache_dir: str = "./cache",
+        response_cache_max_bytes: int = DEFAULT_RESPONSE_CACHE_BYTES,
+        bypass_response_cache: bool = False,
+        max_repair_attempts: int = DEFAULT_MAX_REPAIR_ATTEMPTS,
+        llm: LLM | None = None,
+        embed_model: BaseEmbedding | None = None,
+    ):
         """Constructor.
 
         Parameters
@@ -58,11 +172,26 @@ class BcoRag:
             The user configuration selections.
         output_dir : str (default: "./output")
             The directory to dump the outputs.
+        cache_dir : str (default: "./cache")
+            The directory to persist reusable artifacts (e.g. indexes) to.
+        response_cache_max_bytes : int (default: DEFAULT_RESPONSE_CACHE_BYTES)
+            The byte budget for the LLM response cache.
+        bypass_response_cache : bool (default: False)
+            Whether to skip LLM response cache lookups and always call the LLM.
+        max_repair_attempts : int (default: DEFAULT_MAX_REPAIR_ATTEMPTS)
+            The max number of repair calls for a response that fails schema
+            validation.
+        llm : LLM or None (default: None)
+            Overrides the LLM chosen in the user selections (e.g. with a local
+            stand-in for benchmarking). Overridden LLMs skip the response cache.
+        embed_model : BaseEmbedding or None (default: None)
+            Overrides the embedding model chosen in the user selections.
 
         Attributes
         ----------
         domain_map : dict
-            Mapping for each domain to its standardized prompt.
+            Mapping for each domain to its standardized prompt, its prompt with the
+            schema minified and its sliced top level schema supplement.
         output_path : str
             Path to the specific document directory to dump the outputs.
         debug : bool
@@ -71,77 +200,107 @@ class BcoRag:
             The file name that is being indexed.
         logger : logging.Logger
             The document specific logger.
-        embed_model : OpenAIEmbedding
+        embed_model : BaseEmbedding
             The embedding model instance.
-        documents : list[Documents]
-            The list of documents (containers for the data source).
+        response_cache : ResponseCache
+            The LLM response cache.
+        llm : LLM
+            The LLM instance.
+        max_repair_attempts : int
+            The max number of repair calls per response.
+        validation_results : dict[str, dict]
+            The schema validation outcome for each generated domain.
+        domain_errors : dict[str, str]
+            The error of each domain whose last concurrent generation failed.
+        merge_reports : dict[str, dict[str, int]]
+            The node and token counts of each domain's retrieved nodes before
+            and after merging the adjacent and overlapping nodes.
+        github_loaders : list[GithubLoader]
+            The supplementary repository loaders, empty if no repository was
+            chosen.
+        git_commits : dict[str, str]
+            The head commit SHA of each supplementary repository, keyed by its
+            `owner/repo` name.
+        documents : list[Documents] or None
+            The list of documents (containers for the data source), None if the
+            index was loaded from the index cache. Repository files with cached
+            nodes are not loaded as documents.
+        paper_id : str
+            The content hash of the paper.
+        index_cache_path : str
+            Path to the persisted index for this paper and configuration, or to
+            the shared corpus index for the configuration.
+        corpus : CorpusIndex or None
+            The shared corpus index (if the corpus index scope is chosen).
         index : VectorStoreIndex
             The vector indexer instance.
-        token_counter : TokenCountingHandler or None
-            The token counter handler or None if mode is production.
-        token_counts : dict or None
-            The token counts or None if mode is production.
-        splitter : SemanticSplitterNodeParser or None
-            The node parser (if a non-fixed chunking strategy is chosen).
+        bm25 : BM25Index or None
+            The BM25 index over the same nodes (if the hybrid retriever is
+            chosen), persisted next to the vector index.
+        similarity_top_k : int
+            The number of nodes retrieved per domain.
+        query_engine : RetrieverQueryEngine
+            The query engine.
+        streaming_query_engine : RetrieverQueryEngine
+            The query engine that streams the response.
+        tracer : Tracer
+            The tracer writing the stage spans to the run trace file.
+        run_id : str
+            The run identifier used in the trace and ledger file names.
+        ledger : MeteringLedger
+            The per call token and cost ledger for the paper.
+        ledger_path : str
+            Path the ledger is written to after indexing and after each domain.
+        timings : dict[str, float]
+            Wall clock seconds spent in each stage (load, chunk, embed and index,
+            then retrieve, synthesize, repair and write for each domain, plus the
+            time to first token for streamed domains).
+        embedding_cache : EmbeddingCache
+            The text embedding cache for the embedding model, shared by the
+            semantic chunking and the node embeddings.
+        query_embedding_cache : EmbeddingCache
+            The query embedding cache for the embedding model, holding the
+            retrieval query embeddings.
+        query_embeddings : dict[str, list[float]]
+            The embedding of each domain retrieval query.
+        splitter : SemanticChunker or None
+            The semantic chunker (if a non-fixed chunking strategy is chosen).
         """
         _llm_model_name = user_selections["llm"]
         _embed_model_name = user_selections["embedding_model"]
         _file_name = user_selections["filename"]
-        _file_path = user_selections["filepath"]
         _vector_store = user_selections["vector_store"]
-        _loader = user_selections["loader"]
+        _index_scope = user_selections.get("index_scope", "paper")
+        _retriever = user_selections.get("retriever", "vector")
+        _synthesis = user_selections.get("synthesis", "compact")
         _mode = user_selections["mode"]
         _top_k = int(user_selections["similarity_top_k"])
-        _git_flag = True if user_selections["git_data"] is not None else False
+        _git_flag = True if user_selections["git_data"] else False
         _chunk_strat = user_selections["chunking_config"]
         _chunk_fixed = (
             False if user_selections["chunking_config"] == "semantic" else True
         )
 
         # domain mapping
-        self.domain_map = {
-            "usability": {
-                "prompt": USABILITY_DOMAIN,
-                "top_level": False,
-                "user_prompt": "[u]sability",
-                "code": "u",
-            },
-            "io": {
-                "prompt": IO_DOMAIN,
-                "top_level": True,
-                "user_prompt": "[i]o",
-                "code": "i",
-            },
-            "description": {
-                "prompt": DESCRIPTION_DOMAIN,
-                "top_level": True,
-                "user_prompt": "[d]escription",
-                "code": "d",
-            },
-            "execution": {
-                "prompt": EXECUTION_DOMAIN,
-                "top_level": True,
-                "user_prompt": "[e]xecution",
-                "code": "e",
-            },
-            "parametric": {
-                "prompt": PARAMETRIC_DOMAIN,
-                "top_level": False,
-                "user_prompt": "[p]arametric",
-                "code": "p",
-            },
-            "error": {
-                "prompt": ERROR_DOMAIN,
-                "top_level": False,
-                "user_prompt": "[err]or",
-                "code": "err",
-            },
-        }
+        self.domain_map = copy.deepcopy(DOMAIN_MAP)
+        # slice the top level schema down to the referenced definitions and
+        # minify the schemas to cut the prompt tokens
+        for domain_info in self.domain_map.values():
+            domain_info["sliced_prompt"] = minify_domain_prompt(domain_info["prompt"])
+            domain_info["supplement"] = (
+                build_supplement_prompt(domain_info["prompt"])
+                if domain_info["top_level"]
+                else None
+            )
+            domain_info["validator"] = build_validator(domain_info["prompt"])
+        self.validation_results: dict[str, dict] = {}
+        self.domain_errors: dict[str, str] = {}
+        self.merge_reports: dict[str, dict[str, int]] = {}
 
         load_dotenv()
 
         openai_api_key = os.getenv("OPENAI_API_KEY")
-        if not openai_api_key:
+        if not openai_api_key and (llm is None or embed_model is None):
             raise EnvironmentError("OpenAI API key not found.")
 
         github_token = os.getenv("GITHUB_TOKEN")
@@ -151,22 +310,47 @@ class BcoRag:
         self.output_path = f"{output_dir}/{os.path.splitext(_file_name.lower().replace(' ', '_').strip())[0]}/"
         misc_fns.check_dir(self.output_path)
         self.debug = True if _mode == "debug" else False
+        self.max_repair_attempts = max_repair_attempts
+        self.similarity_top_k = _top_k
         self.file_name = _file_name
         self.logger = misc_fns.setup_document_logger(
             self.file_name.lower().strip().replace(" ", "_")
         )
         self._display_info(user_selections, "User selections:")
+        if self.debug:
+            self._display_info(
+                token_report(self.domain_map, _llm_model_name),
+                "Query prompt token counts (full schema vs sliced schema):",
+            )
+        self.timings: dict[str, float] = {}
+        self.run_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+        self.tracer = Tracer(f"{self.output_path}trace_{self.run_id}.jsonl")
+        self.ledger = MeteringLedger(self.file_name)
+        self.ledger_path = f"{self.output_path}ledger_{self.run_id}.json"
+        self.logger.info(f"Writing trace spans to `{self.tracer.trace_path}`.")
 
         # setup embedding model
-        self.embed_model = OpenAIEmbedding(model=_embed_model_name)
+        if embed_model is None:
+            from llama_index.embeddings.openai import OpenAIEmbedding  # type: ignore
+
+            embed_model = OpenAIEmbedding(model=_embed_model_name)
+        self.embed_model = embed_model
         Settings.embed_model = self.embed_model
+        self.embedding_cache = EmbeddingCache(
+            os.path.join(cache_dir, "embeddings"), self.embed_model
+        )
+        self.query_embedding_cache = EmbeddingCache(
+            os.path.join(cache_dir, "query_embeddings"), self.embed_model, query=True
+        )
 
         # handle chunking strategy chosen
-        self.splitter = None
+        self.splitter: SemanticChunker | None = None
         if _chunk_strat == "semantic":
-            self.splitter = SemanticSplitterNodeParser.from_defaults(
+            from bcorag.semantic_chunker import SemanticChunker
+
+            self.splitter = SemanticChunker(
+                self.embedding_cache,
                 buffer_size=1,
-                embed_model=self.embed_model,
                 # The percentile of cosin dissimilarity that must be exceeded
                 # between a group of sentences and the next to form a node. The
                 # smaller this number is, the more nodes will be generated.
@@ -185,97 +369,889 @@ class BcoRag:
             Settings.chunk_size = 1024
             Settings.chunk_overlap = 20
 
-        # setup llm model
-        Settings.llm = OpenAI(model=_llm_model_name)
+        # setup llm model, behind the response cache
+        self.response_cache = ResponseCache(
+            os.path.join(cache_dir, "responses"),
+            max_bytes=response_cache_max_bytes,
+            bypass=bypass_response_cache,
+        )
+        self.llm = (
+            llm
+            if llm is not None
+            else CachedOpenAI(
+                response_cache=self.response_cache,
+                cache_namespace=(
+                    f"response_mode={RESPONSE_MODE.value}"
+                    if _synthesis == "compact"
+                    else f"response_mode={_synthesis}"
+                ),
+                model=_llm_model_name,
+            )
+        )
+        Settings.llm = self.llm
 
-        # handle additional output for debugging mode
-        if self.debug:
-            self.token_counter: TokenCountingHandler | None = TokenCountingHandler(
-                tokenizer=tiktoken.encoding_for_model(_llm_model_name).encode
-            )
-            Settings.callback_manager = CallbackManager([self.token_counter])
-            self.token_counts: dict | None = {
-                "embedding": 0,
-                "input": 0,
-                "output": 0,
-                "total": 0,
-            }
-        else:
-            self.token_counter = None
-            self.token_counts = None
-
-        # handle data loader
-        if _loader == "SimpleDirectoryReader":
-            loader = SimpleDirectoryReader(input_files=[_file_path])
-            paper_documents = loader.load_data()
-        elif _loader == "PDFReader":
-            with supress_stdout_stderr():
-                pdf_loader = download_loader("PDFReader")
-            paper_documents = pdf_loader().load_data(file=Path(_file_path))
-        documents = paper_documents  # type: ignore
+        # trace and meter the embedding and llm calls
+        _llm_model = self.llm.metadata.model_name
+        _embed_model = self.embed_model.model_name
+        callback_manager = CallbackManager(
+            [
+                TracingCallbackHandler(self.tracer, _llm_model, _embed_model),
+                MeteringHandler(self.ledger, _llm_model, _embed_model),
+            ]
+        )
+        Settings.callback_manager = callback_manager
+        self.llm.callback_manager = callback_manager
+        self.embed_model.callback_manager = callback_manager
+
+        # the retrieval queries are constants, they are only embedded the first
+        # time they are used with the embedding model (or after they change)
+        _queries = [
+            query
+            for domain_info in self.domain_map.values()
+            for query in domain_info["retrieval"]
+        ]
+        self.query_embeddings = dict(
+            zip(_queries, self.query_embedding_cache.embed(_queries))
+        )
+        self.logger.info(
+            f"Loaded {self.query_embedding_cache.hits} retrieval query embedding(s) from the cache, "
+            f"embedded {self.query_embedding_cache.misses}."
+        )
+
+        # resolve the supplementary repository heads, the repository files are
+        # cached by blob sha so only new or changed files are fetched and embedded,
+        # and filtered by the `repo_filter` policy before anything is chunked
+        self.github_loaders: list[GithubLoader] = []
+        self.git_commits: dict[str, str] = {}
         if _git_flag:
-            github_client = GithubClient(github_token)
-            with supress_stdout_stderr():
-                download_loader("GithubRepositoryReader")
-            git_loader = GithubRepositoryReader(
-                github_client=github_client,
-                owner=user_selections["git_data"]["user"],
-                repo=user_selections["git_data"]["repo"],
+            from bcorag.github_loader import GithubLoader, head_commits
+            from bcorag.github_api import DEFAULT_BASE_URL as DEFAULT_GITHUB_API_URL
+            from bcorag.repo_filter import RepoFilter
+
+            _namespace = misc_fns.hash_data(
+                {
+                    "chunking_config": _chunk_strat,
+                    "embedding_model": _embed_model_name,
+                    "embedding_class": self.embed_model.class_name(),
+                }
+            )
+            _repo_filter = RepoFilter.from_conf()
+            self.github_loaders = [
+                GithubLoader(
+                    github_token,
+                    owner=git_data["user"],
+                    repo=git_data["repo"],
+                    branch=GIT_BRANCH,
+                    cache_dir=os.path.join(cache_dir, "github"),
+                    namespace=_namespace,
+                    base_url=os.getenv("GITHUB_API_URL", DEFAULT_GITHUB_API_URL),
+                    repo_filter=_repo_filter,
+                )
+                for git_data in user_selections["git_data"]
+            ]
+            for loader, commit in zip(
+                self.github_loaders, head_commits(self.github_loaders)
+            ):
+                self.git_commits[loader.name] = commit
+                self.logger.info(f"Repo `{loader.name}` is at commit `{commit}`.")
+
+        # handle indexing, either into the shared corpus index or into a private
+        # index for the paper, reusing a persisted index if one exists for this
+        # exact paper content and configuration
+        self.paper_id = misc_fns.hash_file(user_selections["filepath"])
+        if _index_scope == "corpus":
+            self.index_cache_path = os.path.join(
+                cache_dir, "corpus", self._corpus_cache_key(user_selections)
+            )
+        else:
+            self.index_cache_path = os.path.join(
+                cache_dir, "indexes", self._index_cache_key(user_selections)
+            )
+        self.documents = None
+        self.corpus: CorpusIndex | None = None
+        if _index_scope == "corpus":
+            self._index_corpus(user_selections, cache_dir, _chunk_fixed)
+        elif os.path.isdir(self.index_cache_path):
+            self.logger.info(
+                f"Index cache hit, loading index from `{self.index_cache_path}`."
             )
+            with self._timed("index", cache_hit=True) as span:
+                storage_context = self._storage_context(
+                    _vector_store, self.index_cache_path
+                )
+                self.index = load_index_from_storage(storage_context)  # type: ignore
+                span.set(node_count=len(self.index.docstore.docs))
+        else:
             self.logger.info(
-                f"Loading repo `{user_selections['git_data']['repo']}` from user `{user_selections['git_data']['user']}`"
+                f"Index cache miss, building index to persist at `{self.index_cache_path}`."
             )
-            github_documents = git_loader.load_data(branch=GIT_BRANCH)
-            documents += github_documents
-        self.documents = documents  # type: ignore
+            repo_nodes: list[BaseNode] = []
+            with self._timed("load", loader=user_selections["loader"]) as span:
+                self.documents = self._load_documents(
+                    user_selections, os.path.join(cache_dir, "pdf_text"), span
+                )
+                if self.github_loaders:
+                    from bcorag.github_loader import load_all
 
-        # handle indexing
-        if _vector_store == "VectorStoreIndex":
-            if _chunk_fixed:
-                self.index = VectorStoreIndex.from_documents(self.documents)
-            else:
-                nodes = self.splitter.build_semantic_nodes_from_documents(self.documents)  # type: ignore
-                self.index = VectorStoreIndex(nodes=nodes)
+                    # load the repositories concurrently
+                    for cached_nodes, repo_documents in load_all(self.github_loaders):
+                        repo_nodes += cached_nodes
+                        self.documents += repo_documents
+                    span.set(
+                        repos={
+                            loader.name: loader.stats for loader in self.github_loaders
+                        }
+                    )
+                span.set(document_count=len(self.documents))
+            nodes = self._chunk_and_embed(self.documents, _chunk_fixed)
+            for loader in self.github_loaders:
+                loader.cache_nodes(nodes)
+            self.index = self._build_index(nodes + repo_nodes, _vector_store)
+            # persisted to a temporary sibling and moved into place, so an
+            # interrupted persist is never taken for a cache hit
+            tmp_dir = f"{self.index_cache_path}.{os.getpid()}.tmp"
+            self.index.storage_context.persist(persist_dir=tmp_dir)
+            try:
+                os.replace(tmp_dir, self.index_cache_path)
+            except OSError:
+                # a concurrent run persisted the same index first
+                shutil.rmtree(tmp_dir, ignore_errors=True)
 
         # create query engine
-        retriever = VectorIndexRetriever(index=self.index, similarity_top_k=_top_k)
-        response_synthesizer = get_response_synthesizer()
+        # the corpus is pre-filtered to the paper and its repositories
+        _filters = (
+            paper_filters(self.paper_id, list(self.git_commits))
+            if self.corpus is not None
+            else None
+        )
+        self.bm25: BM25Index | None = None
+        retriever: VectorIndexRetriever | HybridRetriever
+        if _retriever == "hybrid":
+            from bcorag.bm25_index import BM25Index
+
+            # timed with the indexing, the BM25 index is built or brought in
+            # line with the vector index
+            with self._timed("index", sparse="bm25") as span:
+                _hybrid = misc_fns.load_json("./bcorag/conf.json")["hybrid"]
+                self.bm25 = BM25Index.for_index(
+                    self.index, self.index_cache_path, k1=_hybrid["k1"], b=_hybrid["b"]
+                )
+                span.set(node_count=len(self.bm25))
+            retriever = HybridRetriever.from_conf(
+                self.index, self.bm25, _top_k, filters=_filters
+            )
+        else:
+            retriever = VectorIndexRetriever(
+                index=self.index, similarity_top_k=_top_k, filters=_filters
+            )
+        response_synthesizer: BaseSynthesizer
+        streaming_synthesizer: BaseSynthesizer
+        if _synthesis == "packed":
+            from bcorag.packed_synthesizer import PackedSynthesizer
+
+            response_synthesizer = PackedSynthesizer.from_conf(self.llm)
+            streaming_synthesizer = PackedSynthesizer.from_conf(
+                self.llm, streaming=True
+            )
+        else:
+            response_synthesizer = get_response_synthesizer(
+                response_mode=RESPONSE_MODE
+            )
+            streaming_synthesizer = get_response_synthesizer(
+                response_mode=RESPONSE_MODE, streaming=True
+            )
         self.query_engine = RetrieverQueryEngine(
             retriever=retriever, response_synthesizer=response_synthesizer
         )
+        self.streaming_query_engine = RetrieverQueryEngine(
+            retriever=retriever, response_synthesizer=streaming_synthesizer
+        )
 
-        # capture indexing embed token
-        if self.debug:
-            self.token_counts["embedding"] += self.token_counter.total_embedding_token_count  # type: ignore
+        self.ledger.write(self.ledger_path)
+
+    def _load_documents(
+        self, user_selections: dict, pdf_cache_dir: str, span: Span
+    ) -> list[Document]:
+        """Loads the paper into documents. PDF page text is extracted in parallel
+        and cached by the paper's content hash and the data loader.
+
+        Parameters
+        ----------
+        user_selections : dict[str, str | int]
+            The user configuration selections.
+        pdf_cache_dir : str
+            The directory holding the extracted PDF text cache.
+        span : Span
+            The load stage span to record the extracted text cache outcome on.
+
+        Returns
+        -------
+        list[Document]
+            The loaded documents.
+        """
+        if not user_selections["filepath"].lower().endswith(".pdf"):
+            from llama_index.core import SimpleDirectoryReader
+
+            loader = SimpleDirectoryReader(input_files=[user_selections["filepath"]])
+            return loader.load_data()
+        documents, cache_hit = load_pdf(
+            user_selections["filepath"], user_selections["loader"], pdf_cache_dir
+        )
+        span.set(pdf_cache_hit=cache_hit)
+        return documents
+
+    def _chunk_and_embed(
+        self, documents: list[Document], chunk_fixed: bool
+    ) -> list[BaseNode]:
+        """Chunks and embeds the documents, timing each of the chunk and embed
+        stages. Node embeddings go through the embedding cache, so nodes whose
+        exact text was already embedded are not embedded again.
+
+        Parameters
+        ----------
+        documents : list[Document]
+            The documents to chunk.
+        chunk_fixed : bool
+            Whether a fixed size chunking strategy was chosen.
+
+        Returns
+        -------
+        list[BaseNode]
+            The embedded nodes.
+        """
+        with self._timed("chunk", chunk_fixed=chunk_fixed) as span:
+            hits = self.embedding_cache.hits
+            if chunk_fixed:
+                nodes = Settings.node_parser.get_nodes_from_documents(documents)
+            else:
+                nodes = self.splitter.build_semantic_nodes_from_documents(documents)  # type: ignore
+            span.set(node_count=len(nodes), cache_hits=self.embedding_cache.hits - hits)
+        with self._timed("embed", node_count=len(nodes)) as span:
+            hits = self.embedding_cache.hits
+            embeddings = self.embedding_cache.embed(
+                [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+            )
+            for node, embedding in zip(nodes, embeddings):
+                node.embedding = embedding
+            span.set(cache_hits=self.embedding_cache.hits - hits)
+        return nodes
+
+    def _build_index(self, nodes: list[BaseNode], vector_store: str) -> VectorStoreIndex:
+        """Builds the index over the embedded nodes, timing the index stage.
+
+        Parameters
+        ----------
+        nodes : list[BaseNode]
+            The embedded nodes.
+        vector_store : str
+            The vector store selection.
+
+        Returns
+        -------
+        VectorStoreIndex
+            The built index.
+        """
+        with self._timed("index", cache_hit=False, node_count=len(nodes)):
+            index = VectorStoreIndex(
+                nodes=nodes, storage_context=self._storage_context(vector_store)
+            )
+        self._display_info(f"Indexed {len(nodes)} nodes.")
+        return index
 
-    def perform_query(self, domain: str) -> str:
+    def _index_corpus(self, user_selections: dict, cache_dir: str, chunk_fixed: bool):
+        """Loads the shared corpus index and adds the paper and the versions of
+        its repositories that aren't in the corpus yet. Only the missing sources
+        are loaded, chunked and embedded.
+
+        Parameters
+        ----------
+        user_selections : dict[str, str | int]
+            The user configuration selections.
+        cache_dir : str
+            The cache directory.
+        chunk_fixed : bool
+            Whether a fixed size chunking strategy was chosen.
+        """
+        vector_store = user_selections["vector_store"]
+        with self._timed("index", cache_hit=True, scope="corpus") as span:
+            self.corpus = CorpusIndex(
+                self.index_cache_path,
+                lambda persist_dir: self._storage_context(vector_store, persist_dir),
+            )
+            span.set(node_count=self.corpus.node_count)
+        paper_missing = not self.corpus.has_paper(self.paper_id)
+        repo_versions = {
+            loader.name: misc_fns.hash_data(
+                {
+                    "commit": self.git_commits[loader.name],
+                    "repo_filter": loader.repo_filter.policy
+                    if loader.repo_filter is not None
+                    else None,
+                }
+            )
+            for loader in self.github_loaders
+        }
+        missing_loaders = [
+            loader
+            for loader in self.github_loaders
+            if not self.corpus.has_repo(loader.name, repo_versions[loader.name])
+        ]
+        if not paper_missing and not missing_loaders:
+            self.logger.info(
+                f"Corpus index hit, the paper and its repos are indexed in `{self.index_cache_path}`."
+            )
+            self.index = self.corpus.index
+            return
+        self.logger.info(
+            f"Corpus index miss, adding {'the paper' if paper_missing else 'no paper'} and "
+            f"{len(missing_loaders)} repo(s) to `{self.index_cache_path}`."
+        )
+
+        # each source's nodes are tracked by their source document IDs
+        repo_nodes: dict[str, list[BaseNode]] = {}
+        doc_sources: dict[str, str] = {}
+        with self._timed("load", loader=user_selections["loader"]) as span:
+            self.documents = []
+            if paper_missing:
+                self.documents = self._load_documents(
+                    user_selections, os.path.join(cache_dir, "pdf_text"), span
+                )
+            if missing_loaders:
+                from bcorag.github_loader import load_all
+
+                for loader, (cached_nodes, repo_documents) in zip(
+                    missing_loaders, load_all(missing_loaders)
+                ):
+                    repo_nodes[loader.name] = cached_nodes
+                    doc_sources.update(
+                        {document.doc_id: loader.name for document in repo_documents}
+                    )
+                    self.documents += repo_documents
+                span.set(repos={loader.name: loader.stats for loader in missing_loaders})
+            span.set(document_count=len(self.documents))
+        nodes = self._chunk_and_embed(self.documents, chunk_fixed)
+        for loader in missing_loaders:
+            loader.cache_nodes(nodes)
+        paper_nodes: list[BaseNode] = []
+        for node in nodes:
+            source = doc_sources.get(node.ref_doc_id)  # type: ignore
+            if source is None:
+                paper_nodes.append(node)
+            else:
+                repo_nodes[source].append(node)
+
+        with self._timed(
+            "index", cache_hit=False, scope="corpus", node_count=len(nodes)
+        ) as span:
+            self.corpus.update(
+                papers=(
+                    {self.paper_id: (self.file_name, paper_nodes)}
+                    if paper_missing
+                    else {}
+                ),
+                repos={
+                    name: (repo_versions[name], source_nodes)
+                    for name, source_nodes in repo_nodes.items()
+                },
+            )
+            span.set(corpus_node_count=self.corpus.node_count)
+        self.index = self.corpus.index
+        added = len(paper_nodes) + sum(
+            len(source_nodes) for source_nodes in repo_nodes.values()
+        )
+        self._display_info(
+            f"Indexed {added} nodes into the corpus ({self.corpus.node_count} nodes)."
+        )
+
+    def _storage_context(
+        self, vector_store: str, persist_dir: str | None = None
+    ) -> StorageContext:
+        """Creates the storage context for the vector store selection.
+
+        Parameters
+        ----------
+        vector_store : str
+            The vector store selection.
+        persist_dir : str or None (default: None)
+            The persisted index to load, None for a new index.
+
+        Returns
+        -------
+        StorageContext
+            The storage context.
+        """
+        if vector_store == "NumpyVectorStore":
+            from bcorag.numpy_vector_store import NumpyVectorStore
+
+            store = (
+                NumpyVectorStore()
+                if persist_dir is None
+                else NumpyVectorStore.from_persist_dir(persist_dir)
+            )
+            return StorageContext.from_defaults(
+                persist_dir=persist_dir, vector_store=store
+            )
+        if vector_store == "IvfVectorStore":
+            from bcorag.ivf_vector_store import IvfVectorStore
+
+            store = (
+                IvfVectorStore.from_conf()
+                if persist_dir is None
+                else IvfVectorStore.from_persist_dir(
+                    persist_dir, **misc_fns.load_json("./bcorag/conf.json")["ivf"]
+                )
+            )
+            return StorageContext.from_defaults(
+                persist_dir=persist_dir, vector_store=store
+            )
+        return StorageContext.from_defaults(persist_dir=persist_dir)
+
+    def perform_query(self, domain: str, stream: bool = False) -> str:
         """Performs a qeury for a specific BCO domain.
 
         Parameters
         ----------
         domain : str
             The domain being queried for.
+        stream : bool (default: False)
+            Whether to stream the response, printing the tokens to the terminal
+            and appending them to the domain txt file as they arrive.
+
+        Returns
+        -------
+        str
+            The generated domain.
+        """
+        with self.tracer.span("query", domain=domain, stream=stream), metered_scope(
+            domain
+        ):
+            query_prompt = self._build_query_prompt(domain)
+            query_bundle = QueryBundle(query_prompt)
+            with self._timed("retrieve", domain) as span:
+                source_nodes = self._merge_source_nodes(
+                    domain,
+                    self._merge_retrievals(
+                        [
+                            self.query_engine.retrieve(retrieval_query)
+                            for retrieval_query in self._retrieval_queries(domain)
+                        ]
+                    ),
+                )
+                span.set(node_count=len(source_nodes), **self.merge_reports[domain])
+            if stream:
+                return self._perform_streaming_query(
+                    domain, query_prompt, query_bundle, source_nodes
+                )
+            with self._timed("synthesize", domain):
+                response_object = self.query_engine.synthesize(
+                    query_bundle, source_nodes
+                )
+            return self._handle_response(domain, query_prompt, response_object)
+
+    def _perform_streaming_query(
+        self,
+        domain: str,
+        query_prompt: str,
+        query_bundle: QueryBundle,
+        source_nodes: list[NodeWithScore],
+    ) -> str:
+        """Performs a streaming synthesis. The raw tokens are appended to the domain
+        txt file as they arrive so a crash mid-generation still leaves the partial
+        response on disk. The fence stripping and JSON serialization are done once
+        the stream completes.
+
+        Parameters
+        ----------
+        domain : str
+            The domain being queried for.
+        query_prompt : str
+            The query prompt.
+        query_bundle : QueryBundle
+            The query bundle for the query prompt.
+        source_nodes : list[NodeWithScore]
+            The retrieved nodes.
 
         Returns
         -------
         str
             The generated domain.
         """
-        query_prompt = QUERY_PROMPT.format(domain, self.domain_map[domain]["prompt"])
-        if self.domain_map[domain]["top_level"]:
-            query_prompt += f"\n{SUPPLEMENT_PROMPT}"
-        response_object = self.query_engine.query(query_prompt)
-        query_response = str(response_object)
+        txt_file = f"{self.output_path}{domain}_domain.txt"
+        with self._timed("synthesize", domain, stream=True) as span:
+            start = time.perf_counter()
+            response_object = self.streaming_query_engine.synthesize(
+                query_bundle, source_nodes
+            )
+            response_tokens: list[str] = []
+            with open(txt_file, "w") as f:
+                for token in response_object.response_gen:  # type: ignore
+                    if not response_tokens:
+                        self.timings[f"{domain}_first_token"] = (
+                            time.perf_counter() - start
+                        )
+                        span.set(first_token=self.timings[f"{domain}_first_token"])
+                    response_tokens.append(token)
+                    f.write(token)
+                    f.flush()
+                    print(token, end="", flush=True)
+            print()
+        return self._handle_response(
+            domain, query_prompt, response_object, "".join(response_tokens)
+        )
+
+    def generate_domains(
+        self,
+        domains: list[str] | str = "all",
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ) -> dict[str, str]:
+        """Generates multiple domains concurrently. Blocking wrapper around
+        bcorag.agenerate_domains().
+
+        Parameters
+        ----------
+        domains : list[str] or str (default: "all")
+            The domains (full names or short codes) to generate or "all" to
+            generate every domain in the domain map.
+        max_concurrency : int (default: DEFAULT_MAX_CONCURRENCY)
+            The maximum number of domain queries in flight at once.
+
+        Returns
+        -------
+        dict[str, str]
+            Mapping of each successfully generated domain to its response.
+        """
+        return asyncio.run(self.agenerate_domains(domains, max_concurrency))
+
+    async def agenerate_domains(
+        self,
+        domains: list[str] | str = "all",
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ) -> dict[str, str]:
+        """Generates multiple domains concurrently using the async query path of
+        the query engine. Each response is written out as soon as it completes.
+        A domain that fails is logged and recorded in `domain_errors` without
+        stopping the other domains.
+
+        Parameters
+        ----------
+        domains : list[str] or str (default: "all")
+            The domains (full names or short codes) to generate or "all" to
+            generate every domain in the domain map.
+        max_concurrency : int (default: DEFAULT_MAX_CONCURRENCY)
+            The maximum number of domain queries (retrieval, synthesis and
+            repairs) in flight at once.
+
+        Returns
+        -------
+        dict[str, str]
+            Mapping of each successfully generated domain to its response.
+        """
+        target_domains = self._resolve_domains(domains)
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self._display_info(
+            f"Generating domains {target_domains} with a max concurrency of {max_concurrency}."
+        )
+
+        async def _generate(domain: str) -> tuple[str, str]:
+            query_prompt = self._build_query_prompt(domain)
+            query_bundle = QueryBundle(query_prompt)
+            with self.tracer.span(
+                "query", domain=domain, stream=False
+            ), metered_scope(domain):
+                async with semaphore:
+                    with self._timed("retrieve", domain) as span:
+                        source_nodes = self._merge_source_nodes(
+                            domain,
+                            self._merge_retrievals(
+                                await asyncio.gather(
+                                    *(
+                                        self.query_engine.aretrieve(retrieval_query)
+                                        for retrieval_query in self._retrieval_queries(
+                                            domain
+                                        )
+                                    )
+                                )
+                            ),
+                        )
+                        span.set(
+                            node_count=len(source_nodes), **self.merge_reports[domain]
+                        )
+                    with self._timed("synthesize", domain):
+                        response_object = await self.query_engine.asynthesize(
+                            query_bundle, source_nodes
+                        )
+                    # the repair calls count against the concurrency cap too
+                    query_response = await self._ahandle_response(
+                        domain, query_prompt, response_object
+                    )
+                return domain, query_response
+
+        async def _try_generate(domain: str) -> tuple[str, str | None]:
+            # a failed domain is reported without cancelling the others
+            try:
+                result = await _generate(domain)
+            except Exception as e:
+                self.domain_errors[domain] = repr(e)
+                self.logger.error(
+                    f"Failed to generate the {domain} domain.\n{traceback.format_exc()}"
+                )
+                return domain, None
+            self.domain_errors.pop(domain, None)
+            return result
+
+        results: dict[str, str] = {}
+        for future in asyncio.as_completed(
+            [_try_generate(domain) for domain in target_domains]
+        ):
+            domain, query_response = await future
+            if query_response is not None:
+                results[domain] = query_response
+        return results
+
+    def _resolve_domains(self, domains: list[str] | str) -> list[str]:
+        """Resolves domain names or short codes to domain map keys.
+
+        Parameters
+        ----------
+        domains : list[str] or str
+            The domains (full names or short codes) or "all".
+
+        Returns
+        -------
+        list[str]
+            The resolved domain names, in domain map order for "all".
+        """
+        if isinstance(domains, str):
+            domains = [domains]
+        if any(domain.strip().lower() in ("all", "a") for domain in domains):
+            return list(self.domain_map.keys())
+        resolved: list[str] = []
+        for domain in domains:
+            domain = domain.strip().lower()
+            for domain_name, domain_info in self.domain_map.items():
+                if domain == domain_name or domain == domain_info["code"]:
+                    if domain_name not in resolved:
+                        resolved.append(domain_name)
+                    break
+            else:
+                raise ValueError(f"Unrecognized domain `{domain}`.")
+        return resolved
+
+    def _retrieval_queries(self, domain: str) -> list[QueryBundle]:
+        """Builds the retrieval queries for a domain, with their precomputed
+        embeddings. The retrieval queries are short descriptions of the content
+        the domain needs, the schema laden query prompt is only used for the
+        synthesis.
 
+        Parameters
+        ----------
+        domain : str
+            The domain being queried for.
+
+        Returns
+        -------
+        list[QueryBundle]
+            The query bundles to retrieve with.
+        """
+        return [
+            QueryBundle(query, embedding=self.query_embeddings[query])
+            for query in self.domain_map[domain]["retrieval"]
+        ]
+
+    def _merge_retrievals(
+        self, retrievals: list[list[NodeWithScore]]
+    ) -> list[NodeWithScore]:
+        """Merges the nodes retrieved by each retrieval query of a domain into
+        one ranking with reciprocal rank fusion, keeping the top k.
+
+        Parameters
+        ----------
+        retrievals : list[list[NodeWithScore]]
+            The nodes retrieved by each query, best first.
+
+        Returns
+        -------
+        list[NodeWithScore]
+            The top k nodes, scored by the fused rank (the retrieval scores are
+            kept as is for a single query).
+        """
+        if len(retrievals) == 1:
+            return retrievals[0]
+        nodes = {
+            result.node.node_id: result.node
+            for retrieval in retrievals
+            for result in retrieval
+        }
+        fused = reciprocal_rank_fusion(
+            [[result.node.node_id for result in retrieval] for retrieval in retrievals]
+        )
+        return [
+            NodeWithScore(node=nodes[node_id], score=score)
+            for node_id, score in fused[: self.similarity_top_k]
+        ]
+
+    def _merge_source_nodes(
+        self, domain: str, source_nodes: list[NodeWithScore]
+    ) -> list[NodeWithScore]:
+        """Merges the adjacent and overlapping retrieved nodes of the same source
+        document into contiguous passages so the overlapping text is only sent
+        to the LLM once. The node and token counts before and after the merge
+        are recorded in the domain's merge report.
+
+        Parameters
+        ----------
+        domain : str
+            The domain being queried for.
+        source_nodes : list[NodeWithScore]
+            The retrieved nodes.
+
+        Returns
+        -------
+        list[NodeWithScore]
+            The merged nodes, highest score first.
+        """
+        merged_nodes = merge_nodes(source_nodes)
+        self.merge_reports[domain] = {
+            "retrieved_nodes": len(source_nodes),
+            "retrieved_tokens": self._count_node_tokens(source_nodes),
+            "merged_nodes": len(merged_nodes),
+            "merged_tokens": self._count_node_tokens(merged_nodes),
+        }
+        return merged_nodes
+
+    def _count_node_tokens(self, nodes: list[NodeWithScore]) -> int:
+        """Counts the tokens of the nodes' content as sent to the LLM.
+
+        Parameters
+        ----------
+        nodes : list[NodeWithScore]
+            The nodes.
+
+        Returns
+        -------
+        int
+            The total token count.
+        """
+        return sum(
+            count_tokens(
+                node.node.get_content(metadata_mode=MetadataMode.LLM),
+                self.llm.metadata.model_name,
+            )
+            for node in nodes
+        )
+
+    def _build_query_prompt(self, domain: str) -> str:
+        """Builds the full query prompt for a domain.
+
+        Parameters
+        ----------
+        domain : str
+            The domain being queried for.
+
+        Returns
+        -------
+        str
+            The query prompt.
+        """
+        query_prompt = QUERY_PROMPT.format(
+            domain, self.domain_map[domain]["sliced_prompt"]
+        )
+        if self.domain_map[domain]["supplement"] is not None:
+            query_prompt += f"\n{self.domain_map[domain]['supplement']}"
+        return query_prompt
+
+    def _handle_response(
+        self,
+        domain: str,
+        query_prompt: str,
+        response_object: RESPONSE_TYPE,
+        query_response: str | None = None,
+    ) -> str:
+        """Handles the debug logging and output writing for a query response.
+
+        Parameters
+        ----------
+        domain : str
+            The domain the response is for.
+        query_prompt : str
+            The query prompt that produced the response.
+        response_object : RESPONSE_TYPE
+            The response returned by the query engine.
+        query_response : str or None (default: None)
+            The response text if already consumed from a streaming response,
+            otherwise taken from the response object.
+
+        Returns
+        -------
+        str
+            The generated domain, after any repairs.
+        """
+        if query_response is None:
+            query_response = str(response_object)
+        self._display_response_sources(domain, query_prompt, response_object)
+        query_response = self._process_output(domain, query_response)
+        self._write_ledger(domain)
+        return query_response
+
+    async def _ahandle_response(
+        self,
+        domain: str,
+        query_prompt: str,
+        response_object: RESPONSE_TYPE,
+    ) -> str:
+        """Async version of bcorag._handle_response(), the repair calls don't
+        block the event loop.
+
+        Parameters
+        ----------
+        domain : str
+            The domain the response is for.
+        query_prompt : str
+            The query prompt that produced the response.
+        response_object : RESPONSE_TYPE
+            The response returned by the query engine.
+
+        Returns
+        -------
+        str
+            The generated domain, after any repairs.
+        """
+        self._display_response_sources(domain, query_prompt, response_object)
+        query_response = await self._aprocess_output(domain, str(response_object))
+        self._write_ledger(domain)
+        return query_response
+
+    def _display_response_sources(
+        self, domain: str, query_prompt: str, response_object: RESPONSE_TYPE
+    ):
+        """If in debug mode, logs the retrieval queries, the query prompt and
+        the retrieved source nodes of a response.
+
+        Parameters
+        ----------
+        domain : str
+            The domain the response is for.
+        query_prompt : str
+            The query prompt that produced the response.
+        response_object : RESPONSE_TYPE
+            The response returned by the query engine.
+        """
         if self.debug:
+            self._display_info(
+                self.domain_map[domain]["retrieval"],
+                f"RETRIEVAL QUERIES for the {domain} domain:",
+            )
             self._display_info(query_prompt, f"QUERY PROMPT for the {domain} domain:")
-            self.token_counts["input"] += self.token_counter.prompt_llm_token_count  # type: ignore
-            self.token_counts["output"] += self.token_counter.completion_llm_token_count  # type: ignore
-            self.token_counts["total"] += self.token_counter.total_llm_token_count  # type: ignore
-            self.token_counts["embedding"] += self.token_counter.total_embedding_token_count  # type: ignore
-            self._display_info(self.token_counts, "Updated token counts:")
-            if type(response_object) == Response:
+            if isinstance(response_object, (Response, StreamingResponse)):
                 source_str = ""
+                if domain in self.merge_reports:
+                    merge_report = self.merge_reports[domain]
+                    source_str += (
+                        f"\nRetrieved {merge_report['retrieved_nodes']} node(s) "
+                        f"({merge_report['retrieved_tokens']} tokens), merged into "
+                        f"{merge_report['merged_nodes']} node(s) "
+                        f"({merge_report['merged_tokens']} tokens).\n"
+                    )
                 for idx, source_node in enumerate(response_object.source_nodes):
                     source_str += f"\n--------------- Source Node '{idx + 1}/{len(response_object.source_nodes)}' ---------------"
                     source_str += f"\nNode ID: '{source_node.node.node_id}'"
@@ -295,13 +1271,25 @@ class BcoRag:
                     source_str += "\n"
                 self._display_info(source_str, "Retrieval source(s):")
 
-        self._process_output(domain, query_response)
+    def _write_ledger(self, domain: str):
+        """Writes out the ledger after a domain and, if in debug mode, logs the
+        token usage.
 
-        return query_response
+        Parameters
+        ----------
+        domain : str
+            The domain that completed.
+        """
+        self.ledger.write(self.ledger_path)
+        if self.debug:
+            self._display_info(
+                self.ledger.totals(domain), f"Token usage for the {domain} domain:"
+            )
+            self._display_info(self.ledger.totals(), "Total token usage:")
 
     def choose_domain(
         self, automatic_query: bool = False
-    ) -> tuple[str, str] | str | None:
+    ) -> tuple[str, str | dict[str, str]] | str | None:
         """Gets the user input for the domain the user wants to generate.
 
         Parameters
@@ -312,17 +1300,19 @@ class BcoRag:
 
         Returns
         -------
-        (str, str), str or None
+        (str, str or dict[str, str]), str or None
             If automatic query is set to True will return a tuple containing the domain
-            name and the query response. If automatic query is False will return the user
-            chosen domain. None is returned if the user chooses to exit.
+            name and the query response (or a mapping of each domain to its response if
+            the user chose "all"). If automatic query is False will return the user
+            chosen domain ("all" for every domain). None is returned if the user chooses
+            to exit.
         """
         domain_prompt = (
             "Which domain would you like to generate? Supported domains are:"
         )
         for domain in self.domain_map.keys():
             domain_prompt += f"\n\t{self.domain_map[domain]['user_prompt']}"
-        domain_prompt += "\n\tE[x]it\n"
+        domain_prompt += "\n\t[a]ll\n\tE[x]it\n"
         print(domain_prompt)
         domain_selection = None
         while True:
@@ -335,6 +1325,9 @@ class BcoRag:
                     domain_selection = domain
                     break
             else:
+                if domain_selection == "all" or domain_selection == "a":
+                    domain_selection = "all"
+                    break
                 if domain_selection == "exit" or domain_selection == "x":
                     if self.debug:
                         self._display_info(
@@ -356,6 +1349,8 @@ class BcoRag:
                 self._display_info(
                     f"Automatic query called on domain: '{domain_selection}'."
                 )
+            if domain_selection == "all":
+                return domain_selection, self.generate_domains()
             return domain_selection, self.perform_query(domain_selection)
         if self.debug:
             self._display_info(
@@ -363,8 +1358,139 @@ class BcoRag:
             )
         return domain_selection
 
-    def _process_output(self, domain: str, response: str):
-        """Attempts to serialize the response into a JSON object and dumps the raw text.
+    @contextmanager
+    def _timed(self, stage: str, domain: str | None = None, **attributes):
+        """Context manager that runs the block in a trace span and adds the wall
+        clock time spent in the block to the stage timings.
+
+        Parameters
+        ----------
+        stage : str
+            The stage name.
+        domain : str or None (default: None)
+            The domain the stage is for, domain stages are timed under
+            `{domain}_{stage}`.
+        **attributes
+            The initial span attributes.
+
+        Yields
+        ------
+        Span
+            The trace span for the stage.
+        """
+        timing_key = stage if domain is None else f"{domain}_{stage}"
+        if domain is not None:
+            attributes["domain"] = domain
+        start = time.perf_counter()
+        try:
+            with self.tracer.span(stage, **attributes) as span:
+                yield span
+        finally:
+            self.timings[timing_key] = self.timings.get(timing_key, 0.0) + (
+                time.perf_counter() - start
+            )
+
+    def _index_cache_key(self, user_selections: dict) -> str:
+        """Builds the index cache key. The key covers everything that changes the
+        resulting index: the paper content, the data loader, the chunking strategy,
+        the embedding model, the vector store (and the IVF build parameters) and
+        the supplementary repository (down to each repository's head commit and
+        the file filtering policy).
+
+        Parameters
+        ----------
+        user_selections : dict[str, str | int]
+            The user configuration selections.
+
+        Returns
+        -------
+        str
+            The hex digest cache key.
+        """
+        key_data = {
+            "paper": misc_fns.hash_file(user_selections["filepath"]),
+            "loader": user_selections["loader"],
+            "chunking_config": user_selections["chunking_config"],
+            "embedding_model": user_selections["embedding_model"],
+            "embedding_class": self.embed_model.class_name(),
+            "vector_store": user_selections["vector_store"],
+            "git_data": user_selections["git_data"],
+            "git_branch": GIT_BRANCH,
+            "git_commits": self.git_commits,
+            "repo_filter": (
+                self.github_loaders[0].repo_filter.policy
+                if self.github_loaders
+                else None
+            ),
+        }
+        if user_selections["vector_store"] == "IvfVectorStore":
+            key_data["ivf"] = _ivf_build_params()
+        return misc_fns.hash_data(key_data)
+
+    def _corpus_cache_key(self, user_selections: dict) -> str:
+        """Builds the corpus index key. The key covers everything that changes
+        how any paper or repository is indexed: the data loader, the chunking
+        strategy, the embedding model and the vector store (and the IVF build
+        parameters). The papers and repository versions in the corpus are
+        tracked by its manifest.
+
+        Parameters
+        ----------
+        user_selections : dict[str, str | int]
+            The user configuration selections.
+
+        Returns
+        -------
+        str
+            The hex digest key.
+        """
+        key_data = {
+            "loader": user_selections["loader"],
+            "chunking_config": user_selections["chunking_config"],
+            "embedding_model": user_selections["embedding_model"],
+            "embedding_class": self.embed_model.class_name(),
+            "vector_store": user_selections["vector_store"],
+            "git_branch": GIT_BRANCH,
+        }
+        if user_selections["vector_store"] == "IvfVectorStore":
+            key_data["ivf"] = _ivf_build_params()
+        return misc_fns.hash_data(key_data)
+
+    def _process_output(self, domain: str, response: str) -> str:
+        """Validates the response against the domain schema and, if it fails,
+        makes a short repair call with only the broken JSON and the validation
+        errors (up to the max repair attempts). The final response is dumped to
+        the txt file and, if it serializes, to the JSON file.
+
+        Parameters
+        ----------
+        domain : str
+            The domain the response is for.
+        response : str
+            The generated response to dump.
+
+        Returns
+        -------
+        str
+            The final response, after any repairs.
+        """
+        response = _strip_fences(response)
+        self._display_info(response, f"QUERY RESPONSE for the '{domain}' domain:")
+        validator = self.domain_map[domain]["validator"]
+        errors = validation_errors(validator, response)
+        repair_attempts = 0
+        while errors and repair_attempts < self.max_repair_attempts:
+            repair_attempts += 1
+            repair_prompt = self._repair_prompt(domain, response, errors, repair_attempts)
+            with self._timed("repair", domain, attempt=repair_attempts):
+                response = _strip_fences(self.llm.complete(repair_prompt).text)
+            errors = validation_errors(validator, response)
+        self._write_output(domain, response, errors, repair_attempts)
+        return response
+
+    async def _aprocess_output(self, domain: str, response: str) -> str:
+        """Async version of bcorag._process_output(), the repair calls are
+        awaited.
 
         Parameters
         ----------
@@ -372,17 +1498,97 @@ class BcoRag:
             The domain the response is for.
         response : str
             The generated response to dump.
+
+        Returns
+        -------
+        str
+            The final response, after any repairs.
+        """
+        response = _strip_fences(response)
+        self._display_info(response, f"QUERY RESPONSE for the '{domain}' domain:")
+        validator = self.domain_map[domain]["validator"]
+        errors = validation_errors(validator, response)
+        repair_attempts = 0
+        while errors and repair_attempts < self.max_repair_attempts:
+            repair_attempts += 1
+            repair_prompt = self._repair_prompt(domain, response, errors, repair_attempts)
+            with self._timed("repair", domain, attempt=repair_attempts):
+                response = _strip_fences((await self.llm.acomplete(repair_prompt)).text)
+            errors = validation_errors(validator, response)
+        self._write_output(domain, response, errors, repair_attempts)
+        return response
+
+    def _repair_prompt(
+        self, domain: str, response: str, errors: list[str], repair_attempt: int
+    ) -> str:
+        """Logs a failed validation and builds the repair prompt.
+
+        Parameters
+        ----------
+        domain : str
+            The domain the response is for.
+        response : str
+            The response that failed validation.
+        errors : list[str]
+            The validation errors.
+        repair_attempt : int
+            The repair attempt number, starting at 1.
+
+        Returns
+        -------
+        str
+            The repair prompt.
+        """
+        self.logger.info(
+            f"Response for the '{domain}' domain failed validation, repair attempt {repair_attempt}/{self.max_repair_attempts}."
+        )
+        self._display_info("\n".join(errors), "Validation errors:")
+        return REPAIR_PROMPT.format(domain, "\n".join(errors), response)
+
+    def _write_output(
+        self, domain: str, response: str, errors: list[str], repair_attempts: int
+    ):
+        """Records the validation outcome, dumps the raw text and attempts to
+        serialize the response into a JSON object.
+
+        Parameters
+        ----------
+        domain : str
+            The domain the response is for.
+        response : str
+            The final response.
+        errors : list[str]
+            The validation errors of the final response.
+        repair_attempts : int
+            The number of repair calls made.
         """
         txt_file = f"{self.output_path}{domain}_domain.txt"
         json_file = f"{self.output_path}{domain}_domain.json"
-        if response.startswith("```json\n"):
-            response = response.replace("```json\n", "").replace("```", "")
-        self._display_info(response, f"QUERY RESPONSE for the '{domain}' domain:")
-        with open(txt_file, "w") as f:
-            f.write(response)
+        with self._timed("write", domain):
+            with open(txt_file, "w") as f:
+                f.write(response)
+
+        self.validation_results[domain] = {
+            "valid": not errors,
+            "repair_attempts": repair_attempts,
+            "errors": errors,
+        }
+        annotate(valid=not errors, repair_attempts=repair_attempts)
+        if errors:
+            self.logger.error(
+                f"Response for the '{domain}' domain failed schema validation after {repair_attempts} repair attempt(s).\n"
+                + "\n".join(errors)
+            )
+        else:
+            self.logger.info(
+                f"Response for the '{domain}' domain passed schema validation after {repair_attempts} repair attempt(s)."
+            )
+
         try:
             response_json = json.loads(response)
-            if misc_fns.write_json(json_file, response_json):
+            with self._timed("write", domain):
+                json_written = misc_fns.write_json(json_file, response_json)
+            if json_written:
                 self.logger.info(
                     f"Successfully serialized JSON response for the '{domain}' domain."
                 )
@@ -405,6 +1611,9 @@ class BcoRag:
         if isinstance(info, dict):
             for key, value in info.items():
                 log_str += f"\n\t{key}: '{value}'"
+        elif isinstance(info, list):
+            for item in info:
+                log_str += f"\n\t{item}"
         elif isinstance(info, str):
             log_str += f"{info}" if header is None else f"\n{info}"
         self.logger.info(log_str)
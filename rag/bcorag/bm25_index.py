@@ -0,0 +1,395 @@
+""" Sparse BM25 index over the node text, built alongside the vector index.
+
+Dense retrieval is weak on exact identifiers (tool names, versions, accession
+numbers, file names), so the tokenizer keeps identifiers whole (`samtools-1.9`,
+`gse12345`, `reads.fastq.gz`) while also indexing their alphanumeric parts, and
+applies no stemming.
+
+The index is held as a document-term matrix in compressed sparse row form (the
+term IDs and term frequencies of each node, concatenated) and persisted to
+`bm25_index.npz` next to the vector index. The term-document postings used for
+scoring are derived from it on the first search after a change.
+"""
+
+import json
+import math
+import os
+from collections import Counter
+import re
+from typing import Any, Iterable
+import numpy as np
+from llama_index.core import VectorStoreIndex
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.vector_stores.simple import _build_metadata_filter_fn
+from llama_index.core.vector_stores.types import MetadataFilters
+from bcorag.numpy_vector_store import top_k
+
+BM25_FNAME = "bm25_index.npz"
+# BM25 term frequency saturation and document length normalization
+DEFAULT_K1 = 1.5
+DEFAULT_B = 0.75
+# node metadata kept for the metadata filters (the corpus pre-filter keys)
+FILTER_METADATA_KEYS = ("paper_id", "repo")
+# identifiers are runs of alphanumerics joined by . _ - : / (e.g. `v2.0.1`)
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[._\-:/][a-z0-9]+)*")
+_PART_PATTERN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in into is it its of on or "
+    "that the their then there these this to was were which with".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """Splits text into BM25 terms. Compound identifiers are kept whole and
+    their alphanumeric parts are added as terms of their own.
+
+    Parameters
+    ----------
+    text : str
+        The text to tokenize.
+
+    Returns
+    -------
+    list[str]
+        The terms.
+    """
+    terms = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        terms.append(token)
+        parts = _PART_PATTERN.findall(token)
+        if len(parts) > 1:
+            terms += [part for part in parts if part not in _STOPWORDS]
+    return terms
+
+
+class BM25Index:
+    """BM25 index supporting incremental additions and deletions."""
+
+    def __init__(self, k1: float = DEFAULT_K1, b: float = DEFAULT_B):
+        """Constructor.
+
+        Parameters
+        ----------
+        k1 : float (default: DEFAULT_K1)
+            The term frequency saturation.
+        b : float (default: DEFAULT_B)
+            The document length normalization.
+
+        Attributes
+        ----------
+        node_ids : list[str]
+            The node ID of each row.
+        metadata : list[dict]
+            The filter metadata of each row.
+        """
+        self.k1 = k1
+        self.b = b
+        self.node_ids: list[str] = []
+        self.metadata: list[dict[str, Any]] = []
+        self._vocabulary: dict[str, int] = {}
+        # the terms of row i are term_ids[doc_ptr[i] : doc_ptr[i + 1]]
+        self._doc_ptr = np.zeros(1, dtype=np.int64)
+        self._term_ids = np.zeros(0, dtype=np.int32)
+        self._tfs = np.zeros(0, dtype=np.float32)
+        self._doc_lengths = np.zeros(0, dtype=np.float32)
+        self._changed()
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    @classmethod
+    def from_nodes(
+        cls, nodes: Iterable[BaseNode], k1: float = DEFAULT_K1, b: float = DEFAULT_B
+    ) -> "BM25Index":
+        """Builds an index over nodes.
+
+        Parameters
+        ----------
+        nodes : Iterable[BaseNode]
+            The nodes.
+        k1 : float (default: DEFAULT_K1)
+            The term frequency saturation.
+        b : float (default: DEFAULT_B)
+            The document length normalization.
+
+        Returns
+        -------
+        BM25Index
+            The index.
+        """
+        index = cls(k1=k1, b=b)
+        index.add(list(nodes))
+        return index
+
+    @classmethod
+    def for_index(
+        cls,
+        index: VectorStoreIndex,
+        persist_dir: str,
+        k1: float = DEFAULT_K1,
+        b: float = DEFAULT_B,
+    ) -> "BM25Index":
+        """Loads the BM25 index persisted in a vector index's directory and
+        brings it in line with the vector index's nodes, indexing missing nodes
+        (from the docstore) and dropping removed ones. Persists it if anything
+        changed (or nothing was persisted yet).
+
+        Parameters
+        ----------
+        index : VectorStoreIndex
+            The vector index.
+        persist_dir : str
+            The directory the vector index is persisted to.
+        k1 : float (default: DEFAULT_K1)
+            The term frequency saturation.
+        b : float (default: DEFAULT_B)
+            The document length normalization.
+
+        Returns
+        -------
+        BM25Index
+            The index.
+        """
+        persist_path = os.path.join(persist_dir, BM25_FNAME)
+        if os.path.isfile(persist_path):
+            bm25 = cls.from_persist_path(persist_path, k1=k1, b=b)
+        else:
+            bm25 = cls(k1=k1, b=b)
+        indexed = set(bm25.node_ids)
+        node_ids = set(index.index_struct.nodes_dict.values())  # type: ignore
+        missing = [node_id for node_id in node_ids if node_id not in indexed]
+        removed = indexed - node_ids
+        if removed:
+            bm25.delete(removed)
+        if missing:
+            bm25.add(index.docstore.get_nodes(missing))
+        if removed or missing or not os.path.isfile(persist_path):
+            bm25.persist(persist_path)
+        return bm25
+
+    def add(self, nodes: list[BaseNode]):
+        """Indexes the nodes' LLM facing content (text and metadata). Nodes
+        already in the index are replaced.
+
+        Parameters
+        ----------
+        nodes : list[BaseNode]
+            The nodes.
+        """
+        if not nodes:
+            return
+        replaced = self._rows.keys() & {node.node_id for node in nodes}
+        if replaced:
+            self.delete(replaced)
+        term_ids: list[int] = []
+        tfs: list[int] = []
+        doc_sizes: list[int] = []
+        doc_lengths: list[int] = []
+        for node in nodes:
+            terms = tokenize(node.get_content(metadata_mode=MetadataMode.LLM))
+            counts = Counter(terms)
+            for term, count in counts.items():
+                term_ids.append(self._vocabulary.setdefault(term, len(self._vocabulary)))
+                tfs.append(count)
+            doc_sizes.append(len(counts))
+            doc_lengths.append(len(terms))
+            self.node_ids.append(node.node_id)
+            self.metadata.append(
+                {
+                    key: node.metadata[key]
+                    for key in FILTER_METADATA_KEYS
+                    if key in node.metadata
+                }
+            )
+        self._doc_ptr = np.concatenate(
+            [self._doc_ptr, self._doc_ptr[-1] + np.cumsum(doc_sizes, dtype=np.int64)]
+        )
+        self._term_ids = np.concatenate(
+            [self._term_ids, np.asarray(term_ids, dtype=np.int32)]
+        )
+        self._tfs = np.concatenate([self._tfs, np.asarray(tfs, dtype=np.float32)])
+        self._doc_lengths = np.concatenate(
+            [self._doc_lengths, np.asarray(doc_lengths, dtype=np.float32)]
+        )
+        self._changed()
+
+    def delete(self, node_ids: Iterable[str]):
+        """Removes nodes from the index.
+
+        Parameters
+        ----------
+        node_ids : Iterable[str]
+            The IDs of the nodes to remove, unknown IDs are ignored.
+        """
+        rows = [self._rows[node_id] for node_id in node_ids if node_id in self._rows]
+        if not rows:
+            return
+        keep = np.ones(len(self.node_ids), dtype=bool)
+        keep[rows] = False
+        doc_sizes = np.diff(self._doc_ptr)
+        entries = np.repeat(keep, doc_sizes)
+        self._term_ids = self._term_ids[entries]
+        self._tfs = self._tfs[entries]
+        self._doc_ptr = np.concatenate([[0], np.cumsum(doc_sizes[keep])])
+        self._doc_lengths = self._doc_lengths[keep]
+        kept_rows = np.flatnonzero(keep)
+        self.node_ids = [self.node_ids[row] for row in kept_rows]
+        self.metadata = [self.metadata[row] for row in kept_rows]
+        self._changed()
+
+    def search(
+        self, query: str, k: int, filters: MetadataFilters | None = None
+    ) -> list[tuple[str, float]]:
+        """Scores the nodes against a query with BM25.
+
+        Parameters
+        ----------
+        query : str
+            The query text.
+        k : int
+            The max number of nodes to return.
+        filters : MetadataFilters or None (default: None)
+            Restricts the search to the nodes matching the filters.
+
+        Returns
+        -------
+        list[tuple[str, float]]
+            The IDs and scores of the top k nodes sharing a term with the query,
+            highest scoring first.
+        """
+        if not self.node_ids:
+            return []
+        post_docs, post_tfs, bounds = self._term_postings()
+        doc_count = len(self.node_ids)
+        length_norm = self.k1 * (
+            1 - self.b + self.b * self._doc_lengths / max(self._doc_lengths.mean(), 1.0)
+        )
+        scores = np.zeros(doc_count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self._vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = bounds[term_id], bounds[term_id + 1]
+            if start == end:
+                continue
+            docs = post_docs[start:end]
+            tfs = post_tfs[start:end]
+            idf = math.log(1 + (doc_count - (end - start) + 0.5) / (end - start + 0.5))
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + length_norm[docs])
+        rows = np.flatnonzero(scores)
+        if filters is not None and filters.filters:
+            rows = rows[np.isin(rows, self._filter_rows(filters), assume_unique=True)]
+        top_rows, top_scores = top_k(scores[rows], k)
+        return [
+            (self.node_ids[row], float(score))
+            for row, score in zip(rows[top_rows], top_scores)
+        ]
+
+    def persist(self, persist_path: str):
+        """Persists the index.
+
+        Parameters
+        ----------
+        persist_path : str
+            The `.npz` file path.
+        """
+        vocabulary = sorted(self._vocabulary, key=self._vocabulary.__getitem__)
+        tmp_path = f"{persist_path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            node_ids=np.asarray(self.node_ids, dtype=str),
+            metadata=np.asarray(json.dumps(self.metadata)),
+            vocabulary=np.asarray(vocabulary, dtype=str),
+            doc_ptr=self._doc_ptr,
+            term_ids=self._term_ids,
+            tfs=self._tfs,
+            doc_lengths=self._doc_lengths,
+        )
+        os.replace(tmp_path, persist_path)
+
+    @classmethod
+    def from_persist_path(
+        cls, persist_path: str, k1: float = DEFAULT_K1, b: float = DEFAULT_B
+    ) -> "BM25Index":
+        """Loads a persisted index.
+
+        Parameters
+        ----------
+        persist_path : str
+            The `.npz` file path.
+        k1 : float (default: DEFAULT_K1)
+            The term frequency saturation.
+        b : float (default: DEFAULT_B)
+            The document length normalization.
+
+        Returns
+        -------
+        BM25Index
+            The loaded index.
+        """
+        index = cls(k1=k1, b=b)
+        with np.load(persist_path) as data:
+            index.node_ids = data["node_ids"].tolist()
+            index.metadata = json.loads(str(data["metadata"]))
+            index._vocabulary = {
+                term: term_id for term_id, term in enumerate(data["vocabulary"].tolist())
+            }
+            index._doc_ptr = data["doc_ptr"]
+            index._term_ids = data["term_ids"]
+            index._tfs = data["tfs"]
+            index._doc_lengths = data["doc_lengths"]
+        index._changed()
+        return index
+
+    def _term_postings(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Builds (or returns the cached) term-document postings.
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray, np.ndarray]
+            The rows and term frequencies grouped by term, and the bounds of
+            each term's group (the postings of term i are at
+            `bounds[i] : bounds[i + 1]`).
+        """
+        if self._postings is None:
+            order = np.argsort(self._term_ids, kind="stable")
+            entry_rows = np.repeat(
+                np.arange(len(self.node_ids)), np.diff(self._doc_ptr)
+            )
+            bounds = np.searchsorted(
+                self._term_ids[order], np.arange(len(self._vocabulary) + 1)
+            )
+            self._postings = (entry_rows[order], self._tfs[order], bounds)
+        return self._postings
+
+    def _filter_rows(self, filters: MetadataFilters) -> np.ndarray:
+        """Finds (or returns the cached) rows matching metadata filters.
+
+        Parameters
+        ----------
+        filters : MetadataFilters
+            The metadata filters.
+
+        Returns
+        -------
+        np.ndarray
+            The matching rows, in ascending order.
+        """
+        key = filters.json()
+        if key not in self._filter_cache:
+            filter_fn = _build_metadata_filter_fn(
+                lambda node_id: self.metadata[self._rows[node_id]], filters
+            )
+            self._filter_cache[key] = np.asarray(
+                [row for row, node_id in enumerate(self.node_ids) if filter_fn(node_id)],
+                dtype=np.int64,
+            )
+        return self._filter_cache[key]
+
+    def _changed(self):
+        """Resets the derived state after the rows change."""
+        self._rows = {node_id: row for row, node_id in enumerate(self.node_ids)}
+        self._postings: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None
+        self._filter_cache: dict[str, np.ndarray] = {}
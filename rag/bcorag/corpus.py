@@ -0,0 +1,360 @@
+""" Shared corpus index. With the `corpus` index scope every paper and
+supplementary repository is indexed once into a single persistent index (per
+data loader, chunking strategy, embedding model and vector store), instead of
+one private index per paper. Each node is tagged with the source it came from
+and the queries for a paper are pre-filtered down to the paper's own nodes and
+the nodes of its repositories before the similarity search.
+
+The manifest next to the persisted index records what has been indexed:
+
+- `papers`: Keyed by the paper's content hash (the `paper_id` node metadata).
+- `repos`: Keyed by the `owner/repo` name (the `repo` node metadata), with the
+  key of the indexed version (head commit and file filter policy) and the IDs
+  of its nodes. When a repository moves to a new commit its old nodes are
+  replaced.
+- `segments`: The files holding the nodes (with their embeddings) added since
+  the index was last persisted in full, replayed on top of it when loading.
+
+Updates are serialized across processes with a lock file, so batch workers can
+share the corpus. An update only writes its own nodes to a new segment, the
+whole index is persisted again (and the segments dropped) once the segments
+hold as many nodes as the persisted index, or when a repository version is
+replaced, so the total write cost stays linear in the corpus size.
+"""
+
+import logging
+import os
+from contextlib import contextmanager
+from typing import Callable, Iterator
+from llama_index.core import StorageContext, VectorStoreIndex, load_index_from_storage
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+from llama_index.core.vector_stores.types import (
+    FilterCondition,
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+)
+import bcorag.misc_functions as misc_fns
+
+MANIFEST_FNAME = "corpus_manifest.json"
+LOCK_FNAME = ".lock"
+SEGMENT_DIR = "segments"
+# the source tag of paper and repository nodes
+PAPER_SOURCE = "paper"
+GITHUB_SOURCE = "github"
+# corpus metadata hidden from the embedding and LLM content, so nodes embed
+# (and read) the same in the corpus as in a per paper index
+CORPUS_METADATA_KEYS = ["paper_id", "source"]
+
+
+class CorpusIndex:
+    """Shared, persistent index over every paper and repository."""
+
+    def __init__(
+        self,
+        persist_dir: str,
+        storage_context_fn: Callable[[str | None], StorageContext],
+    ):
+        """Constructor, loads the persisted corpus index (or creates an empty
+        one).
+
+        Parameters
+        ----------
+        persist_dir : str
+            The directory the corpus index and manifest are persisted to.
+        storage_context_fn : Callable[[str | None], StorageContext]
+            Creates the storage context for the selected vector store, loading
+            the index persisted in the given directory or, for None, a new one.
+
+        Attributes
+        ----------
+        manifest : dict
+            The indexed papers and repositories.
+        index : VectorStoreIndex
+            The corpus index.
+        """
+        self.persist_dir = persist_dir
+        self.storage_context_fn = storage_context_fn
+        self.logger = logging.getLogger("bcorag")
+        # the persisted generation and segment count the index is in sync with
+        self._loaded: tuple[int, int] | None = None
+        os.makedirs(os.path.join(self.persist_dir, SEGMENT_DIR), exist_ok=True)
+        with self._locked():
+            self._load()
+
+    @property
+    def node_count(self) -> int:
+        """The number of nodes in the corpus."""
+        return len(self.index.index_struct.nodes_dict)  # type: ignore
+
+    def has_paper(self, paper_id: str) -> bool:
+        """Checks whether a paper is indexed.
+
+        Parameters
+        ----------
+        paper_id : str
+            The paper's content hash.
+
+        Returns
+        -------
+        bool
+            Whether the paper is in the corpus.
+        """
+        return paper_id in self.manifest["papers"]
+
+    def has_repo(self, name: str, version_key: str) -> bool:
+        """Checks whether a repository version is indexed.
+
+        Parameters
+        ----------
+        name : str
+            The `owner/repo` name.
+        version_key : str
+            The key of the repository version (head commit and file filter
+            policy).
+
+        Returns
+        -------
+        bool
+            Whether this version of the repository is in the corpus.
+        """
+        entry = self.manifest["repos"].get(name)
+        return entry is not None and entry["version_key"] == version_key
+
+    def update(
+        self,
+        papers: dict[str, tuple[str, list[BaseNode]]],
+        repos: dict[str, tuple[str, list[BaseNode]]],
+    ):
+        """Adds papers and repository versions to the corpus and persists it.
+        The corpus is brought up to date under the lock first, so sources
+        indexed by another process in the meantime are kept (and not added
+        twice).
+
+        Parameters
+        ----------
+        papers : dict[str, tuple[str, list[BaseNode]]]
+            The file name and embedded nodes of each paper, keyed by paper ID.
+        repos : dict[str, tuple[str, list[BaseNode]]]
+            The version key and embedded nodes of each repository, keyed by
+            `owner/repo` name. Any other indexed version of a repository is
+            replaced.
+        """
+        with self._locked():
+            self._load()
+            # the in memory index runs ahead of the persisted one until the
+            # manifest is written
+            self._loaded = None
+            replaced = False
+            new_nodes: list[BaseNode] = []
+            for paper_id, (file_name, nodes) in papers.items():
+                if self.has_paper(paper_id):
+                    continue
+                tag_nodes(nodes, paper_id=paper_id, source=PAPER_SOURCE)
+                new_nodes += nodes
+                self.manifest["papers"][paper_id] = {
+                    "file_name": file_name,
+                    "node_count": len(nodes),
+                }
+            for name, (version_key, nodes) in repos.items():
+                if self.has_repo(name, version_key):
+                    continue
+                if name in self.manifest["repos"]:
+                    self._remove_repo(name)
+                    replaced = True
+                tag_nodes(nodes, source=GITHUB_SOURCE)
+                new_nodes += nodes
+                self.manifest["repos"][name] = {
+                    "version_key": version_key,
+                    "node_ids": [node.node_id for node in nodes],
+                    "ref_doc_ids": sorted(
+                        {node.ref_doc_id for node in nodes if node.ref_doc_id}
+                    ),
+                }
+            if not new_nodes:
+                self._loaded = (
+                    self.manifest["generation"],
+                    len(self.manifest["segments"]),
+                )
+                return
+            self.index.insert_nodes(new_nodes)
+            stale_segments: list[str] = []
+            if (
+                replaced
+                or self.node_count >= 2 * self.manifest["persisted_node_count"]
+                or not self._write_segment(new_nodes)
+            ):
+                self.index.storage_context.persist(persist_dir=self.persist_dir)
+                stale_segments = self.manifest["segments"]
+                self.manifest["generation"] += 1
+                self.manifest["persisted_node_count"] = self.node_count
+                self.manifest["segments"] = []
+            # the manifest is written last, an interrupted update is redone
+            misc_fns.write_json(
+                os.path.join(self.persist_dir, MANIFEST_FNAME), self.manifest
+            )
+            self._loaded = (self.manifest["generation"], len(self.manifest["segments"]))
+            for fname in stale_segments:
+                os.remove(os.path.join(self.persist_dir, SEGMENT_DIR, fname))
+        self.logger.info(
+            f"Corpus index at `{self.persist_dir}` updated with {len(new_nodes)} nodes "
+            f"({self.node_count} nodes, {len(self.manifest['papers'])} papers, "
+            f"{len(self.manifest['repos'])} repos)."
+        )
+
+    def _remove_repo(self, name: str):
+        """Removes the indexed version of a repository.
+
+        Parameters
+        ----------
+        name : str
+            The `owner/repo` name.
+        """
+        entry = self.manifest["repos"].pop(name)
+        vector_store = self.index.vector_store
+        try:
+            # one pass over the vector store rather than one per document
+            vector_store.delete_nodes(entry["node_ids"])
+        except NotImplementedError:
+            pass
+        for ref_doc_id in entry["ref_doc_ids"]:
+            self.index.delete_ref_doc(ref_doc_id, delete_from_docstore=True)
+        self.logger.info(
+            f"Removed {len(entry['node_ids'])} nodes of the previous version of repo `{name}` from the corpus."
+        )
+
+    def _write_segment(self, nodes: list[BaseNode]) -> bool:
+        """Writes the nodes added by an update to a new segment and lists it
+        in the manifest.
+
+        Parameters
+        ----------
+        nodes : list[BaseNode]
+            The embedded nodes.
+
+        Returns
+        -------
+        bool
+            Whether the segment was written.
+        """
+        fname = f"{self.manifest['generation']}_{len(self.manifest['segments'])}.json"
+        if not misc_fns.write_json(
+            os.path.join(self.persist_dir, SEGMENT_DIR, fname),
+            [doc_to_json(node) for node in nodes],
+        ):
+            return False
+        self.manifest["segments"].append(fname)
+        return True
+
+    def _load(self):
+        """Brings the corpus up to date with the persisted one. Only the
+        segments written since the last load are replayed, unless the index
+        was persisted in full in the meantime. Creates an empty corpus if
+        nothing (complete) has been persisted yet."""
+        manifest_path = os.path.join(self.persist_dir, MANIFEST_FNAME)
+        if not os.path.isfile(manifest_path):
+            self.manifest = {
+                "papers": {},
+                "repos": {},
+                "generation": 0,
+                "persisted_node_count": 0,
+                "segments": [],
+            }
+            self.index = VectorStoreIndex(
+                nodes=[], storage_context=self.storage_context_fn(None)
+            )
+            self._loaded = (0, 0)
+            return
+        manifest = misc_fns.load_json(manifest_path)
+        if "segments" not in manifest:
+            # persisted in full before the corpus was segmented
+            manifest.update(generation=0, persisted_node_count=0, segments=[])
+        if self._loaded is None or self._loaded[0] != manifest["generation"]:
+            self.index = load_index_from_storage(  # type: ignore
+                self.storage_context_fn(self.persist_dir)
+            )
+            replayed = 0
+        else:
+            replayed = self._loaded[1]
+        for fname in manifest["segments"][replayed:]:
+            segment = misc_fns.load_json(
+                os.path.join(self.persist_dir, SEGMENT_DIR, fname)
+            )
+            # an update interrupted before its manifest was written may have
+            # persisted the segment nodes in full already
+            nodes = [
+                node
+                for node in map(json_to_doc, segment)
+                if not self.index.docstore.document_exists(node.node_id)
+            ]
+            if nodes:
+                self.index.insert_nodes(nodes)
+        self.manifest = manifest
+        self._loaded = (manifest["generation"], len(manifest["segments"]))
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Holds the corpus lock file (exclusive across processes)."""
+        with open(os.path.join(self.persist_dir, LOCK_FNAME), "a+") as lock_file:
+            if os.name == "nt":
+                import msvcrt
+
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)  # type: ignore
+            else:
+                import fcntl
+
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if os.name == "nt":
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)  # type: ignore
+                else:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def tag_nodes(nodes: list[BaseNode], **metadata: str):
+    """Adds corpus metadata to nodes, hidden from the embedding and LLM
+    content.
+
+    Parameters
+    ----------
+    nodes : list[BaseNode]
+        The nodes to tag.
+    **metadata
+        The metadata to add.
+    """
+    for node in nodes:
+        node.metadata.update(metadata)
+        for key in CORPUS_METADATA_KEYS:
+            if key not in node.excluded_embed_metadata_keys:
+                node.excluded_embed_metadata_keys.append(key)
+            if key not in node.excluded_llm_metadata_keys:
+                node.excluded_llm_metadata_keys.append(key)
+
+
+def paper_filters(paper_id: str, repos: list[str]) -> MetadataFilters:
+    """Builds the pre-filter selecting a paper's nodes and the nodes of its
+    repositories.
+
+    Parameters
+    ----------
+    paper_id : str
+        The paper's content hash.
+    repos : list[str]
+        The `owner/repo` names of the paper's repositories.
+
+    Returns
+    -------
+    MetadataFilters
+        The metadata filters.
+    """
+    filters = [MetadataFilter(key="paper_id", value=paper_id)]
+    if repos:
+        filters.append(
+            MetadataFilter(key="repo", operator=FilterOperator.IN, value=repos)
+        )
+    return MetadataFilters(filters=filters, condition=FilterCondition.OR)
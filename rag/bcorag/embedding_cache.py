@@ -0,0 +1,426 @@
+""" Content addressed, disk backed cache for text embeddings.
+
+Embeddings are keyed by a hash of the exact text embedded and stored per
+embedding model, so a text (a sentence group for the semantic chunking, a node,
+or a domain retrieval query) is only ever embedded once per model. Each batch
+of new embeddings is written as its own shard, so processes sharing the cache
+directory never write to the same file. A shard is an `.npy` file of embeddings with a `.keys.npy`
+file of the text keys next to it. Only the key files are read to build the
+index, the embeddings are memory mapped and only the rows looked up are read.
+Once enough small shards pile up they are compacted into one.
+"""
+
+import logging
+import os
+import uuid
+from typing import Sequence
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+import bcorag.misc_functions as misc_fns
+
+# default byte budget for the on-disk embedding cache, per model (512 MiB)
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# the OpenAI embeddings endpoint accepts at most 2048 inputs per request
+MAX_EMBED_BATCH_SIZE = 2048
+# cap on the characters per request, keeping batches of long texts well under
+# the per request token limit
+MAX_EMBED_BATCH_CHARS = 600_000
+# shards smaller than this are compacted once there are COMPACT_MIN_SHARDS of
+# them (4 MiB)
+COMPACT_SHARD_BYTES = 4 * 1024 * 1024
+COMPACT_MIN_SHARDS = 8
+SHARD_SUFFIX = ".npy"
+KEYS_SUFFIX = ".keys.npy"
+# shards written by earlier versions, keys and embeddings in one file
+LEGACY_SHARD_SUFFIX = ".npz"
+
+
+class EmbeddingCache:
+    """Embeds texts through the cache. The key index of the model's shards is
+    loaded on the first lookup, recency is tracked through the shard
+    modification times and the least recently used shards are evicted down to
+    the byte budget.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        embed_model: BaseEmbedding,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        query: bool = False,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+        cache_dir : str
+            The root directory of the embedding cache.
+        embed_model : BaseEmbedding
+            The embedding model, each model (and model class) gets its own
+            subdirectory.
+        max_bytes : int (default: DEFAULT_MAX_BYTES)
+            The byte budget for the model's shards.
+        query : bool (default: False)
+            Whether the texts are queries, embedded with the model's query
+            embedding (some models embed queries differently from documents).
+
+        Attributes
+        ----------
+        hits : int
+            The number of texts served from the cache.
+        misses : int
+            The number of texts embedded.
+        """
+        self.embed_model = embed_model
+        self.max_bytes = max_bytes
+        self.query = query
+        self.hits = 0
+        self.misses = 0
+        model_key = {
+            "embedding_model": embed_model.model_name,
+            "embedding_class": embed_model.class_name(),
+        }
+        if query:
+            model_key["query"] = True
+        self.cache_dir = os.path.join(cache_dir, misc_fns.hash_data(model_key))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # key -> (shard path, row)
+        self._index: dict[str, tuple[str, int]] | None = None
+        # shard path -> embeddings (memory mapped), None if the shard is gone
+        self._shards: dict[str, np.ndarray | None] = {}
+
+    def embed(self, texts: Sequence[str]) -> list[list[float]]:
+        """Embeds the texts, only calling the embedding model for the texts that
+        aren't cached (each distinct text once). The uncached texts are sent in
+        batches of up to MAX_EMBED_BATCH_SIZE texts.
+
+        Parameters
+        ----------
+        texts : Sequence[str]
+            The texts to embed.
+
+        Returns
+        -------
+        list[list[float]]
+            The embedding of each text.
+        """
+        keys = [misc_fns.hash_data(text) for text in texts]
+        vectors = self._lookup(set(keys))
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            missing_keys = list(missing.keys())
+            embeddings = self._embed_batched([missing[key] for key in missing_keys])
+            matrix = np.asarray(embeddings, dtype=np.float32)
+            self._write_shard(missing_keys, matrix)
+            vectors.update(zip(missing_keys, matrix))
+        return [vectors[key].tolist() for key in keys]
+
+    def _embed_batched(self, texts: list[str]) -> list[list[float]]:
+        """Embeds the texts at the max batch size the API allows. Goes through
+        get_text_embedding_batch() so the calls are traced and metered. Queries
+        go through get_query_embedding() one at a time.
+
+        Parameters
+        ----------
+        texts : list[str]
+            The texts to embed.
+
+        Returns
+        -------
+        list[list[float]]
+            The embedding of each text.
+        """
+        if self.query:
+            return [self.embed_model.get_query_embedding(text) for text in texts]
+        batches: list[list[str]] = [[]]
+        batch_chars = 0
+        for text in texts:
+            if batches[-1] and (
+                len(batches[-1]) == MAX_EMBED_BATCH_SIZE
+                or batch_chars + len(text) > MAX_EMBED_BATCH_CHARS
+            ):
+                batches.append([])
+                batch_chars = 0
+            batches[-1].append(text)
+            batch_chars += len(text)
+        embed_batch_size = self.embed_model.embed_batch_size
+        embeddings: list[list[float]] = []
+        try:
+            for batch in batches:
+                self.embed_model.embed_batch_size = len(batch)
+                embeddings.extend(self.embed_model.get_text_embedding_batch(batch))
+        finally:
+            self.embed_model.embed_batch_size = embed_batch_size
+        return embeddings
+
+    def _lookup(self, keys: set[str]) -> dict[str, np.ndarray]:
+        """Looks up cached embeddings and marks their shards as recently used.
+        Only the rows of the keys found are read from the memory mapped shards.
+
+        Parameters
+        ----------
+        keys : set[str]
+            The text keys.
+
+        Returns
+        -------
+        dict[str, np.ndarray]
+            The cached embedding of each key found.
+        """
+        if self._index is None:
+            self._load_index()
+        found: dict[str, np.ndarray] = {}
+        used_shards = set()
+        for key in keys:
+            location = self._index.get(key)  # type: ignore
+            if location is None:
+                continue
+            shard_path, row = location
+            vectors = self._open_shard(shard_path)
+            if vectors is None:
+                continue
+            found[key] = np.array(vectors[row])
+            used_shards.add(shard_path)
+        for shard_path in used_shards:
+            try:
+                os.utime(shard_path)
+            except OSError:
+                # evicted by another process, the mapped copy is still valid
+                pass
+        return found
+
+    def _load_index(self):
+        """Builds the key index from the shard key files, the embeddings are
+        only mapped when first looked up. Shards in the legacy single file
+        format are converted first."""
+        self._index = {}
+        with os.scandir(self.cache_dir) as it:
+            legacy_paths = [
+                entry.path
+                for entry in it
+                if entry.name.endswith(LEGACY_SHARD_SUFFIX) and ".tmp" not in entry.name
+            ]
+        for legacy_path in legacy_paths:
+            self._convert_legacy_shard(legacy_path)
+        for shard_path, _, _ in self._entries():
+            try:
+                shard_keys = np.load(_keys_path(shard_path)).astype(str)
+            except FileNotFoundError:
+                # still being written or evicted by another process
+                continue
+            except (OSError, ValueError):
+                logging.getLogger("bcorag").warning(
+                    f"Skipping unreadable embedding cache shard `{shard_path}`."
+                )
+                continue
+            for row, key in enumerate(shard_keys):
+                self._index[str(key)] = (shard_path, row)
+
+    def _open_shard(self, shard_path: str) -> np.ndarray | None:
+        """Memory maps a shard's embeddings (once per shard).
+
+        Parameters
+        ----------
+        shard_path : str
+            The shard path.
+
+        Returns
+        -------
+        np.ndarray or None
+            The embeddings, None if the shard is gone or unreadable.
+        """
+        if shard_path not in self._shards:
+            try:
+                self._shards[shard_path] = np.load(shard_path, mmap_mode="r")
+            except (OSError, ValueError):
+                # evicted or compacted by another process, its texts are
+                # embedded again
+                self._shards[shard_path] = None
+        return self._shards[shard_path]
+
+    def _write_shard(self, keys: list[str], matrix: np.ndarray):
+        """Writes new embeddings as a shard, compacts the small shards and
+        evicts the least recently used shards if the byte budget is exceeded.
+
+        Parameters
+        ----------
+        keys : list[str]
+            The text keys.
+        matrix : np.ndarray
+            The embeddings, one row per key.
+        """
+        if self._save_shard(keys, matrix) is None:
+            return
+        entries = self._entries()
+        small = [entry for entry in entries if entry[2] < COMPACT_SHARD_BYTES]
+        if len(small) >= COMPACT_MIN_SHARDS:
+            self._compact([shard_path for shard_path, _, _ in small])
+            entries = self._entries()
+        if sum(size for _, _, size in entries) > self.max_bytes:
+            self._evict(entries)
+
+    def _save_shard(self, keys: list[str], matrix: np.ndarray) -> str | None:
+        """Saves a shard, the embeddings first and then the keys (a shard is
+        only indexed once its key file exists), and adds it to the index.
+
+        Parameters
+        ----------
+        keys : list[str]
+            The text keys.
+        matrix : np.ndarray
+            The embeddings, one row per key.
+
+        Returns
+        -------
+        str or None
+            The shard path, None if it couldn't be written.
+        """
+        shard_path = os.path.join(self.cache_dir, f"{uuid.uuid4().hex}{SHARD_SUFFIX}")
+        try:
+            for path, data in (
+                (shard_path, matrix),
+                (_keys_path(shard_path), np.asarray(keys, dtype=np.bytes_)),
+            ):
+                tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+                np.save(tmp_path, data)
+                os.replace(tmp_path, path)
+        except OSError as e:
+            logging.getLogger("bcorag").error(
+                f"Failed to write embedding cache shard `{shard_path}`.\n{e}"
+            )
+            _remove_shard(shard_path)
+            return None
+        self._shards[shard_path] = matrix
+        if self._index is not None:
+            for row, key in enumerate(keys):
+                self._index[key] = (shard_path, row)
+        return shard_path
+
+    def _compact(self, shard_paths: list[str]):
+        """Merges shards into one, so the shard count (and the index load
+        time) doesn't grow with every write.
+
+        Parameters
+        ----------
+        shard_paths : list[str]
+            The paths of the shards to merge.
+        """
+        keys: list[str] = []
+        matrices: list[np.ndarray] = []
+        merged_paths: list[str] = []
+        for shard_path in shard_paths:
+            try:
+                shard_keys = np.load(_keys_path(shard_path)).astype(str)
+                shard_vectors = np.load(shard_path)
+            except (OSError, ValueError):
+                # being written, or compacted or evicted by another process
+                continue
+            if len(shard_keys) != len(shard_vectors):
+                continue
+            keys += [str(key) for key in shard_keys]
+            matrices.append(shard_vectors)
+            merged_paths.append(shard_path)
+        if len(merged_paths) < 2:
+            return
+        if self._save_shard(keys, np.concatenate(matrices)) is None:
+            return
+        for shard_path in merged_paths:
+            _remove_shard(shard_path)
+            self._shards.pop(shard_path, None)
+
+    def _convert_legacy_shard(self, legacy_path: str):
+        """Converts a shard in the legacy single file format (keys and
+        embeddings in one `.npz` file, which can't be memory mapped).
+
+        Parameters
+        ----------
+        legacy_path : str
+            The legacy shard path.
+        """
+        try:
+            with np.load(legacy_path) as shard:
+                keys = [str(key) for key in shard["keys"]]
+                matrix = shard["vectors"]
+        except FileNotFoundError:
+            # converted by another process
+            return
+        except (OSError, ValueError, KeyError):
+            logging.getLogger("bcorag").warning(
+                f"Removing unreadable embedding cache shard `{legacy_path}`."
+            )
+        else:
+            if self._save_shard(keys, matrix) is None:
+                return
+        try:
+            os.remove(legacy_path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, entries: list[tuple[str, float, int]]):
+        """Evicts the least recently used shards until the cache fits within the
+        byte budget.
+
+        Parameters
+        ----------
+        entries : list[tuple[str, float, int]]
+            The path, last used time and size in bytes of each shard.
+        """
+        total_bytes = sum(size for _, _, size in entries)
+        for shard_path, _, size in sorted(entries, key=lambda entry: entry[1]):
+            if total_bytes <= self.max_bytes:
+                break
+            _remove_shard(shard_path)
+            total_bytes -= size
+
+    def _entries(self) -> list[tuple[str, float, int]]:
+        """Lists the shards.
+
+        Returns
+        -------
+        list[tuple[str, float, int]]
+            The path, last used time and size in bytes (embeddings and keys) of
+            each shard.
+        """
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if (
+                    not entry.name.endswith(SHARD_SUFFIX)
+                    or entry.name.endswith(KEYS_SUFFIX)
+                    or ".tmp" in entry.name
+                ):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                size = stat.st_size
+                try:
+                    size += os.path.getsize(_keys_path(entry.path))
+                except OSError:
+                    # key file not written yet
+                    pass
+                entries.append((entry.path, stat.st_mtime, size))
+        return entries
+
+
+def _keys_path(shard_path: str) -> str:
+    return f"{shard_path[: -len(SHARD_SUFFIX)]}{KEYS_SUFFIX}"
+
+
+def _remove_shard(shard_path: str):
+    """Removes a shard, the key file first so it is no longer indexed.
+
+    Parameters
+    ----------
+    shard_path : str
+        The shard path.
+    """
+    for path in (_keys_path(shard_path), shard_path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # already removed by another process
+            pass
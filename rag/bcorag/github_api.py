@@ -0,0 +1,188 @@
+""" Minimal async client for the Github REST API endpoints used by the
+repository loader. All requests share one pooled connection, the number of
+requests in flight is bounded, and rate limited or failed requests are retried
+with backoff.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Any
+import httpx
+
+DEFAULT_BASE_URL = "https://api.github.com"
+DEFAULT_API_VERSION = "2022-11-28"
+# default cap on the number of requests in flight at once
+DEFAULT_MAX_CONCURRENCY = 16
+# default max number of retries for a rate limited or failed request
+DEFAULT_MAX_RETRIES = 5
+# longest rate limit reset to wait for (in seconds) before giving up
+MAX_RATE_LIMIT_WAIT = 300
+
+ENDPOINTS = {
+    "getBranch": "/repos/{owner}/{repo}/branches/{branch}",
+    "getTree": "/repos/{owner}/{repo}/git/trees/{tree_sha}",
+    "getBlob": "/repos/{owner}/{repo}/git/blobs/{file_sha}",
+}
+
+
+class RateLimitError(Exception):
+    """Raised when the rate limit resets too far in the future to wait for."""
+
+
+class GithubApi:
+    """Async context manager holding the pooled HTTP client.
+
+    Example
+    -------
+        async with GithubApi(token) as api:
+            branch = await api.get("getBranch", owner=owner, repo=repo, branch="main")
+    """
+
+    def __init__(
+        self,
+        token: str | None,
+        base_url: str = DEFAULT_BASE_URL,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        timeout: float = 30.0,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+        token : str or None
+            The Github token, requests are unauthenticated if None.
+        base_url : str (default: DEFAULT_BASE_URL)
+            The API base URL.
+        max_concurrency : int (default: DEFAULT_MAX_CONCURRENCY)
+            The cap on the number of requests in flight (and pooled connections).
+        max_retries : int (default: DEFAULT_MAX_RETRIES)
+            The max number of retries for a rate limited or failed request.
+        timeout : float (default: 30.0)
+            The request timeout in seconds.
+        """
+        self.base_url = base_url
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.requests = 0
+        self.retries = 0
+        self.logger = logging.getLogger("bcorag")
+        self._headers = {
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": DEFAULT_API_VERSION,
+        }
+        if token:
+            self._headers["Authorization"] = f"Bearer {token}"
+        self._client: httpx.AsyncClient | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+
+    async def __aenter__(self) -> "GithubApi":
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self._headers,
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+            ),
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info: Any):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get(
+        self, endpoint: str, params: dict | None = None, **path_params: str
+    ) -> dict:
+        """Requests an endpoint, retrying rate limited requests once the rate
+        limit resets and server errors with exponential backoff.
+
+        Parameters
+        ----------
+        endpoint : str
+            The endpoint name (see ENDPOINTS).
+        params : dict or None (default: None)
+            The query parameters.
+        **path_params
+            The endpoint path parameters.
+
+        Returns
+        -------
+        dict
+            The deserialized response.
+        """
+        url = ENDPOINTS[endpoint].format(**path_params)
+        for attempt in range(self.max_retries + 1):
+            async with self._semaphore:  # type: ignore
+                self.requests += 1
+                try:
+                    response = await self._client.get(url, params=params)  # type: ignore
+                except httpx.TransportError as e:
+                    if attempt == self.max_retries:
+                        raise
+                    wait = _backoff(attempt)
+                    self.logger.warning(
+                        f"Github request `{url}` failed ({e!r}), retrying in {wait:.1f}s."
+                    )
+                else:
+                    wait = self._retry_wait(response, attempt)
+                    if wait is None:
+                        response.raise_for_status()
+                        return response.json()
+            self.retries += 1
+            await asyncio.sleep(wait)
+        raise AssertionError("unreachable")
+
+    def _retry_wait(self, response: httpx.Response, attempt: int) -> float | None:
+        """Works out how long to wait before retrying a response.
+
+        Parameters
+        ----------
+        response : httpx.Response
+            The response.
+        attempt : int
+            The zero indexed attempt number.
+
+        Returns
+        -------
+        float or None
+            The seconds to wait, None if the response should not be retried.
+        """
+        if attempt == self.max_retries:
+            return None
+        status = response.status_code
+        headers = response.headers
+        if status in (403, 429):
+            if "retry-after" in headers:
+                # secondary rate limit
+                wait = float(headers["retry-after"])
+            elif headers.get("x-ratelimit-remaining") == "0":
+                wait = max(float(headers.get("x-ratelimit-reset", 0)) - time.time(), 1.0)
+            else:
+                return None
+            if wait > MAX_RATE_LIMIT_WAIT:
+                raise RateLimitError(
+                    f"Github rate limit exceeded, resets in {wait:.0f}s."
+                )
+            self.logger.warning(
+                f"Github rate limit hit on `{response.url}`, retrying in {wait:.1f}s."
+            )
+            return wait
+        if status >= 500:
+            wait = _backoff(attempt)
+            self.logger.warning(
+                f"Github request `{response.url}` failed with status {status}, retrying in {wait:.1f}s."
+            )
+            return wait
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    """Exponential backoff with jitter, capped at 30 seconds."""
+    return min(30.0, 2**attempt) * (0.5 + random.random() / 2)
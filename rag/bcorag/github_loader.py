@@ -0,0 +1,505 @@
+""" Incremental loader for the supplementary Github repository.
+
+Git objects are content addressed, so everything fetched from the repository
+is cached on disk under its SHA:
+
+- `trees/<tree sha>.json`: The files under a tree (an unchanged repository is
+  never listed again).
+- `blobs/<blob sha>.json`: The decoded text of a file (and its token count).
+- `nodes/<namespace>/<key>.json`: The chunked and embedded nodes of a file, per
+  chunking strategy and embedding model (the namespace) and keyed by the blob
+  SHA and path.
+
+Only the branch head is requested on every run. Files are filtered by the
+bcorag.repo_filter policy before anything is chunked. Files whose blob SHA is
+already cached are neither fetched nor embedded again. The remaining requests
+go through the pooled, bounded concurrency client in bcorag.github_api.
+Several repositories can be loaded concurrently with load_all().
+"""
+
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable, TypeVar
+from llama_index.core.schema import BaseNode, Document
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+from bcorag.github_api import GithubApi, DEFAULT_BASE_URL, DEFAULT_MAX_CONCURRENCY
+from bcorag.repo_filter import RepoFilter, count_tokens, prepare_text
+import bcorag.misc_functions as misc_fns
+
+T = TypeVar("T")
+
+
+class GithubLoader:
+    """Loads the files of a repository branch into documents, reusing the
+    cached nodes of files that haven't changed.
+    """
+
+    def __init__(
+        self,
+        github_token: str | None,
+        owner: str,
+        repo: str,
+        branch: str,
+        cache_dir: str,
+        namespace: str,
+        base_url: str = DEFAULT_BASE_URL,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        repo_filter: RepoFilter | None = None,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+        github_token : str or None
+            The Github token.
+        owner : str
+            The repository owner.
+        repo : str
+            The repository name.
+        branch : str
+            The branch to load.
+        cache_dir : str
+            The root directory of the Github cache.
+        namespace : str
+            The node cache namespace, must change whenever the chunking strategy
+            or embedding model does.
+        base_url : str (default: DEFAULT_BASE_URL)
+            The Github API base URL.
+        max_concurrency : int (default: DEFAULT_MAX_CONCURRENCY)
+            The cap on the number of requests in flight at once.
+        repo_filter : RepoFilter or None (default: None)
+            The file include/exclude policy, every decodable file is loaded if
+            None.
+
+        Attributes
+        ----------
+        commit_sha : str or None
+            The branch head commit SHA, set by head_commit().
+        stats : dict[str, int]
+            The counts of the last load: total files, selected files, excluded
+            files, files with cached nodes, blobs fetched, selected tokens (when
+            filtered), API requests and retries.
+        exclusions : dict[str, int]
+            The number of files excluded by the last load for each reason.
+        """
+        self.github_token = github_token
+        self.owner = owner
+        self.repo = repo
+        self.branch = branch
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.repo_filter = repo_filter
+        self.logger = logging.getLogger("bcorag")
+        self.commit_sha: str | None = None
+        self.stats: dict[str, int] = {}
+        self.exclusions: dict[str, int] = {}
+        self._tree_sha: str | None = None
+        self._repo_cache = os.path.join(cache_dir, owner, repo)
+        self._node_cache = os.path.join(self._repo_cache, "nodes", namespace)
+        for subdir in ("trees", "blobs"):
+            os.makedirs(os.path.join(self._repo_cache, subdir), exist_ok=True)
+        os.makedirs(self._node_cache, exist_ok=True)
+        # node cache path for each document returned by the last load
+        self._pending: dict[str, str] = {}
+
+    @property
+    def name(self) -> str:
+        """The `owner/repo` name, set as the `repo` metadata of every node."""
+        return f"{self.owner}/{self.repo}"
+
+    def head_commit(self) -> str:
+        """Resolves the branch head. This is the only request made on every run.
+
+        Returns
+        -------
+        str
+            The head commit SHA.
+        """
+        return asyncio.run(self.ahead_commit())
+
+    async def ahead_commit(self) -> str:
+        """Async version of head_commit()."""
+        branch_data = await self._arun(
+            lambda api: api.get(
+                "getBranch", owner=self.owner, repo=self.repo, branch=self.branch
+            )
+        )
+        self.commit_sha = branch_data["commit"]["sha"]
+        self._tree_sha = branch_data["commit"]["commit"]["tree"]["sha"]
+        return self.commit_sha  # type: ignore
+
+    def load(self) -> tuple[list[BaseNode], list[Document]]:
+        """Loads the branch head. Files with cached nodes are returned as nodes,
+        the remaining files are returned as documents to be chunked and embedded
+        (and then handed back through cache_nodes()).
+
+        Returns
+        -------
+        tuple[list[BaseNode], list[Document]]
+            The cached nodes and the documents for the new or changed files.
+        """
+        return asyncio.run(self.aload())
+
+    async def aload(self) -> tuple[list[BaseNode], list[Document]]:
+        """Async version of load()."""
+        if self._tree_sha is None:
+            await self.ahead_commit()
+        return await self._arun(self._aload)
+
+    def cache_nodes(self, nodes: list[BaseNode]):
+        """Caches the nodes built from the documents returned by the last load,
+        nodes from any other document are ignored.
+
+        Parameters
+        ----------
+        nodes : list[BaseNode]
+            The chunked and embedded nodes.
+        """
+        grouped: dict[str, list[dict]] = {}
+        for node in nodes:
+            if node.ref_doc_id in self._pending:
+                grouped.setdefault(node.ref_doc_id, []).append(doc_to_json(node))
+        for doc_id, node_path in self._pending.items():
+            _write_json_atomic(node_path, grouped.get(doc_id, []))
+        self._pending = {}
+
+    async def _arun(self, operation: Callable[[GithubApi], Awaitable[T]]) -> T:
+        """Runs an async operation with a pooled API client that lives for the
+        duration of the operation.
+
+        Parameters
+        ----------
+        operation : Callable[[GithubApi], Awaitable[T]]
+            The operation to run.
+
+        Returns
+        -------
+        T
+            The operation result.
+        """
+        async with GithubApi(
+            self.github_token, self.base_url, self.max_concurrency
+        ) as api:
+            result = await operation(api)
+            self.stats["requests"] = self.stats.get("requests", 0) + api.requests
+            self.stats["retries"] = self.stats.get("retries", 0) + api.retries
+            return result
+
+    async def _aload(self, api: GithubApi) -> tuple[list[BaseNode], list[Document]]:
+        files = await self._list_files(api, self._tree_sha)  # type: ignore
+        self.exclusions = {}
+        blobs: dict[str, dict] = {}
+        fetched = 0
+
+        def _exclude(reason: str, count: int = 1):
+            self.exclusions[reason] = self.exclusions.get(reason, 0) + count
+
+        async def _fetch_blob(blob_sha: str):
+            nonlocal fetched
+            blob_data = _read_json(self._blob_path(blob_sha))
+            if blob_data is None:
+                blob = await api.get(
+                    "getBlob", owner=self.owner, repo=self.repo, file_sha=blob_sha
+                )
+                fetched += 1
+                blob_data = {"text": _decode_blob(blob)}
+                _write_json_atomic(self._blob_path(blob_sha), blob_data)
+            blobs[blob_sha] = blob_data
+
+        # path, type and size rules, before anything is downloaded
+        selected: list[tuple[str, str]] = []
+        for path, blob_sha, size in files:
+            reason = (
+                None
+                if self.repo_filter is None
+                else self.repo_filter.check_path(path, size)
+            )
+            if reason is None:
+                selected.append((path, blob_sha))
+            else:
+                _exclude(reason)
+
+        # content rules and the token budget, on the text of every remaining file
+        # (the texts and token counts are cached by blob sha)
+        tokens = 0
+        if self.repo_filter is not None:
+            await asyncio.gather(
+                *(_fetch_blob(blob_sha) for blob_sha in {sha for _, sha in selected})
+            )
+            budgeted: list[tuple[str, int]] = []
+            for path, blob_sha in selected:
+                blob_data = blobs[blob_sha]
+                if blob_data["text"] is None:
+                    _exclude("undecodable")
+                    continue
+                # notebooks are checked without their outputs
+                text = prepare_text(path, blob_data["text"])
+                reason = self.repo_filter.check_content(text)
+                if reason is not None:
+                    _exclude(reason)
+                    continue
+                if "tokens" not in blob_data:
+                    blob_data["tokens"] = count_tokens(text)
+                    _write_json_atomic(self._blob_path(blob_sha), blob_data)
+                budgeted.append((path, blob_data["tokens"]))
+            kept, dropped = self.repo_filter.apply_budget(budgeted)
+            if dropped:
+                _exclude("over token budget", len(dropped))
+            selected = [(path, blob_sha) for path, blob_sha in selected if path in kept]
+            tokens = sum(count for path, count in budgeted if path in kept)
+
+        cached_nodes: list[BaseNode] = []
+        uncached: list[tuple[str, str]] = []
+        for path, blob_sha in selected:
+            node_data = _read_json(self._node_path(blob_sha, path))
+            if node_data is None:
+                uncached.append((path, blob_sha))
+            else:
+                for node_json in node_data:
+                    node = json_to_doc(node_json)
+                    # nodes cached before the repo metadata was added
+                    node.metadata.setdefault("repo", self.name)
+                    cached_nodes.append(node)
+
+        await asyncio.gather(
+            *(
+                _fetch_blob(blob_sha)
+                for blob_sha in {sha for _, sha in uncached}
+                if blob_sha not in blobs
+            )
+        )
+        documents: list[Document] = []
+        self._pending = {}
+        for path, blob_sha in uncached:
+            text = blobs[blob_sha]["text"]
+            if text is None:
+                _exclude("undecodable")
+                continue
+            document = Document(
+                text=prepare_text(path, text),
+                doc_id=f"{self.name}:{blob_sha}:{path}",
+                extra_info={
+                    "repo": self.name,
+                    "file_path": path,
+                    "file_name": path.split("/")[-1],
+                    "url": f"https://github.com/{self.owner}/{self.repo}/blob/{self.commit_sha}/{path}",
+                },
+            )
+            documents.append(document)
+            self._pending[document.doc_id] = self._node_path(blob_sha, path)
+
+        self.stats.update(
+            {
+                "files": len(files),
+                "selected": len(selected) - (len(uncached) - len(documents)),
+                "excluded": sum(self.exclusions.values()),
+                "cached": len(selected) - len(uncached),
+                "fetched": fetched,
+            }
+        )
+        if self.repo_filter is not None:
+            self.stats["tokens"] = tokens
+        self.logger.info(
+            f"Loaded repo `{self.name}` at commit `{self.commit_sha}`: {self.stats['files']} files, "
+            f"{self.stats['selected']} selected, {self.stats['cached']} with cached nodes, "
+            f"{self.stats['fetched']} blobs fetched."
+        )
+        if self.exclusions:
+            reasons = ", ".join(
+                f"{count} {reason}" for reason, count in sorted(self.exclusions.items())
+            )
+            self.logger.info(
+                f"Excluded {self.stats['excluded']} files from repo `{self.name}`: {reasons}."
+            )
+        if self.repo_filter is not None:
+            self.logger.info(
+                f"Selected {tokens} of the {self.repo_filter.policy['token_budget']} token budget for repo `{self.name}`."
+            )
+        return cached_nodes, documents
+
+    async def _list_files(
+        self, api: GithubApi, tree_sha: str
+    ) -> list[tuple[str, str, int]]:
+        """Lists the files under a tree with a single recursive request, falling
+        back to walking the tree one directory at a time if the recursive listing
+        is truncated (very large repositories). Listings are cached by tree SHA.
+
+        Parameters
+        ----------
+        api : GithubApi
+            The API client.
+        tree_sha : str
+            The tree SHA.
+
+        Returns
+        -------
+        list[tuple[str, str, int]]
+            The path (relative to the tree), blob SHA and size in bytes of each
+            file.
+        """
+        tree_path = os.path.join(self._repo_cache, "trees", f"{tree_sha}.json")
+        files = _read_json(tree_path)
+        if files is not None:
+            return [(path, blob_sha, size) for path, blob_sha, size in files]
+        tree_data = await api.get(
+            "getTree",
+            params={"recursive": "1"},
+            owner=self.owner,
+            repo=self.repo,
+            tree_sha=tree_sha,
+        )
+        if tree_data.get("truncated"):
+            files = await self._walk_tree(api, tree_sha)
+        else:
+            files = _blob_entries(tree_data)
+        _write_json_atomic(tree_path, files)
+        return files
+
+    async def _walk_tree(
+        self, api: GithubApi, tree_sha: str
+    ) -> list[tuple[str, str, int]]:
+        """Lists the files under a tree one directory at a time, listing sibling
+        directories concurrently.
+
+        Parameters
+        ----------
+        api : GithubApi
+            The API client.
+        tree_sha : str
+            The tree SHA.
+
+        Returns
+        -------
+        list[tuple[str, str, int]]
+            The path (relative to the tree), blob SHA and size in bytes of each
+            file.
+        """
+        tree_data = await api.get(
+            "getTree", owner=self.owner, repo=self.repo, tree_sha=tree_sha
+        )
+        files = _blob_entries(tree_data)
+        subtrees = [entry for entry in tree_data["tree"] if entry["type"] == "tree"]
+        subtree_files = await asyncio.gather(
+            *(self._walk_tree(api, subtree["sha"]) for subtree in subtrees)
+        )
+        for subtree, nested_files in zip(subtrees, subtree_files):
+            files.extend(
+                (f"{subtree['path']}/{path}", blob_sha, size)
+                for path, blob_sha, size in nested_files
+            )
+        return files
+
+    def _blob_path(self, blob_sha: str) -> str:
+        return os.path.join(self._repo_cache, "blobs", f"{blob_sha}.json")
+
+    def _node_path(self, blob_sha: str, path: str) -> str:
+        key = misc_fns.hash_data({"blob": blob_sha, "path": path})
+        return os.path.join(self._node_cache, f"{key}.json")
+
+
+def _blob_entries(tree_data: dict) -> list[tuple[str, str, int]]:
+    """Extracts the files from a getTree response.
+
+    Parameters
+    ----------
+    tree_data : dict
+        The getTree response.
+
+    Returns
+    -------
+    list[tuple[str, str, int]]
+        The path, blob SHA and size in bytes of each file.
+    """
+    return [
+        (entry["path"], entry["sha"], entry.get("size") or 0)
+        for entry in tree_data["tree"]
+        if entry["type"] == "blob"
+    ]
+
+
+def _decode_blob(blob: dict) -> str | None:
+    """Decodes the text content of a blob.
+
+    Parameters
+    ----------
+    blob : dict
+        The getBlob response.
+
+    Returns
+    -------
+    str or None
+        The text content, None if the blob isn't UTF-8 text.
+    """
+    if blob.get("encoding") != "base64":
+        return None
+    try:
+        return base64.b64decode(blob["content"]).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+
+
+def _read_json(path: str) -> Any:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json_atomic(path: str, data: Any):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.getLogger("bcorag").error(f"Failed to write Github cache entry `{path}`.\n{e}")
+
+
+def head_commits(loaders: list[GithubLoader]) -> list[str]:
+    """Resolves the branch heads of several repositories concurrently.
+
+    Parameters
+    ----------
+    loaders : list[GithubLoader]
+        The repository loaders.
+
+    Returns
+    -------
+    list[str]
+        The head commit SHA of each repository.
+    """
+
+    async def _gather() -> list[str]:
+        return await asyncio.gather(*(loader.ahead_commit() for loader in loaders))
+
+    return asyncio.run(_gather())
+
+
+def load_all(
+    loaders: list[GithubLoader],
+) -> list[tuple[list[BaseNode], list[Document]]]:
+    """Loads several repositories concurrently, so the total load time is close
+    to that of the slowest single repository. Each repository gets its own
+    pooled client (and concurrency cap).
+
+    Parameters
+    ----------
+    loaders : list[GithubLoader]
+        The repository loaders.
+
+    Returns
+    -------
+    list[tuple[list[BaseNode], list[Document]]]
+        The cached nodes and the documents of each repository (see
+        GithubLoader.load()).
+    """
+
+    async def _gather() -> list[tuple[list[BaseNode], list[Document]]]:
+        return await asyncio.gather(*(loader.aload() for loader in loaders))
+
+    return asyncio.run(_gather())
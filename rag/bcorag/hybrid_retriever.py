@@ -0,0 +1,174 @@
+""" Hybrid retriever fusing the dense vector search with the sparse BM25 search.
+
+Both searches return their `candidate_k` best nodes (under the same metadata
+filters) and the two rankings are combined with reciprocal rank fusion, each
+node scoring `1 / (rrf_k + rank)` per ranking it appears in. Rank fusion needs
+no calibration between cosine similarities and BM25 scores, and a node found by
+both searches outranks a node found by only one.
+"""
+
+from typing import TYPE_CHECKING
+from llama_index.core import VectorStoreIndex
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.retrievers import VectorIndexRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.types import MetadataFilters
+import bcorag.misc_functions as misc_fns
+
+if TYPE_CHECKING:
+    from bcorag.bm25_index import BM25Index
+
+# reciprocal rank fusion constant, damps the weight of the top ranks
+DEFAULT_RRF_K = 60
+# nodes retrieved by each search before the fusion
+DEFAULT_CANDIDATE_K = 20
+
+
+class HybridRetriever(BaseRetriever):
+    """Vector and BM25 retriever with reciprocal rank fusion."""
+
+    def __init__(
+        self,
+        index: VectorStoreIndex,
+        bm25: "BM25Index",
+        similarity_top_k: int,
+        candidate_k: int = DEFAULT_CANDIDATE_K,
+        rrf_k: int = DEFAULT_RRF_K,
+        filters: MetadataFilters | None = None,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+        index : VectorStoreIndex
+            The vector index.
+        bm25 : BM25Index
+            The BM25 index over the same nodes.
+        similarity_top_k : int
+            The number of fused nodes to return.
+        candidate_k : int (default: DEFAULT_CANDIDATE_K)
+            The number of nodes retrieved by each search before the fusion.
+        rrf_k : int (default: DEFAULT_RRF_K)
+            The reciprocal rank fusion constant.
+        filters : MetadataFilters or None (default: None)
+            The metadata pre-filter applied to both searches.
+        """
+        super().__init__()
+        self.index = index
+        self.bm25 = bm25
+        self.similarity_top_k = similarity_top_k
+        self.candidate_k = max(candidate_k, similarity_top_k)
+        self.rrf_k = rrf_k
+        self.filters = filters
+        self._vector_retriever = VectorIndexRetriever(
+            index=index, similarity_top_k=self.candidate_k, filters=filters
+        )
+
+    @classmethod
+    def from_conf(
+        cls,
+        index: VectorStoreIndex,
+        bm25: "BM25Index",
+        similarity_top_k: int,
+        filters: MetadataFilters | None = None,
+        conf_path: str = "./bcorag/conf.json",
+    ) -> "HybridRetriever":
+        """Builds the retriever with the fusion parameters from the `hybrid`
+        section of the configuration file.
+
+        Parameters
+        ----------
+        index : VectorStoreIndex
+            The vector index.
+        bm25 : BM25Index
+            The BM25 index over the same nodes.
+        similarity_top_k : int
+            The number of fused nodes to return.
+        filters : MetadataFilters or None (default: None)
+            The metadata pre-filter applied to both searches.
+        conf_path : str (default: "./bcorag/conf.json")
+            Path to the configuration file.
+
+        Returns
+        -------
+        HybridRetriever
+            The retriever.
+        """
+        hybrid = misc_fns.load_json(conf_path)["hybrid"]
+        return cls(
+            index,
+            bm25,
+            similarity_top_k,
+            candidate_k=hybrid["candidate_k"],
+            rrf_k=hybrid["rrf_k"],
+            filters=filters,
+        )
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        return self._fuse(query_bundle, self._vector_retriever.retrieve(query_bundle))
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        return self._fuse(
+            query_bundle, await self._vector_retriever.aretrieve(query_bundle)
+        )
+
+    def _fuse(
+        self, query_bundle: QueryBundle, vector_nodes: list[NodeWithScore]
+    ) -> list[NodeWithScore]:
+        """Runs the BM25 search and fuses its ranking with the vector ranking.
+
+        Parameters
+        ----------
+        query_bundle : QueryBundle
+            The query.
+        vector_nodes : list[NodeWithScore]
+            The vector search results, most similar first.
+
+        Returns
+        -------
+        list[NodeWithScore]
+            The top k nodes by fused score, highest first.
+        """
+        bm25_ranking = self.bm25.search(
+            query_bundle.query_str, self.candidate_k, self.filters
+        )
+        nodes = {result.node.node_id: result.node for result in vector_nodes}
+        top = reciprocal_rank_fusion(
+            [
+                [result.node.node_id for result in vector_nodes],
+                [node_id for node_id, _ in bm25_ranking],
+            ],
+            self.rrf_k,
+        )[: self.similarity_top_k]
+        # nodes only found by the BM25 search are read from the docstore
+        missing = [node_id for node_id, _ in top if node_id not in nodes]
+        if missing:
+            for node in self.index.docstore.get_nodes(missing):
+                nodes[node.node_id] = node
+        return [NodeWithScore(node=nodes[node_id], score=score) for node_id, score in top]
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[str]], rrf_k: int = DEFAULT_RRF_K
+) -> list[tuple[str, float]]:
+    """Fuses rankings, each ID scoring `1 / (rrf_k + rank)` per ranking it
+    appears in (ranks start at 1).
+
+    Parameters
+    ----------
+    rankings : list[list[str]]
+        The ranked IDs, best first.
+    rrf_k : int (default: DEFAULT_RRF_K)
+        The reciprocal rank fusion constant.
+
+    Returns
+    -------
+    list[tuple[str, float]]
+        The IDs and fused scores, highest first (ties in order of first
+        appearance).
+    """
+    fused: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            fused[item_id] = fused.get(item_id, 0.0) + 1 / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
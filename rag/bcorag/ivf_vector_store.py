@@ -0,0 +1,353 @@
+""" Approximate nearest neighbour vector store, an inverted file (IVF) index
+over the NumpyVectorStore matrix.
+
+The normalized embeddings are clustered with spherical k-means into `nlist`
+lists. A query is scored against the list centroids first and only the rows of
+the `nprobe` closest lists are scored exactly, trading recall for speed (with
+`nprobe` equal to `nlist` every row is scored and the results are exact).
+
+- Until the store holds `min_train_size` rows it isn't trained and every query
+  is an exact scan.
+- New rows are assigned to their closest existing centroid, and the centroids
+  are retrained once the store has grown by RETRAIN_GROWTH times since the last
+  training.
+- The centroids and the list assignments are persisted to
+  `<namespace>__vector_store.ivf.npz`, next to the NumpyVectorStore files.
+"""
+
+import math
+import os
+from typing import Any
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    DEFAULT_PERSIST_DIR,
+    DEFAULT_PERSIST_FNAME,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+import bcorag.misc_functions as misc_fns
+from bcorag.numpy_vector_store import NumpyVectorStore, _normalize, top_k
+
+# retrain the centroids once the store holds this many times the rows it was
+# trained on
+RETRAIN_GROWTH = 2.0
+# max number of rows sampled per list to train the centroids on
+TRAIN_SAMPLES_PER_LIST = 256
+# rows scored against the centroids at a time when assigning lists
+ASSIGN_CHUNK_ROWS = 8192
+
+
+class IvfVectorStore(NumpyVectorStore):
+    """Inverted file vector store."""
+
+    nlist: int | None = None
+    nprobe: int = 8
+    train_iterations: int = 20
+    min_train_size: int = 1024
+    seed: int = 0
+
+    _centroids: np.ndarray | None = PrivateAttr()
+    _assignments: np.ndarray = PrivateAttr()
+    _trained_size: int = PrivateAttr()
+    _list_rows: np.ndarray | None = PrivateAttr()
+    _list_bounds: np.ndarray | None = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        """Constructor.
+
+        Parameters
+        ----------
+        nlist : int or None (default: None)
+            The number of lists (clusters), None for 4 * sqrt(rows) at training.
+        nprobe : int (default: 8)
+            The number of lists scored per query. Higher is slower with better
+            recall.
+        train_iterations : int (default: 20)
+            The number of k-means iterations per training.
+        min_train_size : int (default: 1024)
+            The number of rows needed before the store is trained.
+        seed : int (default: 0)
+            The k-means random seed.
+        """
+        super().__init__(**kwargs)
+        self._centroids = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._trained_size = 0
+        self._list_rows = None
+        self._list_bounds = None
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "IvfVectorStore"
+
+    @classmethod
+    def from_conf(cls, conf_path: str = "./bcorag/conf.json") -> "IvfVectorStore":
+        """Builds an empty store from the `ivf` section of the configuration
+        file.
+
+        Parameters
+        ----------
+        conf_path : str (default: "./bcorag/conf.json")
+            Path to the configuration file.
+
+        Returns
+        -------
+        IvfVectorStore
+            The store.
+        """
+        return cls(**misc_fns.load_json(conf_path)["ivf"])
+
+    @property
+    def trained(self) -> bool:
+        """Whether the centroids have been trained."""
+        return self._centroids is not None
+
+    @property
+    def centroids(self) -> np.ndarray | None:
+        """The list centroids, one row per list, None if not trained."""
+        return self._centroids
+
+    def add(self, nodes: list[BaseNode], **add_kwargs: Any) -> list[str]:
+        """Adds the nodes' embeddings, assigning each to the closest list, and
+        (re)trains the centroids if the store has grown enough.
+
+        Parameters
+        ----------
+        nodes : list[BaseNode]
+            The embedded nodes.
+
+        Returns
+        -------
+        list[str]
+            The node IDs.
+        """
+        node_ids = super().add(nodes, **add_kwargs)
+        # replaced nodes are deleted first, the new rows are at the end
+        offset = len(self.node_ids) - len(nodes)
+        if self._centroids is not None:
+            self._assignments = np.concatenate(
+                [
+                    self._assignments,
+                    nearest_centroids(np.asarray(self.matrix[offset:]), self._centroids),
+                ]
+            )
+        self._list_rows = None
+        size = len(self.node_ids)
+        if (self._centroids is None and size >= self.min_train_size) or (
+            self._centroids is not None and size > RETRAIN_GROWTH * self._trained_size
+        ):
+            self.train()
+        return node_ids
+
+    def train(self):
+        """Trains the centroids on the current rows and reassigns every row."""
+        size = len(self.node_ids)
+        if size == 0:
+            return
+        nlist = self.nlist or round(4 * math.sqrt(size))
+        nlist = max(1, min(nlist, size))
+        matrix = np.asarray(self.matrix)
+        self._centroids = train_centroids(
+            matrix, nlist, self.train_iterations, np.random.default_rng(self.seed)
+        )
+        self._assignments = nearest_centroids(matrix, self._centroids)
+        self._trained_size = size
+        self._list_rows = None
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        """Scores the rows of the `nprobe` lists closest to the query embedding
+        and returns the top k. Falls back to an exact scan if the store isn't
+        trained or the candidate rows left by the filters are fewer than the
+        probed rows.
+
+        Parameters
+        ----------
+        query : VectorStoreQuery
+            The query.
+
+        Returns
+        -------
+        VectorStoreQueryResult
+            The top k node IDs and similarities, most similar first.
+        """
+        if self._centroids is None or query.mode != VectorStoreQueryMode.DEFAULT:
+            return super().query(query, **kwargs)
+        query_vector = _normalize(
+            np.asarray(query.query_embedding, dtype=np.float32)[None, :]
+        )[0]
+        lists, _ = top_k(self._centroids @ query_vector, self.nprobe)
+        rows = self._probe(lists)
+        candidates = self.candidate_rows(query)
+        if candidates is not None:
+            if len(candidates) <= len(rows):
+                return super().query(query, **kwargs)
+            rows = rows[np.isin(rows, candidates, assume_unique=True)]
+        if len(rows) == 0:
+            return VectorStoreQueryResult(nodes=None, similarities=[], ids=[])
+        scores = self.matrix[rows] @ query_vector
+        top_rows, top_scores = top_k(scores, query.similarity_top_k)
+        return VectorStoreQueryResult(
+            nodes=None,
+            similarities=top_scores.tolist(),
+            ids=[self.node_ids[row] for row in rows[top_rows]],
+        )
+
+    def persist(
+        self,
+        persist_path: str = os.path.join(DEFAULT_PERSIST_DIR, DEFAULT_PERSIST_FNAME),
+        fs: Any = None,
+    ) -> None:
+        """Persists the matrix, the sidecar and, if trained, the centroids and
+        list assignments.
+
+        Parameters
+        ----------
+        persist_path : str
+            The sidecar path.
+        """
+        super().persist(persist_path, fs)
+        ivf_path = f"{os.path.splitext(persist_path)[0]}.ivf.npz"
+        if self._centroids is None:
+            if os.path.isfile(ivf_path):
+                os.remove(ivf_path)
+            return
+        tmp_path = f"{ivf_path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self._centroids,
+            assignments=self._assignments,
+            trained_size=np.asarray(self._trained_size),
+        )
+        os.replace(tmp_path, ivf_path)
+
+    @classmethod
+    def from_persist_path(
+        cls, persist_path: str, mmap: bool = True, **kwargs: Any
+    ) -> "IvfVectorStore":
+        """Loads a persisted store.
+
+        Parameters
+        ----------
+        persist_path : str
+            The sidecar path.
+        mmap : bool (default: True)
+            Whether to memory map the embedding matrix.
+        **kwargs
+            Passed to the constructor (the query time parameters such as
+            `nprobe` can differ from the persisted store's).
+
+        Returns
+        -------
+        IvfVectorStore
+            The loaded store.
+        """
+        store = super().from_persist_path(persist_path, mmap=mmap, **kwargs)
+        ivf_path = f"{os.path.splitext(persist_path)[0]}.ivf.npz"
+        if os.path.isfile(ivf_path):
+            with np.load(ivf_path) as ivf:
+                store._centroids = ivf["centroids"]
+                store._assignments = ivf["assignments"]
+                store._trained_size = int(ivf["trained_size"])
+        return store  # type: ignore
+
+    def _probe(self, lists: np.ndarray) -> np.ndarray:
+        """Gathers the rows of the lists.
+
+        Parameters
+        ----------
+        lists : np.ndarray
+            The list indices.
+
+        Returns
+        -------
+        np.ndarray
+            The rows, in ascending order.
+        """
+        if self._list_rows is None or self._list_bounds is None:
+            # rows grouped by list, the rows of list i are
+            # list_rows[list_bounds[i] : list_bounds[i + 1]]
+            self._list_rows = np.argsort(self._assignments, kind="stable")
+            self._list_bounds = np.searchsorted(
+                self._assignments[self._list_rows],
+                np.arange(len(self._centroids) + 1),  # type: ignore
+            )
+        rows = np.concatenate(
+            [
+                self._list_rows[self._list_bounds[i] : self._list_bounds[i + 1]]
+                for i in lists
+            ]
+        )
+        return np.sort(rows)
+
+    def _delete_rows(self, node_ids: set[str]) -> list[int] | None:
+        keep = super()._delete_rows(node_ids)
+        if keep is not None and self._centroids is not None:
+            self._assignments = self._assignments[keep]
+            self._list_rows = None
+        return keep
+
+
+def train_centroids(
+    vectors: np.ndarray, nlist: int, iterations: int, rng: np.random.Generator
+) -> np.ndarray:
+    """Clusters normalized vectors with spherical k-means (cosine similarity).
+
+    Parameters
+    ----------
+    vectors : np.ndarray
+        The normalized vectors, one row each.
+    nlist : int
+        The number of clusters.
+    iterations : int
+        The number of k-means iterations.
+    rng : np.random.Generator
+        The random generator for the sampling and initialization.
+
+    Returns
+    -------
+    np.ndarray
+        The normalized centroids, one row each.
+    """
+    max_samples = nlist * TRAIN_SAMPLES_PER_LIST
+    if len(vectors) > max_samples:
+        vectors = vectors[np.sort(rng.choice(len(vectors), max_samples, replace=False))]
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = nearest_centroids(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=nlist)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+        centroids[filled] = _normalize(
+            np.add.reduceat(vectors[order], starts, axis=0)
+        )
+        # reseed the empty clusters with random vectors
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+    return centroids
+
+
+def nearest_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Assigns each vector to its most similar centroid.
+
+    Parameters
+    ----------
+    vectors : np.ndarray
+        The normalized vectors, one row each.
+    centroids : np.ndarray
+        The normalized centroids, one row each.
+
+    Returns
+    -------
+    np.ndarray
+        The centroid index of each vector.
+    """
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_ROWS):
+        chunk = vectors[start : start + ASSIGN_CHUNK_ROWS]
+        assignments[start : start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
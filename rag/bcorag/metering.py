@@ -0,0 +1,288 @@
+""" Token and cost metering. Every embedding and LLM call is recorded as its own
+ledger entry (the per call token deltas, not running totals) under the scope it
+was made in (a domain, or "indexing" for building the index), and priced with
+the model price table.
+"""
+
+import json
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+from llama_index.core.callbacks.schema import CBEventType, EventPayload
+from bcorag.schema_slicer import encoding_for
+from bcorag.tracing import llm_usage
+
+# USD per 1M tokens, embedding models only have an input price
+PRICES: dict[str, dict[str, float]] = {
+    "gpt-3.5-turbo": {"input": 0.50, "output": 1.50},
+    "gpt-4-turbo": {"input": 10.00, "output": 30.00},
+    "gpt-4-turbo-preview": {"input": 10.00, "output": 30.00},
+    "gpt-4": {"input": 30.00, "output": 60.00},
+    "text-embedding-3-small": {"input": 0.02, "output": 0.0},
+    "text-embedding-3-large": {"input": 0.13, "output": 0.0},
+    "text-embedding-ada-002": {"input": 0.10, "output": 0.0},
+}
+# scope for calls made outside of a domain query
+INDEXING_SCOPE = "indexing"
+
+_current_scope: ContextVar[str] = ContextVar("bcorag_scope", default=INDEXING_SCOPE)
+
+
+@contextmanager
+def metered_scope(scope: str) -> Iterator[None]:
+    """Context manager that records the calls made in the block under a scope.
+
+    Parameters
+    ----------
+    scope : str
+        The scope name (e.g. the domain).
+    """
+    token = _current_scope.set(scope)
+    try:
+        yield
+    finally:
+        _current_scope.reset(token)
+
+
+def price(model: str, input_tokens: int, output_tokens: int = 0) -> float | None:
+    """Prices a call with the model price table.
+
+    Parameters
+    ----------
+    model : str
+        The model name.
+    input_tokens : int
+        The prompt (or embedded) tokens.
+    output_tokens : int (default: 0)
+        The completion tokens.
+
+    Returns
+    -------
+    float or None
+        The cost in USD, None if the model isn't in the price table.
+    """
+    model_prices = PRICES.get(model)
+    if model_prices is None:
+        return None
+    return (
+        input_tokens * model_prices["input"] + output_tokens * model_prices["output"]
+    ) / 1_000_000
+
+
+class MeteringLedger:
+    """The ledger of metered calls for a single paper."""
+
+    def __init__(self, paper: str):
+        """Constructor.
+
+        Parameters
+        ----------
+        paper : str
+            The paper the calls are made for.
+        """
+        self.paper = paper
+        self.entries: list[dict[str, Any]] = []
+        self._unpriced: set[str] = set()
+
+    def record(
+        self,
+        kind: str,
+        model: str,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        estimated: bool = False,
+    ):
+        """Records a single call under the current scope.
+
+        Parameters
+        ----------
+        kind : str
+            The call kind, either "embedding" or "llm".
+        model : str
+            The model name.
+        prompt_tokens : int (default: 0)
+            The prompt (or embedded) tokens.
+        completion_tokens : int (default: 0)
+            The completion tokens.
+        estimated : bool (default: False)
+            Whether the tokens were counted locally rather than reported by the
+            API.
+        """
+        cost = price(model, prompt_tokens, completion_tokens)
+        if cost is None and model not in self._unpriced:
+            self._unpriced.add(model)
+            logging.getLogger("bcorag").warning(
+                f"No price for model `{model}`, its calls are metered without a cost."
+            )
+        self.entries.append(
+            {
+                "scope": _current_scope.get(),
+                "kind": kind,
+                "model": model,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "estimated": estimated,
+                "cost": cost,
+            }
+        )
+
+    def totals(self, scope: str | None = None) -> dict[str, Any]:
+        """Sums the ledger entries.
+
+        Parameters
+        ----------
+        scope : str or None (default: None)
+            The scope to sum, None to sum every entry.
+
+        Returns
+        -------
+        dict[str, Any]
+            The call count, the embedding, prompt and completion tokens and the
+            cost in USD.
+        """
+        totals: dict[str, Any] = {
+            "calls": 0,
+            "embedding_tokens": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cost": 0.0,
+        }
+        for entry in self.entries:
+            if scope is not None and entry["scope"] != scope:
+                continue
+            totals["calls"] += 1
+            if entry["kind"] == "embedding":
+                totals["embedding_tokens"] += entry["prompt_tokens"]
+            else:
+                totals["prompt_tokens"] += entry["prompt_tokens"]
+                totals["completion_tokens"] += entry["completion_tokens"]
+            totals["cost"] += entry["cost"] or 0.0
+        return totals
+
+    def summary(self) -> dict[str, Any]:
+        """Summarizes the ledger per scope.
+
+        Returns
+        -------
+        dict[str, Any]
+            The paper, the overall totals and the totals for each scope.
+        """
+        scopes = dict.fromkeys(entry["scope"] for entry in self.entries)
+        return {
+            "paper": self.paper,
+            "total": self.totals(),
+            "scopes": {scope: self.totals(scope) for scope in scopes},
+        }
+
+    def write(self, path: str):
+        """Writes the ledger summary and entries to a JSON file.
+
+        Parameters
+        ----------
+        path : str
+            The output path.
+        """
+        try:
+            with open(path, "w") as f:
+                json.dump({**self.summary(), "entries": self.entries}, f, indent=4)
+        except OSError as e:
+            logging.getLogger("bcorag").error(
+                f"Failed to write metering ledger to `{path}`.\n{e}"
+            )
+
+
+class MeteringHandler(BaseCallbackHandler):
+    """Llama-index callback handler that records each embedding and LLM call in
+    the ledger. Token counts reported by the API are used where available,
+    otherwise (embeddings and streamed responses) the tokens are counted locally.
+    """
+
+    def __init__(self, ledger: MeteringLedger, llm_model: str, embed_model: str):
+        """Constructor.
+
+        Parameters
+        ----------
+        ledger : MeteringLedger
+            The ledger to record the calls in.
+        llm_model : str
+            The LLM model name.
+        embed_model : str
+            The embedding model name.
+        """
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self.ledger = ledger
+        self.llm_model = llm_model
+        self.embed_model = embed_model
+        self._embed_encoding = encoding_for(embed_model)
+        self._llm_encoding = encoding_for(llm_model)
+
+    def on_event_start(
+        self,
+        event_type: CBEventType,
+        payload: dict[str, Any] | None = None,
+        event_id: str = "",
+        parent_id: str = "",
+        **kwargs: Any,
+    ) -> str:
+        return event_id
+
+    def on_event_end(
+        self,
+        event_type: CBEventType,
+        payload: dict[str, Any] | None = None,
+        event_id: str = "",
+        **kwargs: Any,
+    ) -> None:
+        if payload is None:
+            return
+        if event_type == CBEventType.EMBEDDING:
+            chunks = payload.get(EventPayload.CHUNKS, [])
+            tokens = sum(
+                len(encoded)
+                for encoded in self._embed_encoding.encode_ordinary_batch(chunks)
+            )
+            self.ledger.record(
+                "embedding", self.embed_model, prompt_tokens=tokens, estimated=True
+            )
+        elif event_type == CBEventType.LLM:
+            response = payload.get(EventPayload.RESPONSE) or payload.get(
+                EventPayload.COMPLETION
+            )
+            if response is None:
+                return
+            usage = llm_usage(response)
+            if usage is not None and usage["prompt_tokens"]:
+                self.ledger.record(
+                    "llm",
+                    self.llm_model,
+                    prompt_tokens=usage["prompt_tokens"],
+                    completion_tokens=usage["completion_tokens"],
+                )
+                return
+            if EventPayload.MESSAGES in payload:
+                prompt = "\n".join(
+                    str(message) for message in payload[EventPayload.MESSAGES]
+                )
+                completion = str(response.message.content or "")
+            else:
+                prompt = str(payload.get(EventPayload.PROMPT, ""))
+                completion = str(response.text or "")
+            self.ledger.record(
+                "llm",
+                self.llm_model,
+                prompt_tokens=len(self._llm_encoding.encode_ordinary(prompt)),
+                completion_tokens=len(self._llm_encoding.encode_ordinary(completion)),
+                estimated=True,
+            )
+
+    def start_trace(self, trace_id: str | None = None) -> None:
+        return
+
+    def end_trace(
+        self,
+        trace_id: str | None = None,
+        trace_map: dict[str, list[str]] | None = None,
+    ) -> None:
+        return
@@ -5,6 +5,7 @@ import sys
 import json
 import logging
 import os
+import hashlib
 
 
 def graceful_exit():
@@ -58,6 +59,45 @@ def write_json(output_path: str, data: dict | list) -> bool:
         return False
 
 
+def hash_file(filepath: str, chunk_size: int = 1 << 20) -> str:
+    """Computes the SHA-256 hex digest of a file's contents.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the file to hash.
+    chunk_size : int (default: 1 MiB)
+        Number of bytes to read at a time.
+
+    Returns
+    -------
+    str
+        The hex digest of the file contents.
+    """
+    sha = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        while chunk := f.read(chunk_size):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def hash_data(data: dict | list | str) -> str:
+    """Computes a stable SHA-256 hex digest of JSON serializable data.
+
+    Parameters
+    ----------
+    data : dict, list or str
+        The data to hash, dictionaries are hashed independent of key order.
+
+    Returns
+    -------
+    str
+        The hex digest of the serialized data.
+    """
+    serialized = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
 def check_dir(path: str):
     """Checks whether a directory creates and if it doesn't, create it. Note, this
     really only works for checking/creating the last level direcotry. Will fail if
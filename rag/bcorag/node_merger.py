@@ -0,0 +1,223 @@
+""" Post retrieval merging of adjacent and overlapping nodes.
+
+The fixed size chunking strategies overlap consecutive chunks, so neighbouring
+retrieved nodes send the overlapping text to the LLM twice. Nodes from the same
+source document that overlap or follow each other (by their character offsets
+or their previous/next relationships) are merged into one contiguous passage
+with the overlap removed, and nodes whose text is already contained in another
+retrieved node are dropped.
+"""
+
+from llama_index.core.schema import BaseNode, NodeRelationship, NodeWithScore
+
+# max characters between two nodes of a document for them to count as adjacent
+# (the whitespace stripped at the chunk boundary)
+MAX_GAP_CHARS = 1
+# overlap lengths searched for between nodes without character offsets, shorter
+# matches are coincidental
+MIN_OVERLAP_CHARS = 16
+MAX_OVERLAP_CHARS = 2048
+# joins adjacent (non overlapping) nodes
+_ADJACENT_SEPARATOR = "\n"
+
+
+def merge_nodes(nodes: list[NodeWithScore]) -> list[NodeWithScore]:
+    """Merges adjacent and overlapping nodes from the same source document and
+    drops nodes contained in other nodes.
+
+    Parameters
+    ----------
+    nodes : list[NodeWithScore]
+        The retrieved nodes.
+
+    Returns
+    -------
+    list[NodeWithScore]
+        The merged nodes, highest score first. A merged node keeps the ID and
+        metadata of its first node and the highest score of the nodes merged
+        into it.
+    """
+    by_document: dict[str, list[NodeWithScore]] = {}
+    merged: list[NodeWithScore] = []
+    for node in nodes:
+        if node.node.ref_doc_id is None:
+            merged.append(node)
+        else:
+            by_document.setdefault(node.node.ref_doc_id, []).append(node)
+    for document_nodes in by_document.values():
+        merged += _merge_document_nodes(document_nodes)
+    return _drop_contained(sorted(merged, key=_score, reverse=True))
+
+
+def _merge_document_nodes(nodes: list[NodeWithScore]) -> list[NodeWithScore]:
+    """Merges the runs of adjacent or overlapping nodes of one document.
+
+    Parameters
+    ----------
+    nodes : list[NodeWithScore]
+        The retrieved nodes of the document.
+
+    Returns
+    -------
+    list[NodeWithScore]
+        The merged nodes.
+    """
+    if len(nodes) == 1:
+        return nodes
+    ordered = _document_order(nodes)
+    runs: list[list[NodeWithScore]] = [[ordered[0]]]
+    for node in ordered[1:]:
+        if _adjacent(runs[-1][-1].node, node.node):
+            runs[-1].append(node)
+        else:
+            runs.append([node])
+    return [run[0] if len(run) == 1 else _merge_run(run) for run in runs]
+
+
+def _document_order(nodes: list[NodeWithScore]) -> list[NodeWithScore]:
+    """Orders a document's nodes by their position in the document, by
+    character offset or else by following the previous/next relationships.
+    """
+    if all(node.node.start_char_idx is not None for node in nodes):
+        return sorted(nodes, key=lambda node: node.node.start_char_idx)  # type: ignore
+    by_id = {node.node.node_id: node for node in nodes}
+    ordered: list[NodeWithScore] = []
+    seen: set[str] = set()
+    # the nodes whose previous node wasn't retrieved start a chain
+    for start in nodes:
+        previous = start.node.prev_node
+        if previous is not None and previous.node_id in by_id:
+            continue
+        node: NodeWithScore | None = start
+        while node is not None and node.node.node_id not in seen:
+            ordered.append(node)
+            seen.add(node.node.node_id)
+            next_node = node.node.next_node
+            node = by_id.get(next_node.node_id) if next_node is not None else None
+    # nodes on a cycle of relationships (not expected) keep their order
+    ordered += [node for node in nodes if node.node.node_id not in seen]
+    return ordered
+
+
+def _adjacent(first: BaseNode, second: BaseNode) -> bool:
+    """Checks whether the second node directly follows (or overlaps) the first
+    node of the same document.
+    """
+    next_node = first.relationships.get(NodeRelationship.NEXT)
+    if next_node is not None and next_node.node_id == second.node_id:  # type: ignore
+        return True
+    if first.end_char_idx is None or second.start_char_idx is None:
+        return False
+    return second.start_char_idx <= first.end_char_idx + MAX_GAP_CHARS
+
+
+def _merge_run(run: list[NodeWithScore]) -> NodeWithScore:
+    """Merges a run of adjacent nodes, in document order, into one node.
+
+    Parameters
+    ----------
+    run : list[NodeWithScore]
+        The nodes.
+
+    Returns
+    -------
+    NodeWithScore
+        The merged node.
+    """
+    text = run[0].node.get_content()
+    end_char_idx = run[0].node.end_char_idx
+    for node in run[1:]:
+        node_text = node.node.get_content()
+        start_char_idx = node.node.start_char_idx
+        if end_char_idx is not None and start_char_idx is not None:
+            hint = end_char_idx - start_char_idx
+            overlap = _overlap(text, node_text, hint)
+        else:
+            overlap = _overlap(text, node_text)
+        if overlap >= len(node_text):
+            # contained in the passage so far
+            continue
+        if overlap == 0:
+            text += _ADJACENT_SEPARATOR
+        text += node_text[overlap:]
+        if node.node.end_char_idx is not None:
+            end_char_idx = max(end_char_idx or 0, node.node.end_char_idx)
+    merged = run[0].node.copy()
+    # the copy is shallow, the first node's relationships must not change
+    merged.relationships = dict(merged.relationships)
+    merged.set_content(text)
+    merged.end_char_idx = end_char_idx
+    last_next = run[-1].node.relationships.get(NodeRelationship.NEXT)
+    if last_next is not None:
+        merged.relationships[NodeRelationship.NEXT] = last_next
+    else:
+        merged.relationships.pop(NodeRelationship.NEXT, None)
+    return NodeWithScore(node=merged, score=max(_score(node) for node in run))
+
+
+def _overlap(text: str, next_text: str, hint: int | None = None) -> int:
+    """Finds the overlap between the end of a passage and the start of the
+    next node's text.
+
+    Parameters
+    ----------
+    text : str
+        The passage so far.
+    next_text : str
+        The text of the following node.
+    hint : int or None (default: None)
+        The overlap according to the character offsets, if known. If the texts
+        don't agree with it the overlap is searched for.
+
+    Returns
+    -------
+    int
+        The overlap length in characters (the next text's length if the whole
+        next text is already at the end of the passage).
+    """
+    if hint is not None:
+        if hint <= 0:
+            return 0
+        if text.endswith(next_text[:hint]):
+            return min(hint, len(next_text))
+    if text.endswith(next_text):
+        return len(next_text)
+    for length in range(
+        min(len(text), len(next_text), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1
+    ):
+        if text.endswith(next_text[:length]):
+            return length
+    return 0
+
+
+def _drop_contained(nodes: list[NodeWithScore]) -> list[NodeWithScore]:
+    """Drops the nodes whose text is contained in another node's text. The
+    containing node takes the higher of the two scores.
+
+    Parameters
+    ----------
+    nodes : list[NodeWithScore]
+        The nodes, highest score first.
+
+    Returns
+    -------
+    list[NodeWithScore]
+        The remaining nodes, highest score first.
+    """
+    kept: list[NodeWithScore] = []
+    for node in nodes:
+        text = node.node.get_content()
+        if any(text in other.node.get_content() for other in kept):
+            continue
+        contained = [other for other in kept if other.node.get_content() in text]
+        if contained:
+            node = NodeWithScore(
+                node=node.node, score=max(_score(node), *map(_score, contained))
+            )
+            kept = [other for other in kept if all(other is not c for c in contained)]
+        kept.append(node)
+    return sorted(kept, key=_score, reverse=True)
+
+
+def _score(node: NodeWithScore) -> float:
+    return node.score if node.score is not None else 0.0
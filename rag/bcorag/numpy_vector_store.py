@@ -0,0 +1,475 @@
+""" Vector store backed by a contiguous float32 matrix with normalized rows.
+
+The default llama-index SimpleVectorStore holds each embedding as a Python list
+of floats and scores every node in pure Python. Here a query is a single matrix
+vector product followed by an `argpartition` top k. The store persists to two
+files next to the rest of the index:
+
+- `<namespace>__vector_store.npy`: The embedding matrix, memory mapped on load
+  so loading an index doesn't read (or copy) the embeddings up front.
+- `<namespace>__vector_store.json`: The sidecar with the node ID, source
+  document ID and the flat (scalar valued) metadata of each row.
+"""
+
+import json
+import os
+from typing import Any
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.simple import _build_metadata_filter_fn
+from llama_index.core.vector_stores.types import (
+    DEFAULT_PERSIST_DIR,
+    DEFAULT_PERSIST_FNAME,
+    BasePydanticVectorStore,
+    FilterCondition,
+    FilterOperator,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+
+NAMESPACE_SEP = "__"
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """In memory vector store over a float32 embedding matrix. Stores only the
+    embeddings (and the metadata needed for filtering), the node text lives in
+    the docstore.
+    """
+
+    stores_text: bool = False
+
+    _matrix: np.ndarray = PrivateAttr()
+    _node_ids: list[str] = PrivateAttr()
+    _ref_doc_ids: list[str | None] = PrivateAttr()
+    _metadata: list[dict[str, Any]] = PrivateAttr()
+    _positions: dict[str, int] = PrivateAttr()
+    _postings: dict[str, dict[Any, np.ndarray]] = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._node_ids = []
+        self._ref_doc_ids = []
+        self._metadata = []
+        self._positions = {}
+        # metadata key -> value -> rows, built on the first filter on the key
+        self._postings = {}
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumpyVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """The normalized embedding matrix, one row per node."""
+        return self._matrix
+
+    @property
+    def node_ids(self) -> list[str]:
+        """The node ID of each row."""
+        return self._node_ids
+
+    def add(self, nodes: list[BaseNode], **add_kwargs: Any) -> list[str]:
+        """Adds the nodes' embeddings. Nodes already in the store are replaced.
+
+        Parameters
+        ----------
+        nodes : list[BaseNode]
+            The embedded nodes.
+
+        Returns
+        -------
+        list[str]
+            The node IDs.
+        """
+        if not nodes:
+            return []
+        replaced = [node.node_id for node in nodes if node.node_id in self._positions]
+        if replaced:
+            self._delete_rows(set(replaced))
+        vectors = _normalize(
+            np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        )
+        offset = len(self._node_ids)
+        if self._matrix.size == 0:
+            self._matrix = vectors
+        else:
+            self._matrix = np.concatenate([self._matrix, vectors])
+        for row, node in enumerate(nodes, start=offset):
+            self._node_ids.append(node.node_id)
+            self._ref_doc_ids.append(node.ref_doc_id)
+            self._metadata.append(_flat_metadata(node.metadata))
+            self._positions[node.node_id] = row
+        self._postings = {}
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        """Deletes the nodes built from a source document.
+
+        Parameters
+        ----------
+        ref_doc_id : str
+            The source document ID.
+        """
+        self._delete_rows(
+            {
+                node_id
+                for node_id, doc_id in zip(self._node_ids, self._ref_doc_ids)
+                if doc_id == ref_doc_id
+            }
+        )
+
+    def delete_nodes(
+        self,
+        node_ids: list[str] | None = None,
+        filters: MetadataFilters | None = None,
+        **delete_kwargs: Any,
+    ) -> None:
+        """Deletes nodes in a single pass over the matrix.
+
+        Parameters
+        ----------
+        node_ids : list[str] or None (default: None)
+            The node IDs to delete.
+        filters : MetadataFilters or None (default: None)
+            Restricts the deletion to the nodes matching the filters.
+        """
+        if node_ids is None and filters is None:
+            return
+        rows = self.candidate_rows(
+            VectorStoreQuery(node_ids=node_ids, filters=filters)
+        )
+        self._delete_rows({self._node_ids[row] for row in rows})  # type: ignore
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        """Scores every candidate row against the query embedding (cosine
+        similarity) and returns the top k.
+
+        Parameters
+        ----------
+        query : VectorStoreQuery
+            The query, metadata filters and node ID restrictions select the
+            candidate rows.
+
+        Returns
+        -------
+        VectorStoreQueryResult
+            The top k node IDs and similarities, most similar first.
+        """
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"Unsupported query mode: {query.mode}")
+        rows = self.candidate_rows(query)
+        if len(self._node_ids) == 0 or (rows is not None and len(rows) == 0):
+            return VectorStoreQueryResult(nodes=None, similarities=[], ids=[])
+        query_vector = _normalize(
+            np.asarray(query.query_embedding, dtype=np.float32)[None, :]
+        )[0]
+        matrix = self._matrix if rows is None else self._matrix[rows]
+        scores = matrix @ query_vector
+        top_rows, top_scores = top_k(scores, query.similarity_top_k)
+        if rows is not None:
+            top_rows = rows[top_rows]
+        return VectorStoreQueryResult(
+            nodes=None,
+            similarities=top_scores.tolist(),
+            ids=[self._node_ids[row] for row in top_rows],
+        )
+
+    def candidate_rows(self, query: VectorStoreQuery) -> np.ndarray | None:
+        """Applies the query's metadata filters and node ID restrictions.
+
+        Parameters
+        ----------
+        query : VectorStoreQuery
+            The query.
+
+        Returns
+        -------
+        np.ndarray or None
+            The candidate row indices, None if every row is a candidate.
+        """
+        if query.filters is None and query.node_ids is None and query.doc_ids is None:
+            return None
+        rows = None
+        filter_fn = None
+        if query.filters is not None:
+            rows = self._filter_rows(query.filters)
+            if rows is None:
+                filter_fn = _build_metadata_filter_fn(
+                    lambda node_id: self._metadata[self._positions[node_id]],
+                    query.filters,
+                )
+        if query.node_ids is not None:
+            node_rows = np.asarray(
+                sorted(
+                    self._positions[node_id]
+                    for node_id in set(query.node_ids)
+                    if node_id in self._positions
+                ),
+                dtype=np.int64,
+            )
+            rows = (
+                node_rows
+                if rows is None
+                else np.intersect1d(rows, node_rows, assume_unique=True)
+            )
+        if rows is None:
+            rows = np.arange(len(self._node_ids), dtype=np.int64)
+        if query.doc_ids is not None or filter_fn is not None:
+            doc_ids = set(query.doc_ids) if query.doc_ids is not None else None
+            rows = np.asarray(
+                [
+                    row
+                    for row in rows.tolist()
+                    if (doc_ids is None or self._ref_doc_ids[row] in doc_ids)
+                    and (filter_fn is None or filter_fn(self._node_ids[row]))
+                ],
+                dtype=np.int64,
+            )
+        return rows
+
+    def _filter_rows(self, filters: MetadataFilters) -> np.ndarray | None:
+        """Resolves equality (`==` and `in`) metadata filters through the
+        posting lists, so the cost of a filter is proportional to the number of
+        rows it matches rather than to the size of the store.
+
+        Parameters
+        ----------
+        filters : MetadataFilters
+            The filters.
+
+        Returns
+        -------
+        np.ndarray or None
+            The matching rows in ascending order, None if the filters use any
+            other operator (or unhashable values).
+        """
+        matches = []
+        for metadata_filter in filters.filters:
+            if not hasattr(metadata_filter, "operator"):
+                # nested filters
+                return None
+            if metadata_filter.operator == FilterOperator.EQ:
+                values = [metadata_filter.value]
+            elif metadata_filter.operator == FilterOperator.IN:
+                values = list(metadata_filter.value)  # type: ignore
+            else:
+                return None
+            try:
+                postings = self._key_postings(metadata_filter.key)
+                matched = [postings[value] for value in values if value in postings]
+            except TypeError:
+                return None
+            matches.append(
+                np.unique(np.concatenate(matched))
+                if matched
+                else np.zeros(0, dtype=np.int64)
+            )
+        if not matches:
+            return None
+        rows = matches[0]
+        for matched in matches[1:]:
+            if filters.condition == FilterCondition.OR:
+                rows = np.union1d(rows, matched)
+            else:
+                rows = np.intersect1d(rows, matched, assume_unique=True)
+        return rows
+
+    def _key_postings(self, key: str) -> dict[Any, np.ndarray]:
+        """Builds (once per key) the rows holding each value of a metadata key.
+
+        Parameters
+        ----------
+        key : str
+            The metadata key.
+
+        Returns
+        -------
+        dict[Any, np.ndarray]
+            The rows of each value, in ascending order.
+        """
+        if key not in self._postings:
+            grouped: dict[Any, list[int]] = {}
+            for row, metadata in enumerate(self._metadata):
+                value = metadata.get(key)
+                if value is not None:
+                    grouped.setdefault(value, []).append(row)
+            self._postings[key] = {
+                value: np.asarray(rows, dtype=np.int64)
+                for value, rows in grouped.items()
+            }
+        return self._postings[key]
+
+    def persist(
+        self,
+        persist_path: str = os.path.join(DEFAULT_PERSIST_DIR, DEFAULT_PERSIST_FNAME),
+        fs: Any = None,
+    ) -> None:
+        """Persists the embedding matrix and the sidecar, each replaced
+        atomically.
+
+        Parameters
+        ----------
+        persist_path : str
+            The sidecar path (the `.json` vector store path the storage context
+            passes in), the matrix is written next to it as a `.npy` file.
+        """
+        os.makedirs(os.path.dirname(persist_path) or ".", exist_ok=True)
+        matrix_path = f"{os.path.splitext(persist_path)[0]}.npy"
+        tmp_path = f"{matrix_path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, np.ascontiguousarray(self._matrix))
+        os.replace(tmp_path, matrix_path)
+        tmp_path = f"{persist_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "node_ids": self._node_ids,
+                    "ref_doc_ids": self._ref_doc_ids,
+                    "metadata": self._metadata,
+                },
+                f,
+            )
+        os.replace(tmp_path, persist_path)
+
+    @classmethod
+    def from_persist_path(
+        cls, persist_path: str, mmap: bool = True, **kwargs: Any
+    ) -> "NumpyVectorStore":
+        """Loads a persisted store, a ValueError is raised if the matrix rows
+        don't match the sidecar nodes (an interrupted persist).
+
+        Parameters
+        ----------
+        persist_path : str
+            The sidecar path.
+        mmap : bool (default: True)
+            Whether to memory map the embedding matrix (read only, copied on the
+            first add or delete).
+        **kwargs
+            Passed to the constructor.
+
+        Returns
+        -------
+        NumpyVectorStore
+            The loaded store.
+        """
+        store = cls(**kwargs)
+        matrix_path = f"{os.path.splitext(persist_path)[0]}.npy"
+        store._matrix = np.load(matrix_path, mmap_mode="r" if mmap else None)
+        with open(persist_path, "r") as f:
+            sidecar = json.load(f)
+        store._node_ids = sidecar["node_ids"]
+        store._ref_doc_ids = sidecar["ref_doc_ids"]
+        store._metadata = sidecar["metadata"]
+        if len(store._matrix) != len(store._node_ids):
+            raise ValueError(
+                f"Vector store at `{persist_path}` has {len(store._matrix)} embeddings "
+                f"for {len(store._node_ids)} nodes, the persist was interrupted."
+            )
+        store._positions = {node_id: row for row, node_id in enumerate(store._node_ids)}
+        return store
+
+    @classmethod
+    def from_persist_dir(
+        cls,
+        persist_dir: str,
+        namespace: str = "default",
+        mmap: bool = True,
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        """Loads the store persisted by a storage context.
+
+        Parameters
+        ----------
+        persist_dir : str
+            The storage context persist directory.
+        namespace : str (default: "default")
+            The vector store namespace.
+        mmap : bool (default: True)
+            Whether to memory map the embedding matrix.
+        **kwargs
+            Passed to the constructor.
+
+        Returns
+        -------
+        NumpyVectorStore
+            The loaded store.
+        """
+        return cls.from_persist_path(
+            os.path.join(persist_dir, f"{namespace}{NAMESPACE_SEP}{DEFAULT_PERSIST_FNAME}"),
+            mmap=mmap,
+            **kwargs,
+        )
+
+    def _delete_rows(self, node_ids: set[str]) -> list[int] | None:
+        """Deletes the rows of the nodes.
+
+        Parameters
+        ----------
+        node_ids : set[str]
+            The node IDs to delete.
+
+        Returns
+        -------
+        list[int] or None
+            The rows kept (in their previous numbering), None if nothing was
+            deleted.
+        """
+        if not node_ids:
+            return None
+        keep = [row for row, node_id in enumerate(self._node_ids) if node_id not in node_ids]
+        self._matrix = np.asarray(self._matrix[keep])
+        self._node_ids = [self._node_ids[row] for row in keep]
+        self._ref_doc_ids = [self._ref_doc_ids[row] for row in keep]
+        self._metadata = [self._metadata[row] for row in keep]
+        self._positions = {node_id: row for row, node_id in enumerate(self._node_ids)}
+        self._postings = {}
+        return keep
+
+
+def top_k(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Selects the k highest scores with argpartition (linear time) and sorts
+    only those.
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        The scores.
+    k : int
+        The number of scores to select.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        The indices and the scores of the top k, highest first.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=scores.dtype)
+    if k < len(scores):
+        indices = np.argpartition(-scores, k - 1)[:k]
+    else:
+        indices = np.arange(len(scores))
+    indices = indices[np.argsort(-scores[indices], kind="stable")]
+    return indices, scores[indices]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+
+def _flat_metadata(metadata: dict[str, Any]) -> dict[str, Any]:
+    return {
+        key: value
+        for key, value in metadata.items()
+        if isinstance(value, (str, int, float, bool)) or value is None
+    }
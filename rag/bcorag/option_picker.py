@@ -32,7 +32,8 @@ def initialize_picker(filetype: str = "pdf") -> dict | None:
             "loader": <value>,
             "embedding_model: <value>,
             "vector_store": <value>,
-            "llm": <value>
+            "llm": <value>,
+            "git_data": [{"user": <value>, "repo": <value>}, ...]
         }
         or None if the user selects to exit at any point in the process.
     """
@@ -63,10 +64,7 @@ def initialize_picker(filetype: str = "pdf") -> dict | None:
     repo_data = _repo_picker()
     if repo_data is None:
         return None
-    if repo_data["user"] is None:
-        return_data["git_data"] = None
-    else:
-        return_data["git_data"] = repo_data
+    return_data["git_data"] = repo_data
 
     return return_data
 
@@ -98,31 +96,56 @@ def _file_picker(path: str, filetype: str = "pdf") -> Tuple[str, str] | None:
     return str(option), f"{path}{option}"
 
 
-def _repo_picker() -> dict | None:
-    """Allows the user to input a github repository link to be included in the indexing.
+def _repo_picker() -> list[dict] | None:
+    """Allows the user to input any number of github repository links to be
+    included in the indexing, one at a time.
 
     Returns
     -------
-    dict or None
-        Returns parsed repo information from the link or None if the user exits.
+    list[dict] or None
+        Returns the parsed repo information from each link (empty if the user
+        skips) or None if the user exits.
     """
-    pattern = r"https://github\.com/([^/]+)/([^/]+)"
-    return_data: dict[str, str | None] = {"user": None, "repo": None}
+    return_data: list[dict] = []
     while True:
-        url = input(
-            'If you would like to include a Github repository enter the URL below. Enter "x" to exit or leave blank to skip.\n'
-        )
+        if not return_data:
+            prompt = 'If you would like to include a Github repository enter the URL below. Enter "x" to exit or leave blank to skip.\n'
+        else:
+            prompt = 'Enter another Github repository URL below. Enter "x" to exit or leave blank to finish.\n'
+        url = input(prompt)
         url = url.strip()
         if not url or url is None:
             return return_data
         elif url == "x":
             return None
-        match = re.match(pattern, url.lower())
-        if match is None:
+        parsed_data = parse_repo_url(url)
+        if parsed_data is None:
             print("Error parsing repository URL.")
             continue
-        return_data = {"user": match.groups()[0], "repo": match.groups()[1]}
-        return return_data
+        if parsed_data in return_data:
+            print("Repository already included.")
+            continue
+        return_data.append(parsed_data)
+
+
+def parse_repo_url(url: str) -> dict | None:
+    """Parses the repository owner and name from a Github repository URL.
+
+    Parameters
+    ----------
+    url : str
+        The Github repository URL.
+
+    Returns
+    -------
+    dict or None
+        The parsed repo information or None if the URL could not be parsed.
+    """
+    pattern = r"https://github\.com/([^/]+)/([^/]+)"
+    match = re.match(pattern, url.strip().lower())
+    if match is None:
+        return None
+    return {"user": match.groups()[0], "repo": match.groups()[1]}
 
 
 def _create_picker(
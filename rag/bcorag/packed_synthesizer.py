@@ -0,0 +1,270 @@
+""" Single call response synthesizer packing the retrieved nodes into a token
+budget.
+
+The default compact synthesizer falls back to a refine loop (one LLM call per
+chunk of context) when the retrieved text and the domain prompt don't fit in
+the context window. The packed synthesizer instead fits the context to a fixed
+budget up front, so every domain costs exactly one LLM call:
+
+- The budget is the LLM's context window, less the tokens reserved for the
+  output and the tokens of the prompt template with the query prompt, capped
+  by `max_context_tokens` if set.
+- Nodes whose text is contained in a higher scoring node's text are dropped.
+- The nodes are packed highest score first, nodes that don't fit in what's
+  left of the budget are dropped. If not even the best node fits, its text is
+  truncated to the budget.
+
+Tokens are counted with the tiktoken encoding of the LLM.
+"""
+
+from typing import Any, Sequence
+from llama_index.core.base.response.schema import RESPONSE_TYPE
+from llama_index.core.llms import LLM
+from llama_index.core.response_synthesizers import SimpleSummarize
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from llama_index.core.types import RESPONSE_TEXT_TYPE
+import bcorag.misc_functions as misc_fns
+from bcorag.schema_slicer import encoding_for
+from bcorag.tracing import annotate
+
+# output tokens reserved when the LLM has no max tokens set
+DEFAULT_OUTPUT_TOKENS = 2048
+# headroom for the chat message formatting and tokenizer differences
+PROMPT_MARGIN_TOKENS = 64
+# the packed node texts are joined with this separator
+CHUNK_SEPARATOR = "\n\n"
+
+
+class PackedSynthesizer(SimpleSummarize):
+    """Synthesizer making exactly one LLM call over a token budgeted context."""
+
+    def __init__(
+        self,
+        llm: LLM,
+        output_tokens: int = DEFAULT_OUTPUT_TOKENS,
+        max_context_tokens: int | None = None,
+        streaming: bool = False,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+        llm : LLM
+            The LLM.
+        output_tokens : int (default: DEFAULT_OUTPUT_TOKENS)
+            The tokens reserved for the response, if the LLM has no max tokens
+            set.
+        max_context_tokens : int or None (default: None)
+            Cap on the context tokens, None to fill the context window.
+        streaming : bool (default: False)
+            Whether to stream the response.
+        """
+        super().__init__(llm=llm, streaming=streaming)
+        self.output_tokens = output_tokens
+        self.max_context_tokens = max_context_tokens
+        self._encoding = encoding_for(llm.metadata.model_name)
+
+    @classmethod
+    def from_conf(
+        cls,
+        llm: LLM,
+        streaming: bool = False,
+        conf_path: str = "./bcorag/conf.json",
+    ) -> "PackedSynthesizer":
+        """Builds the synthesizer from the `packing` section of the
+        configuration file.
+
+        Parameters
+        ----------
+        llm : LLM
+            The LLM.
+        streaming : bool (default: False)
+            Whether to stream the response.
+        conf_path : str (default: "./bcorag/conf.json")
+            Path to the configuration file.
+
+        Returns
+        -------
+        PackedSynthesizer
+            The synthesizer.
+        """
+        return cls(llm, streaming=streaming, **misc_fns.load_json(conf_path)["packing"])
+
+    def count_tokens(self, text: str) -> int:
+        """Counts the tokens of a text with the LLM's encoding.
+
+        Parameters
+        ----------
+        text : str
+            The text.
+
+        Returns
+        -------
+        int
+            The token count.
+        """
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def context_budget(self, query_str: str) -> int:
+        """Computes the context token budget for a query.
+
+        Parameters
+        ----------
+        query_str : str
+            The query prompt.
+
+        Returns
+        -------
+        int
+            The tokens available for the packed node texts.
+        """
+        metadata = self._llm.metadata
+        output_tokens = (
+            metadata.num_output if metadata.num_output > 0 else self.output_tokens
+        )
+        prompt = self._text_qa_template.format(
+            llm=self._llm, context_str="", query_str=query_str
+        )
+        budget = (
+            metadata.context_window
+            - output_tokens
+            - self.count_tokens(prompt)
+            - PROMPT_MARGIN_TOKENS
+        )
+        if self.max_context_tokens is not None:
+            budget = min(budget, self.max_context_tokens)
+        return max(budget, 0)
+
+    def pack(self, query_str: str, nodes: list[NodeWithScore]) -> list[NodeWithScore]:
+        """Selects the nodes to send with the query prompt, within the context
+        budget. The context and packing token counts are added to the current
+        trace span.
+
+        Parameters
+        ----------
+        query_str : str
+            The query prompt.
+        nodes : list[NodeWithScore]
+            The retrieved nodes.
+
+        Returns
+        -------
+        list[NodeWithScore]
+            The packed nodes, highest score first.
+        """
+        budget = self.context_budget(query_str)
+        separator_tokens = self.count_tokens(CHUNK_SEPARATOR)
+        ranked = sorted(nodes, key=lambda node: node.score or 0.0, reverse=True)
+        packed: list[NodeWithScore] = []
+        packed_texts: list[str] = []
+        retrieved_tokens = 0
+        used = 0
+        for node in ranked:
+            text = node.node.get_content(metadata_mode=MetadataMode.LLM)
+            tokens = self.count_tokens(text)
+            retrieved_tokens += tokens
+            if any(text in packed_text for packed_text in packed_texts):
+                continue
+            cost = tokens + (separator_tokens if packed else 0)
+            if used + cost > budget:
+                continue
+            packed.append(node)
+            packed_texts.append(text)
+            used += cost
+        if not packed and ranked:
+            packed = [self._truncate(ranked[0], budget)]
+            used = budget
+        annotate(
+            context_budget=budget,
+            retrieved_tokens=retrieved_tokens,
+            context_tokens=used,
+            packed_nodes=len(packed),
+            dropped_nodes=len(nodes) - len(packed),
+        )
+        return packed
+
+    def synthesize(
+        self,
+        query: QueryBundle | str,
+        nodes: list[NodeWithScore],
+        additional_source_nodes: Sequence[NodeWithScore] | None = None,
+        **response_kwargs: Any,
+    ) -> RESPONSE_TYPE:
+        query_str = query.query_str if isinstance(query, QueryBundle) else query
+        return super().synthesize(
+            query,
+            self.pack(query_str, nodes),
+            additional_source_nodes,
+            **response_kwargs,
+        )
+
+    async def asynthesize(
+        self,
+        query: QueryBundle | str,
+        nodes: list[NodeWithScore],
+        additional_source_nodes: Sequence[NodeWithScore] | None = None,
+        **response_kwargs: Any,
+    ) -> RESPONSE_TYPE:
+        query_str = query.query_str if isinstance(query, QueryBundle) else query
+        return await super().asynthesize(
+            query,
+            self.pack(query_str, nodes),
+            additional_source_nodes,
+            **response_kwargs,
+        )
+
+    def get_response(
+        self, query_str: str, text_chunks: Sequence[str], **response_kwargs: Any
+    ) -> RESPONSE_TEXT_TYPE:
+        # the chunks are already packed to the budget, no truncation needed
+        text_qa_template = self._text_qa_template.partial_format(query_str=query_str)
+        context_str = CHUNK_SEPARATOR.join(text_chunks)
+        if self._streaming:
+            return self._llm.stream(
+                text_qa_template, context_str=context_str, **response_kwargs
+            )
+        return (
+            self._llm.predict(text_qa_template, context_str=context_str, **response_kwargs)
+            or "Empty Response"
+        )
+
+    async def aget_response(
+        self, query_str: str, text_chunks: Sequence[str], **response_kwargs: Any
+    ) -> RESPONSE_TEXT_TYPE:
+        text_qa_template = self._text_qa_template.partial_format(query_str=query_str)
+        context_str = CHUNK_SEPARATOR.join(text_chunks)
+        if self._streaming:
+            return await self._llm.astream(
+                text_qa_template, context_str=context_str, **response_kwargs
+            )
+        return (
+            await self._llm.apredict(
+                text_qa_template, context_str=context_str, **response_kwargs
+            )
+            or "Empty Response"
+        )
+
+    def _truncate(self, node: NodeWithScore, budget: int) -> NodeWithScore:
+        """Truncates a node's text so its content fits in the budget.
+
+        Parameters
+        ----------
+        node : NodeWithScore
+            The node.
+        budget : int
+            The token budget.
+
+        Returns
+        -------
+        NodeWithScore
+            A copy of the node with the truncated text.
+        """
+        content_tokens = self.count_tokens(
+            node.node.get_content(metadata_mode=MetadataMode.LLM)
+        )
+        text_tokens = self._encoding.encode(node.node.get_content(), disallowed_special=())
+        # the metadata header stays, only the text is cut
+        keep = max(len(text_tokens) - (content_tokens - budget), 0)
+        truncated = node.node.copy()
+        truncated.set_content(self._encoding.decode(text_tokens[:keep]))
+        return NodeWithScore(node=truncated, score=node.score)
@@ -0,0 +1,99 @@
+""" PDF ingestion stage. Page text extraction is split across a process pool
+(see bcorag.pdf_pages) and the extracted pages are cached on disk, keyed by the paper's content hash and
+the data loader, so repeated runs over the same paper skip parsing entirely.
+
+The documents match the ones built by the llama-index loaders (one document per
+page): `PDFReader` documents carry the `page_label` and `file_name` metadata,
+`SimpleDirectoryReader` documents also carry the file system metadata.
+"""
+
+import logging
+import os
+from llama_index.core.schema import Document
+from llama_index.core.readers.file.base import default_file_metadata_func
+import pypdf
+import bcorag.misc_functions as misc_fns
+from bcorag.pdf_pages import extract_pages
+
+# bumped whenever the cached page format or the extraction changes
+PDF_CACHE_VERSION = 1
+# metadata hidden from the embedding and LLM content by SimpleDirectoryReader
+_FILE_METADATA_EXCLUDED = [
+    "file_name",
+    "file_type",
+    "file_size",
+    "creation_date",
+    "last_modified_date",
+    "last_accessed_date",
+]
+
+
+def load_pdf(
+    filepath: str, loader: str, cache_dir: str, max_workers: int | None = None
+) -> tuple[list[Document], bool]:
+    """Loads a PDF into one document per page, extracting the page text in
+    parallel on a cache miss.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the PDF file.
+    loader : str
+        The data loader option (`PDFReader` or `SimpleDirectoryReader`).
+    cache_dir : str
+        The directory holding the extracted text cache.
+    max_workers : int or None (default: None)
+        The max number of extraction processes, defaults to the number of
+        processors.
+
+    Returns
+    -------
+    tuple[list[Document], bool]
+        The page documents and whether the extracted text came from the cache.
+    """
+    logger = logging.getLogger("bcorag")
+    misc_fns.check_dir(cache_dir)
+    cache_key = misc_fns.hash_data(
+        {
+            "paper": misc_fns.hash_file(filepath),
+            "loader": loader,
+            "pypdf": pypdf.__version__,
+            "version": PDF_CACHE_VERSION,
+        }
+    )
+    cache_path = os.path.join(cache_dir, f"{cache_key}.json")
+    pages = None
+    if os.path.isfile(cache_path):
+        try:
+            pages = misc_fns.load_json(cache_path)
+        except ValueError:
+            logger.warning(f"Corrupt extracted text cache entry `{cache_path}`.")
+    cache_hit = pages is not None
+    if pages is None:
+        pages = extract_pages(filepath, max_workers)
+        misc_fns.write_json(cache_path, pages)
+    logger.info(
+        f"Extracted text cache {'hit' if cache_hit else 'miss'} for `{filepath}` ({len(pages)} pages)."
+    )
+
+    file_name = os.path.basename(filepath)
+    file_metadata = (
+        default_file_metadata_func(filepath)
+        if loader == "SimpleDirectoryReader"
+        else {}
+    )
+    documents = []
+    for page in pages:
+        document = Document(
+            text=page["text"],
+            metadata={
+                "page_label": page["page_label"],
+                "file_name": file_name,
+                **file_metadata,
+            },
+        )
+        if file_metadata:
+            document.excluded_embed_metadata_keys.extend(_FILE_METADATA_EXCLUDED)
+            document.excluded_llm_metadata_keys.extend(_FILE_METADATA_EXCLUDED)
+        documents.append(document)
+    return documents, cache_hit
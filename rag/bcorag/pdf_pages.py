@@ -0,0 +1,87 @@
+""" Parallel PDF page text extraction. Kept free of any llama-index imports, the
+extraction worker processes are spawned and import this module on startup.
+"""
+
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pypdf
+
+# minimum number of pages per extraction worker, spinning up a worker process
+# costs more than extracting a few pages
+MIN_PAGES_PER_WORKER = 8
+
+
+def extract_pages(filepath: str, max_workers: int | None = None) -> list[dict]:
+    """Extracts the text of every page, splitting the pages into contiguous
+    ranges across a process pool. Falls back to extracting in process if the
+    pool breaks.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the PDF file.
+    max_workers : int or None (default: None)
+        The max number of extraction processes, defaults to the number of
+        processors.
+
+    Returns
+    -------
+    list[dict]
+        The `page_label` and `text` of each page, in page order.
+    """
+    page_count = len(pypdf.PdfReader(filepath).pages)
+    workers = min(
+        max_workers or os.cpu_count() or 1,
+        math.ceil(page_count / MIN_PAGES_PER_WORKER),
+    )
+    if workers <= 1:
+        return _extract_range(filepath, 0, page_count)
+    step = math.ceil(page_count / workers)
+    ranges = [
+        (start, min(start + step, page_count)) for start in range(0, page_count, step)
+    ]
+    # spawn rather than fork, the parent may be holding locks or threads
+    context = multiprocessing.get_context("spawn")
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            results = executor.map(
+                _extract_range,
+                [filepath] * len(ranges),
+                [start for start, _ in ranges],
+                [stop for _, stop in ranges],
+            )
+            return [page for pages in results for page in pages]
+    except BrokenProcessPool as e:
+        logging.getLogger("bcorag").warning(
+            f"PDF extraction pool failed ({e}), extracting `{filepath}` in process."
+        )
+        return _extract_range(filepath, 0, page_count)
+
+
+def _extract_range(filepath: str, start: int, stop: int) -> list[dict]:
+    """Extracts the text of a range of pages (run in the worker processes, each
+    worker parses the file on its own).
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the PDF file.
+    start : int
+        The first page index.
+    stop : int
+        The page index to stop at (exclusive).
+
+    Returns
+    -------
+    list[dict]
+        The `page_label` and `text` of each page in the range.
+    """
+    pdf = pypdf.PdfReader(filepath)
+    return [
+        {"page_label": pdf.page_labels[page], "text": pdf.pages[page].extract_text()}
+        for page in range(start, stop)
+    ]
@@ -3,12 +3,24 @@
 QUERY_PROMPT: The standard wrapper used for each prompt.
 _TOP_LEVEL_SCHEMA: The entire top level 2791 object schema.
 SUPPLEMENT_PROMPT: Supplementary prompt for the domains that require the top level schema.
+SLICED_SUPPLEMENT_PROMPT: Supplementary prompt carrying only the referenced top level definitions.
+REPAIR_PROMPT: The prompt to repair a response that failed schema validation.
 USABILITY_DOMAIN: The usability domain specific prompt and schema.
 IO_DOMAIN: The IO domain specific prompt and schema.
 DESCRIPTION_DOMAIN: The description domain specific prompt and schema.
 EXECUTION_DOMAIN: The execution domain specific prompt and schema.
 PARAMETRIC_DOMAIN: The parametric domain specific prompt and schema.
 ERROR_DOMAIN: The error domain specific prompt and schema.
+USABILITY_RETRIEVAL: The usability domain retrieval queries.
+IO_RETRIEVAL: The IO domain retrieval queries.
+DESCRIPTION_RETRIEVAL: The description domain retrieval queries.
+EXECUTION_RETRIEVAL: The execution domain retrieval queries.
+PARAMETRIC_RETRIEVAL: The parametric domain retrieval queries.
+ERROR_RETRIEVAL: The error domain retrieval queries.
+
+The retrieval queries are what is embedded and searched for each domain, the
+domain prompts (with their schemas) are only sent to the LLM for synthesis. The
+nodes retrieved by each query of a domain are merged into one ranking.
 """
 
 QUERY_PROMPT = "Can you give me a BioCompute Object {} domain for the provided paper. The return response must be valid JSON and must validate against the JSON schema I am providing you. {}"
@@ -196,6 +208,10 @@ _TOP_LEVEL_SCHEMA = """
 
 SUPPLEMENT_PROMPT = f"Some of the fields are defined in the top level 2791object JSON schema which is as follows: {_TOP_LEVEL_SCHEMA}"
 
+SLICED_SUPPLEMENT_PROMPT = "Some of the fields reference definitions in the top level 2791object JSON schema, the referenced definitions are as follows: {}"
+
+REPAIR_PROMPT = "The following BioCompute Object {} domain JSON failed validation against its JSON schema. Fix only the listed errors and return the corrected JSON with no additional text.\nErrors:\n{}\nJSON:\n{}"
+
 USABILITY_DOMAIN = """The Usability domain in a BioCompute Object is a plain languages description
 of what was done in the project or paper workflow. The Usasability domain conveys the purpose
 of the Biocompute Object. The JSON schema is as follows:
@@ -634,3 +650,31 @@ ERROR_DOMAIN = """The error domain can be used to determine what range of input
     }
 }
 """
+
+USABILITY_RETRIEVAL = [
+    "What problem does this study address, what is the purpose of the method and how can its results be used?",
+]
+
+IO_RETRIEVAL = [
+    "Input data, datasets, file formats, accession numbers and download sources used in the analysis.",
+    "Output files, result tables and figures produced by the workflow.",
+]
+
+DESCRIPTION_RETRIEVAL = [
+    "The steps of the analysis workflow in order, with the software tool used in each step.",
+    "Software tools, packages and versions used, with keywords and related publications.",
+]
+
+EXECUTION_RETRIEVAL = [
+    "Scripts, commands and code repository used to run the pipeline.",
+    "Software dependencies, installation, environment variables, containers and hardware requirements.",
+]
+
+PARAMETRIC_RETRIEVAL = [
+    "Parameter settings, thresholds, cutoffs and options given to each tool or step.",
+]
+
+ERROR_RETRIEVAL = [
+    "Error rates, accuracy, false positives, false negatives, limits of detection and statistical confidence.",
+    "Limitations and sources of algorithmic error or uncertainty in the method.",
+]
@@ -0,0 +1,247 @@
+""" Include/exclude policy for the supplementary repository files, applied before
+anything is chunked and embedded.
+
+Files are filtered in three passes:
+
+1. On the tree listing, before downloading: the file extension (or name), the
+   excluded path globs and the max file size (except for notebooks).
+2. On the prepared file content (see prepare_text()): the max file size, binary
+   files, generated files (generated file markers in the header) and minified
+   files.
+3. A total token budget: the remaining files are ranked by the priority globs
+   (READMEs, workflow definitions and entry point scripts first), then by path
+   depth and size, and kept until the budget runs out.
+
+Jupyter notebooks are reduced to their cell sources, dropping the embedded
+outputs, before the content rules so a notebook isn't excluded for the size or
+the long base64 lines of its outputs.
+
+Glob patterns without a `/` are matched against the file name, patterns with a
+`/` against the full path (a leading `**/` also matches at the repository root).
+The policy is set in the `repo_filter` section of the configuration file.
+"""
+
+import json
+from fnmatch import fnmatch
+from functools import lru_cache
+from typing import Any
+import tiktoken
+import bcorag.misc_functions as misc_fns
+
+# the token budget is counted in the OpenAI embedding model tokens
+_BUDGET_ENCODING = "cl100k_base"
+
+# header lines that mark a file as generated
+_GENERATED_MARKERS = (
+    "@generated",
+    "do not edit",
+    "auto-generated",
+    "autogenerated",
+    "generated by",
+)
+# number of leading lines searched for the generated file markers
+_HEADER_LINES = 5
+# average line length above which a file is considered minified
+_MINIFIED_LINE_LENGTH = 300
+# notebook extension, notebooks are stripped of their outputs
+_NOTEBOOK_EXTENSION = ".ipynb"
+
+
+class RepoFilter:
+    """The supplementary repository file policy."""
+
+    def __init__(self, policy: dict[str, Any]):
+        """Constructor.
+
+        Parameters
+        ----------
+        policy : dict[str, Any]
+            The policy, with the `include_extensions`, `include_names`,
+            `exclude_globs`, `max_file_bytes`, `token_budget` and
+            `priority_globs` entries. Also part of the index cache key.
+        """
+        self.policy = policy
+        self._extensions = {ext.lower() for ext in self.policy["include_extensions"]}
+        self._names = set(self.policy["include_names"])
+
+    @classmethod
+    def from_conf(cls, conf_path: str = "./bcorag/conf.json") -> "RepoFilter":
+        """Builds the policy from the `repo_filter` section of the configuration
+        file.
+
+        Parameters
+        ----------
+        conf_path : str (default: "./bcorag/conf.json")
+            Path to the configuration file.
+
+        Returns
+        -------
+        RepoFilter
+            The policy.
+        """
+        return cls(misc_fns.load_json(conf_path)["repo_filter"])
+
+    def check_path(self, path: str, size: int) -> str | None:
+        """Checks a file against the path and size rules. The size rule isn't
+        applied to notebooks, their raw size includes the outputs that are
+        stripped (see check_content()).
+
+        Parameters
+        ----------
+        path : str
+            The file path within the repository.
+        size : int
+            The file size in bytes.
+
+        Returns
+        -------
+        str or None
+            The reason the file is excluded, None if it is included.
+        """
+        name = path.rsplit("/", 1)[-1]
+        extension = f".{name.rsplit('.', 1)[-1].lower()}" if "." in name else ""
+        if name not in self._names and extension not in self._extensions:
+            return "file type"
+        if any(_glob_match(path, pattern) for pattern in self.policy["exclude_globs"]):
+            return "excluded path"
+        too_large = size > self.policy["max_file_bytes"]
+        if too_large and extension != _NOTEBOOK_EXTENSION:
+            return "too large"
+        return None
+
+    def check_content(self, text: str) -> str | None:
+        """Checks a file against the content rules, including the size rule on
+        the prepared text.
+
+        Parameters
+        ----------
+        text : str
+            The prepared file text (see prepare_text()).
+
+        Returns
+        -------
+        str or None
+            The reason the file is excluded, None if it is included.
+        """
+        if len(text.encode("utf-8")) > self.policy["max_file_bytes"]:
+            return "too large"
+        if "\0" in text:
+            return "binary"
+        header = "\n".join(text.splitlines()[:_HEADER_LINES]).lower()
+        if any(marker in header for marker in _GENERATED_MARKERS):
+            return "generated"
+        line_count = text.count("\n") + 1
+        if len(text) > 1000 and len(text) / line_count > _MINIFIED_LINE_LENGTH:
+            return "generated"
+        return None
+
+    def priority(self, path: str) -> int:
+        """Ranks a file by the first priority glob it matches.
+
+        Parameters
+        ----------
+        path : str
+            The file path within the repository.
+
+        Returns
+        -------
+        int
+            The rank, lower is more important.
+        """
+        for rank, pattern in enumerate(self.policy["priority_globs"]):
+            if _glob_match(path, pattern):
+                return rank
+        return len(self.policy["priority_globs"])
+
+    def apply_budget(self, files: list[tuple[str, int]]) -> tuple[set[str], set[str]]:
+        """Keeps the highest priority files within the token budget.
+
+        Parameters
+        ----------
+        files : list[tuple[str, int]]
+            The path and token count of each file.
+
+        Returns
+        -------
+        tuple[set[str], set[str]]
+            The paths kept and the paths dropped.
+        """
+        ranked = sorted(
+            files,
+            key=lambda file: (
+                self.priority(file[0]),
+                file[0].count("/"),
+                file[1],
+                file[0],
+            ),
+        )
+        kept: set[str] = set()
+        dropped: set[str] = set()
+        remaining = self.policy["token_budget"]
+        for path, tokens in ranked:
+            if tokens <= remaining:
+                kept.add(path)
+                remaining -= tokens
+            else:
+                dropped.add(path)
+        return kept, dropped
+
+
+def prepare_text(path: str, text: str) -> str:
+    """Prepares a file's text for embedding. Notebooks are reduced to their cell
+    sources, any other file is returned as is.
+
+    Parameters
+    ----------
+    path : str
+        The file path within the repository.
+    text : str
+        The file text.
+
+    Returns
+    -------
+    str
+        The text to embed.
+    """
+    if not path.lower().endswith(_NOTEBOOK_EXTENSION):
+        return text
+    try:
+        notebook = json.loads(text)
+    except ValueError:
+        return text
+    cells = []
+    for cell in notebook.get("cells", []):
+        source = cell.get("source", "")
+        source = "".join(source) if isinstance(source, list) else source
+        if source.strip():
+            cells.append(f"# [{cell.get('cell_type', 'code')}]\n{source}")
+    return "\n\n".join(cells)
+
+
+def count_tokens(text: str) -> int:
+    """Counts the tokens of a file's text for the token budget.
+
+    Parameters
+    ----------
+    text : str
+        The prepared file text.
+
+    Returns
+    -------
+    int
+        The token count.
+    """
+    return len(_encoding().encode_ordinary(text))
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> tiktoken.Encoding:
+    return tiktoken.get_encoding(_BUDGET_ENCODING)
+
+
+def _glob_match(path: str, pattern: str) -> bool:
+    if "/" not in pattern:
+        return fnmatch(path.rsplit("/", 1)[-1], pattern)
+    if fnmatch(path, pattern):
+        return True
+    return pattern.startswith("**/") and fnmatch(path, pattern[3:])
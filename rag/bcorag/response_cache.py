@@ -0,0 +1,313 @@
+""" Content addressed, disk backed cache for LLM responses.
+
+The cache key is a hash of the model, the model settings, the synthesizer
+settings and the full synthesized prompt (which includes the retrieved node
+text), so a response is only reused when the exact same request would have
+been sent to the API.
+"""
+
+import json
+import logging
+import os
+from typing import Any, Sequence
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseGen,
+    CompletionResponse,
+)
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.llms.openai import OpenAI  # type: ignore
+import bcorag.misc_functions as misc_fns
+from bcorag.tracing import annotate
+
+# default byte budget for the on-disk response cache (256 MiB)
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class ResponseCache:
+    """Disk backed key/value store for LLM responses with least recently used
+    eviction down to a byte budget. Each entry is a JSON file named after its
+    key, recency is tracked through the file modification time so it is shared
+    between processes using the same cache directory.
+    """
+
+    def __init__(
+        self, cache_dir: str, max_bytes: int = DEFAULT_MAX_BYTES, bypass: bool = False
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+        cache_dir : str
+            The directory to store the cache entries in.
+        max_bytes : int (default: DEFAULT_MAX_BYTES)
+            The byte budget for the cache entries, the least recently used entries
+            are evicted once the budget is exceeded.
+        bypass : bool (default: False)
+            Whether to bypass cache lookups. Fresh responses are still written to
+            the cache so it stays current.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._total_bytes = sum(size for _, _, size in self._entries())
+
+    def get(self, key: str) -> dict | None:
+        """Looks up a cache entry and marks it as recently used.
+
+        Parameters
+        ----------
+        key : str
+            The cache key.
+
+        Returns
+        -------
+        dict or None
+            The cached value or None on a cache miss (or if bypassing the cache).
+        """
+        if self.bypass:
+            self.misses += 1
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                value = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: dict):
+        """Writes a cache entry and evicts the least recently used entries if the
+        byte budget is exceeded.
+
+        Parameters
+        ----------
+        key : str
+            The cache key.
+        value : dict
+            The JSON serializable value to store.
+        """
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            previous_size = os.path.getsize(path) if os.path.isfile(path) else 0
+            with open(tmp_path, "w") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+            self._total_bytes += os.path.getsize(path) - previous_size
+        except OSError as e:
+            logging.getLogger("bcorag").error(
+                f"Failed to write response cache entry `{path}`.\n{e}"
+            )
+            return
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        """Evicts the least recently used entries until the cache fits within the
+        byte budget.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self._total_bytes = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # already evicted by another process
+                pass
+            self._total_bytes -= size
+
+    def _entries(self) -> list[tuple[str, float, int]]:
+        """Lists the cache entries.
+
+        Returns
+        -------
+        list[tuple[str, float, int]]
+            The path, last used time and size in bytes of each entry.
+        """
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+
+class CachedOpenAI(OpenAI):
+    """OpenAI LLM with a response cache in front of the chat (including streamed
+    chat) and completion calls. Cache hits skip the API call entirely (and so do
+    not emit LLM callback events). Whether the lookup hit is recorded on the
+    current trace span.
+    """
+
+    _response_cache: ResponseCache = PrivateAttr()
+    _cache_namespace: str = PrivateAttr()
+
+    def __init__(
+        self, response_cache: ResponseCache, cache_namespace: str = "", **kwargs: Any
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+        response_cache : ResponseCache
+            The response cache to read from and write to.
+        cache_namespace : str (default: "")
+            Extra settings that affect the response but are not part of the
+            request itself (e.g. the response synthesizer settings).
+        **kwargs
+            Passed through to the OpenAI LLM.
+        """
+        super().__init__(**kwargs)
+        self._response_cache = response_cache
+        self._cache_namespace = cache_namespace
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "cached_openai_llm"
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        key = self._cache_key("chat", _serialize_messages(messages), kwargs)
+        cached = self._response_cache.get(key)
+        annotate(cache_hit=cached is not None)
+        if cached is not None:
+            return _chat_response(cached)
+        response = super().chat(messages, **kwargs)
+        self._response_cache.put(key, _serialize_message(response.message))
+        return response
+
+    def stream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseGen:
+        key = self._cache_key("chat", _serialize_messages(messages), kwargs)
+        cached = self._response_cache.get(key)
+        annotate(cache_hit=cached is not None)
+        if cached is not None:
+            return _cached_stream(cached)
+        return self._caching_stream(key, super().stream_chat(messages, **kwargs))
+
+    def _caching_stream(self, key: str, response_gen: ChatResponseGen) -> ChatResponseGen:
+        """Passes a streamed response through, caching it once the stream has been
+        fully consumed. Partially consumed streams are not cached.
+
+        Parameters
+        ----------
+        key : str
+            The cache key.
+        response_gen : ChatResponseGen
+            The streamed response from the LLM.
+
+        Yields
+        ------
+        ChatResponse
+            The streamed response chunks.
+        """
+        last_response = None
+        for last_response in response_gen:
+            yield last_response
+        if last_response is not None:
+            self._response_cache.put(key, _serialize_message(last_response.message))
+
+    async def achat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponse:
+        key = self._cache_key("chat", _serialize_messages(messages), kwargs)
+        cached = self._response_cache.get(key)
+        annotate(cache_hit=cached is not None)
+        if cached is not None:
+            return _chat_response(cached)
+        response = await super().achat(messages, **kwargs)
+        self._response_cache.put(key, _serialize_message(response.message))
+        return response
+
+    def complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        key = self._cache_key("complete", [prompt, formatted], kwargs)
+        cached = self._response_cache.get(key)
+        annotate(cache_hit=cached is not None)
+        if cached is not None:
+            return CompletionResponse(text=cached["text"])
+        response = super().complete(prompt, formatted, **kwargs)
+        self._response_cache.put(key, {"text": response.text})
+        return response
+
+    async def acomplete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        key = self._cache_key("complete", [prompt, formatted], kwargs)
+        cached = self._response_cache.get(key)
+        annotate(cache_hit=cached is not None)
+        if cached is not None:
+            return CompletionResponse(text=cached["text"])
+        response = await super().acomplete(prompt, formatted, **kwargs)
+        self._response_cache.put(key, {"text": response.text})
+        return response
+
+    def _cache_key(self, call_type: str, payload: list, kwargs: dict) -> str:
+        """Builds the cache key for a request.
+
+        Parameters
+        ----------
+        call_type : str
+            The type of call ("chat" or "complete").
+        payload : list
+            The serialized request payload (the messages or the prompt).
+        kwargs : dict
+            The per call keyword arguments.
+
+        Returns
+        -------
+        str
+            The hex digest cache key.
+        """
+        return misc_fns.hash_data(
+            {
+                "call_type": call_type,
+                "model": self.model,
+                "temperature": self.temperature,
+                "max_tokens": self.max_tokens,
+                "additional_kwargs": repr(sorted(self.additional_kwargs.items())),
+                "call_kwargs": repr(sorted(kwargs.items())),
+                "namespace": self._cache_namespace,
+                "payload": payload,
+            }
+        )
+
+
+def _serialize_message(message: ChatMessage) -> dict:
+    return {"role": message.role.value, "content": message.content}
+
+
+def _serialize_messages(messages: Sequence[ChatMessage]) -> list[dict]:
+    return [_serialize_message(message) for message in messages]
+
+
+def _cached_stream(cached: dict) -> ChatResponseGen:
+    yield ChatResponse(
+        message=ChatMessage(role=cached["role"], content=cached["content"]),
+        delta=cached["content"],
+    )
+
+
+def _chat_response(cached: dict) -> ChatResponse:
+    return ChatResponse(
+        message=ChatMessage(role=cached["role"], content=cached["content"])
+    )
@@ -0,0 +1,245 @@
+""" Slices the top level 2791object schema down to the definitions a domain
+schema actually references and minifies the schemas sent to the LLM.
+"""
+
+import json
+import tiktoken
+from functools import lru_cache
+from typing import Any
+from bcorag.prompts import (
+    QUERY_PROMPT,
+    SUPPLEMENT_PROMPT,
+    SLICED_SUPPLEMENT_PROMPT,
+    _TOP_LEVEL_SCHEMA,
+)
+
+# prefix of the top level schema definitions as referenced from a domain schema
+_TOP_LEVEL_REF_PREFIX = "2791object.json#/definitions/"
+# prefix of the definitions as referenced from within the top level schema
+_LOCAL_REF_PREFIX = "#/definitions/"
+# marker separating the domain prompt text from the domain JSON schema
+_SCHEMA_START = "\n{"
+# encoding for models tiktoken doesn't know
+_FALLBACK_ENCODING = "cl100k_base"
+
+
+def split_domain_prompt(domain_prompt: str) -> tuple[str, dict]:
+    """Splits a domain prompt into its leading text and its JSON schema.
+
+    Parameters
+    ----------
+    domain_prompt : str
+        The domain prompt (e.g. prompts.IO_DOMAIN).
+
+    Returns
+    -------
+    tuple[str, dict]
+        The prompt text and the deserialized domain schema.
+    """
+    schema_start = domain_prompt.index(_SCHEMA_START)
+    return domain_prompt[:schema_start], json.loads(domain_prompt[schema_start:])
+
+
+def minify(data: dict | list) -> str:
+    """Serializes JSON without any indentation or whitespace.
+
+    Parameters
+    ----------
+    data : dict or list
+        The data to serialize.
+
+    Returns
+    -------
+    str
+        The minified JSON string.
+    """
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def minify_domain_prompt(domain_prompt: str) -> str:
+    """Rebuilds a domain prompt with its JSON schema minified.
+
+    Parameters
+    ----------
+    domain_prompt : str
+        The domain prompt.
+
+    Returns
+    -------
+    str
+        The domain prompt text followed by the minified schema.
+    """
+    prompt_text, schema = split_domain_prompt(domain_prompt)
+    return f"{prompt_text}\n{minify(schema)}"
+
+
+def slice_top_level_schema(domain_schema: dict) -> dict:
+    """Builds the subset of the top level schema that is referenced by the domain
+    schema. References between the top level definitions are followed so the
+    slice is self contained.
+
+    Parameters
+    ----------
+    domain_schema : dict
+        The deserialized domain schema.
+
+    Returns
+    -------
+    dict
+        The top level schema `$id` and the referenced `definitions`, the
+        definitions are empty if the domain schema has no top level references.
+    """
+    top_level_schema = json.loads(_TOP_LEVEL_SCHEMA)
+    all_definitions = top_level_schema["definitions"]
+    pending = [
+        ref[len(_TOP_LEVEL_REF_PREFIX) :]
+        for ref in _collect_refs(domain_schema)
+        if ref.startswith(_TOP_LEVEL_REF_PREFIX)
+    ]
+    definitions: dict[str, Any] = {}
+    while pending:
+        name = pending.pop()
+        if name in definitions or name not in all_definitions:
+            continue
+        definitions[name] = all_definitions[name]
+        pending.extend(
+            ref[len(_LOCAL_REF_PREFIX) :]
+            for ref in _collect_refs(definitions[name])
+            if ref.startswith(_LOCAL_REF_PREFIX)
+        )
+    return {
+        "$id": top_level_schema["$id"],
+        "definitions": {name: definitions[name] for name in sorted(definitions)},
+    }
+
+
+def build_supplement_prompt(domain_prompt: str) -> str | None:
+    """Builds the supplementary prompt carrying only the top level definitions
+    the domain schema references.
+
+    Parameters
+    ----------
+    domain_prompt : str
+        The domain prompt.
+
+    Returns
+    -------
+    str or None
+        The minified supplementary prompt or None if the domain schema doesn't
+        reference the top level schema.
+    """
+    _, domain_schema = split_domain_prompt(domain_prompt)
+    sliced_schema = slice_top_level_schema(domain_schema)
+    if not sliced_schema["definitions"]:
+        return None
+    return SLICED_SUPPLEMENT_PROMPT.format(minify(sliced_schema))
+
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    """Counts the tokens in a string with the tokenizer for a model.
+
+    Parameters
+    ----------
+    text : str
+        The text to tokenize.
+    model : str (default: "gpt-4")
+        The model whose tokenizer to use (see encoding_for()).
+
+    Returns
+    -------
+    int
+        The number of tokens.
+    """
+    return len(encoding_for(model).encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=None)
+def encoding_for(model: str) -> tiktoken.Encoding:
+    """Resolves the tiktoken encoding of a model, cached per model.
+
+    Parameters
+    ----------
+    model : str
+        The model name, models tiktoken doesn't know fall back to the
+        `cl100k_base` encoding.
+
+    Returns
+    -------
+    tiktoken.Encoding
+        The encoding.
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(_FALLBACK_ENCODING)
+
+
+def token_report(domain_map: dict, model: str = "gpt-4") -> dict[str, dict[str, int]]:
+    """Compares the prompt token counts of the full schema prompts against the
+    sliced and minified prompts for each domain, along with the tokens of the
+    domain's retrieval queries (the text embedded for the retrieval).
+
+    Parameters
+    ----------
+    domain_map : dict
+        The BcoRag domain map, each entry holding the original domain prompt under
+        `prompt`, the `top_level` flag and the retrieval queries under
+        `retrieval`.
+    model : str (default: "gpt-4")
+        The model whose tokenizer to use.
+
+    Returns
+    -------
+    dict[str, dict[str, int]]
+        For each domain, the token counts of the original (`full`) and sliced
+        (`sliced`) query prompts, the tokens saved and the total tokens of the
+        retrieval queries (`retrieval`).
+    """
+    report: dict[str, dict[str, int]] = {}
+    for domain, domain_info in domain_map.items():
+        full_prompt = QUERY_PROMPT.format(domain, domain_info["prompt"])
+        if domain_info["top_level"]:
+            full_prompt += f"\n{SUPPLEMENT_PROMPT}"
+        sliced_prompt = QUERY_PROMPT.format(
+            domain, minify_domain_prompt(domain_info["prompt"])
+        )
+        supplement_prompt = build_supplement_prompt(domain_info["prompt"])
+        if domain_info["top_level"] and supplement_prompt is not None:
+            sliced_prompt += f"\n{supplement_prompt}"
+        full_tokens = count_tokens(full_prompt, model)
+        sliced_tokens = count_tokens(sliced_prompt, model)
+        report[domain] = {
+            "full": full_tokens,
+            "sliced": sliced_tokens,
+            "saved": full_tokens - sliced_tokens,
+            "retrieval": sum(
+                count_tokens(query, model) for query in domain_info["retrieval"]
+            ),
+        }
+    return report
+
+
+def _collect_refs(schema: Any) -> list[str]:
+    """Recursively collects every `$ref` value in a schema.
+
+    Parameters
+    ----------
+    schema : Any
+        The (sub)schema to search.
+
+    Returns
+    -------
+    list[str]
+        The reference values.
+    """
+    refs: list[str] = []
+    if isinstance(schema, dict):
+        for key, value in schema.items():
+            if key == "$ref" and isinstance(value, str):
+                refs.append(value)
+            else:
+                refs.extend(_collect_refs(value))
+    elif isinstance(schema, list):
+        for item in schema:
+            refs.extend(_collect_refs(item))
+    return refs
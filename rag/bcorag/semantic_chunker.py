@@ -0,0 +1,153 @@
+""" Semantic chunking strategy. Produces the same chunks as the llama-index
+SemanticSplitterNodeParser (sentence groups are embedded and the documents are
+split where the cosine distance between adjacent groups exceeds a percentile of
+all the distances), but:
+
+- The sentence groups of every document are embedded together at the max batch
+  size, through the embedding cache (so re-chunking a paper embeds nothing).
+- The adjacent group distances and breakpoints are computed with vectorized
+  numpy instead of one similarity call per pair.
+"""
+
+from typing import Callable
+import numpy as np
+from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+from llama_index.core.node_parser.text.utils import split_by_sentence_tokenizer
+from llama_index.core.schema import BaseNode, Document
+from bcorag.embedding_cache import EmbeddingCache
+
+
+class SemanticChunker:
+    """Splits documents into semantically coherent nodes."""
+
+    def __init__(
+        self,
+        embedding_cache: EmbeddingCache,
+        buffer_size: int = 1,
+        breakpoint_percentile_threshold: int = 95,
+        sentence_splitter: Callable[[str], list[str]] | None = None,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+        embedding_cache : EmbeddingCache
+            The embedding cache (and model) the sentence groups are embedded
+            through.
+        buffer_size : int (default: 1)
+            The number of sentences on each side of a sentence grouped with it.
+        breakpoint_percentile_threshold : int (default: 95)
+            The percentile of the adjacent group distances that must be exceeded
+            to split. The smaller this number is, the more nodes will be
+            generated.
+        sentence_splitter : Callable[[str], list[str]] or None (default: None)
+            Splits text into sentences, defaults to the llama-index sentence
+            tokenizer.
+        """
+        self.embedding_cache = embedding_cache
+        self.buffer_size = buffer_size
+        self.breakpoint_percentile_threshold = breakpoint_percentile_threshold
+        self.sentence_splitter = sentence_splitter or split_by_sentence_tokenizer()
+
+    def build_semantic_nodes_from_documents(
+        self, documents: list[Document]
+    ) -> list[BaseNode]:
+        """Chunks the documents into nodes.
+
+        Parameters
+        ----------
+        documents : list[Document]
+            The documents to chunk.
+
+        Returns
+        -------
+        list[BaseNode]
+            The nodes, without embeddings.
+        """
+        document_sentences = [self.sentence_splitter(doc.text) for doc in documents]
+        document_groups = [
+            self._sentence_groups(sentences) for sentences in document_sentences
+        ]
+        # one embedding pass over the groups of every document
+        embeddings = self.embedding_cache.embed(
+            [group for groups in document_groups for group in groups]
+        )
+
+        nodes: list[BaseNode] = []
+        offset = 0
+        for doc, sentences, groups in zip(
+            documents, document_sentences, document_groups
+        ):
+            matrix = np.asarray(embeddings[offset : offset + len(groups)])
+            offset += len(groups)
+            chunks = self._chunks(sentences, matrix)
+            nodes.extend(build_nodes_from_splits(chunks, doc))
+        return nodes
+
+    def _sentence_groups(self, sentences: list[str]) -> list[str]:
+        """Joins each sentence with the buffer_size sentences on each side.
+
+        Parameters
+        ----------
+        sentences : list[str]
+            The sentences of a document.
+
+        Returns
+        -------
+        list[str]
+            The sentence group of each sentence.
+        """
+        return [
+            "".join(
+                sentences[max(0, i - self.buffer_size) : i + 1 + self.buffer_size]
+            )
+            for i in range(len(sentences))
+        ]
+
+    def _chunks(self, sentences: list[str], embeddings: np.ndarray) -> list[str]:
+        """Splits a document's sentences where the distance between adjacent
+        sentence groups exceeds the percentile threshold.
+
+        Parameters
+        ----------
+        sentences : list[str]
+            The sentences of the document.
+        embeddings : np.ndarray
+            The embedding of each sentence group, one row per sentence.
+
+        Returns
+        -------
+        list[str]
+            The chunk texts.
+        """
+        if len(sentences) < 2:
+            return [" ".join(sentences)]
+        distances = adjacent_distances(embeddings)
+        threshold = np.percentile(distances, self.breakpoint_percentile_threshold)
+        # split after each sentence whose group is far from the next one
+        ends = np.flatnonzero(distances > threshold) + 1
+        bounds = [0, *ends.tolist(), len(sentences)]
+        return [
+            "".join(sentences[start:end])
+            for start, end in zip(bounds[:-1], bounds[1:])
+            if start < end
+        ]
+
+
+def adjacent_distances(embeddings: np.ndarray) -> np.ndarray:
+    """Computes the cosine distance between each pair of adjacent rows.
+
+    Parameters
+    ----------
+    embeddings : np.ndarray
+        The embeddings, one row each.
+
+    Returns
+    -------
+    np.ndarray
+        The distance between row i and row i + 1, for each i.
+    """
+    norms = np.linalg.norm(embeddings, axis=1)
+    norms[norms == 0] = 1.0
+    unit = embeddings / norms[:, None]
+    return 1.0 - np.einsum("ij,ij->i", unit[:-1], unit[1:])
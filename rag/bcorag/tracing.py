@@ -0,0 +1,288 @@
+""" Lightweight tracing of the pipeline stages. Each stage runs in a timed span
+that is appended to a JSONL trace file as a single line once it ends, spans
+nest through a context variable so concurrent domain queries keep their own
+parent chains.
+
+Each trace line holds:
+
+- `trace_id`: The id shared by every span of the run.
+- `span_id`: The span id.
+- `parent_id`: The enclosing span id (None for top level spans).
+- `name`: The stage name.
+- `start`: The span start as a UNIX timestamp.
+- `duration`: The span duration in seconds.
+- `status`: Either "ok" or "error".
+- `error`: The exception raised in the span, if any.
+- `attributes`: The span attributes (e.g. node count, tokens, model, cache hit).
+"""
+
+import itertools
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+from llama_index.core.callbacks.schema import CBEventType, EventPayload
+
+_current_span: ContextVar["Span | None"] = ContextVar("bcorag_span", default=None)
+
+
+class Span:
+    """A single timed stage."""
+
+    __slots__ = ("span_id", "parent_id", "name", "start", "attributes")
+
+    def __init__(
+        self, span_id: str, parent_id: str | None, name: str, attributes: dict
+    ):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.attributes = attributes
+
+    def set(self, **attributes: Any):
+        """Adds attributes to the span.
+
+        Parameters
+        ----------
+        **attributes
+            The JSON serializable attributes to add.
+        """
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    """Writes the spans of a single run to a JSONL trace file."""
+
+    def __init__(self, trace_path: str):
+        """Constructor.
+
+        Parameters
+        ----------
+        trace_path : str
+            The JSONL file to append the spans to.
+        """
+        self.trace_path = trace_path
+        self.trace_id = uuid.uuid4().hex
+        self._span_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """Context manager that times the block as a span nested under the
+        current span.
+
+        Parameters
+        ----------
+        name : str
+            The stage name.
+        **attributes
+            The initial span attributes.
+
+        Yields
+        ------
+        Span
+            The span, more attributes can be added with `span.set()`.
+        """
+        parent = _current_span.get()
+        span = Span(
+            self.next_span_id(),
+            parent.span_id if parent is not None else None,
+            name,
+            attributes,
+        )
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.record(span, time.perf_counter() - start, error)
+
+    def record(self, span: Span, duration: float, error: str | None = None):
+        """Appends a finished span to the trace file.
+
+        Parameters
+        ----------
+        span : Span
+            The finished span.
+        duration : float
+            The span duration in seconds.
+        error : str or None (default: None)
+            The exception raised in the span, if any.
+        """
+        line = json.dumps(
+            {
+                "trace_id": self.trace_id,
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "name": span.name,
+                "start": span.start,
+                "duration": duration,
+                "status": "ok" if error is None else "error",
+                "error": error,
+                "attributes": span.attributes,
+            },
+            default=str,
+        )
+        try:
+            with self._lock, open(self.trace_path, "a") as f:
+                f.write(f"{line}\n")
+        except OSError as e:
+            logging.getLogger("bcorag").error(
+                f"Failed to write trace span to `{self.trace_path}`.\n{e}"
+            )
+
+    def next_span_id(self) -> str:
+        """Allocates a span id unique within the trace.
+
+        Returns
+        -------
+        str
+            The span id.
+        """
+        return str(next(self._span_ids))
+
+
+def annotate(**attributes: Any):
+    """Adds attributes to the current span, if any. Safe to call from code that
+    may run outside of a traced stage.
+
+    Parameters
+    ----------
+    **attributes
+        The JSON serializable attributes to add.
+    """
+    span = _current_span.get()
+    if span is not None:
+        span.set(**attributes)
+
+
+def llm_usage(response: Any) -> dict[str, int] | None:
+    """Extracts the token usage reported by the API from an LLM response.
+
+    Parameters
+    ----------
+    response : Any
+        The ChatResponse or CompletionResponse.
+
+    Returns
+    -------
+    dict[str, int] or None
+        The prompt, completion and total tokens, None if the response carries
+        no usage (e.g. streamed responses).
+    """
+    raw = getattr(response, "raw", None)
+    if raw is None:
+        return None
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    if usage is None:
+        return None
+    if not isinstance(usage, dict):
+        usage = {
+            key: getattr(usage, key, None)
+            for key in ("prompt_tokens", "completion_tokens", "total_tokens")
+        }
+    return {
+        "prompt_tokens": usage.get("prompt_tokens") or 0,
+        "completion_tokens": usage.get("completion_tokens") or 0,
+        "total_tokens": usage.get("total_tokens") or 0,
+    }
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Llama-index callback handler that records the embedding and LLM calls as
+    spans nested under the stage that made them.
+    """
+
+    def __init__(self, tracer: Tracer, llm_model: str, embed_model: str):
+        """Constructor.
+
+        Parameters
+        ----------
+        tracer : Tracer
+            The tracer to record the spans with.
+        llm_model : str
+            The LLM model name to attribute the LLM calls to.
+        embed_model : str
+            The embedding model name to attribute the embedding calls to.
+        """
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self.tracer = tracer
+        self.llm_model = llm_model
+        self.embed_model = embed_model
+        self._open_spans: dict[str, tuple[Span, float]] = {}
+
+    def on_event_start(
+        self,
+        event_type: CBEventType,
+        payload: dict[str, Any] | None = None,
+        event_id: str = "",
+        parent_id: str = "",
+        **kwargs: Any,
+    ) -> str:
+        if event_type not in (CBEventType.EMBEDDING, CBEventType.LLM):
+            return event_id
+        parent = _current_span.get()
+        span = Span(
+            self.tracer.next_span_id(),
+            parent.span_id if parent is not None else None,
+            event_type.value,
+            {
+                "model": (
+                    self.llm_model
+                    if event_type == CBEventType.LLM
+                    else self.embed_model
+                )
+            },
+        )
+        self._open_spans[event_id] = (span, time.perf_counter())
+        return event_id
+
+    def on_event_end(
+        self,
+        event_type: CBEventType,
+        payload: dict[str, Any] | None = None,
+        event_id: str = "",
+        **kwargs: Any,
+    ) -> None:
+        open_span = self._open_spans.pop(event_id, None)
+        if open_span is None:
+            return
+        span, start = open_span
+        payload = payload or {}
+        if event_type == CBEventType.EMBEDDING:
+            span.set(chunks=len(payload.get(EventPayload.CHUNKS, [])))
+        elif event_type == CBEventType.LLM:
+            response = payload.get(EventPayload.RESPONSE) or payload.get(
+                EventPayload.COMPLETION
+            )
+            usage = llm_usage(response)
+            if usage is not None:
+                span.set(**usage)
+        error = payload.get(EventPayload.EXCEPTION)
+        self.tracer.record(
+            span,
+            time.perf_counter() - start,
+            repr(error) if error is not None else None,
+        )
+
+    def start_trace(self, trace_id: str | None = None) -> None:
+        return
+
+    def end_trace(
+        self,
+        trace_id: str | None = None,
+        trace_map: dict[str, list[str]] | None = None,
+    ) -> None:
+        return
+
@@ -0,0 +1,60 @@
+""" Validates generated domains against their domain JSON schema.
+"""
+
+import json
+from jsonschema import Draft7Validator
+from referencing import Registry, Resource
+from bcorag.prompts import _TOP_LEVEL_SCHEMA
+from bcorag.schema_slicer import split_domain_prompt
+
+# cap on the number of validation errors reported per response
+MAX_REPORTED_ERRORS = 10
+
+
+def build_validator(domain_prompt: str) -> Draft7Validator:
+    """Builds a validator for a domain schema. References to the top level
+    2791object schema are resolved locally.
+
+    Parameters
+    ----------
+    domain_prompt : str
+        The domain prompt holding the domain schema (e.g. prompts.IO_DOMAIN).
+
+    Returns
+    -------
+    Draft7Validator
+        The domain schema validator.
+    """
+    _, domain_schema = split_domain_prompt(domain_prompt)
+    top_level_schema = json.loads(_TOP_LEVEL_SCHEMA)
+    registry = Registry().with_resource(
+        top_level_schema["$id"], Resource.from_contents(top_level_schema)
+    )
+    return Draft7Validator(domain_schema, registry=registry)
+
+
+def validation_errors(validator: Draft7Validator, response: str) -> list[str]:
+    """Checks a response against a domain schema.
+
+    Parameters
+    ----------
+    validator : Draft7Validator
+        The domain schema validator.
+    response : str
+        The (fence stripped) response text.
+
+    Returns
+    -------
+    list[str]
+        The error messages, empty if the response is valid JSON that validates
+        against the schema.
+    """
+    try:
+        data = json.loads(response)
+    except json.JSONDecodeError as e:
+        return [f"Invalid JSON: {e}"]
+    errors = sorted(validator.iter_errors(data), key=lambda error: list(error.path))
+    return [
+        f"{'/'.join(str(part) for part in error.path) or '<root>'}: {error.message}"
+        for error in errors[:MAX_REPORTED_ERRORS]
+    ]
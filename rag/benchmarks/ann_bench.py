@@ -0,0 +1,196 @@
+""" Measures the recall@k and query latency of the IvfVectorStore against exact
+search (the NumpyVectorStore) over a grid of `nlist` and `nprobe` values, on
+synthetic clustered embeddings (a corpus of many papers embeds into topical
+clusters rather than uniformly).
+
+Run from the `rag/` directory:
+
+    python -m benchmarks.ann_bench --nodes 50000 --nlist 256 512 --nprobe 4 8 16 32
+"""
+
+import argparse
+import json
+import statistics
+import time
+import numpy as np
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from bcorag.ivf_vector_store import IvfVectorStore
+from bcorag.numpy_vector_store import NumpyVectorStore
+
+
+def clustered_embeddings(
+    count: int, dim: int, clusters: int, spread: float, rng: np.random.Generator
+) -> tuple[np.ndarray, np.ndarray]:
+    """Draws embeddings around random cluster centers.
+
+    Parameters
+    ----------
+    count : int
+        The number of embeddings.
+    dim : int
+        The embedding dimension.
+    clusters : int
+        The number of cluster centers.
+    spread : float
+        The standard deviation around the centers (the centers have unit
+        standard deviation).
+    rng : np.random.Generator
+        The random generator.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        The cluster centers and the embeddings, one row each.
+    """
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    embeddings = centers[rng.integers(0, clusters, count)] + spread * rng.standard_normal(
+        (count, dim), dtype=np.float32
+    )
+    return centers, embeddings
+
+
+def run_queries(
+    store: NumpyVectorStore, queries: np.ndarray, top_k: int
+) -> tuple[list[list[str]], list[float]]:
+    """Runs the queries against a store.
+
+    Parameters
+    ----------
+    store : NumpyVectorStore
+        The store.
+    queries : np.ndarray
+        The query embeddings, one row each.
+    top_k : int
+        The number of nodes to retrieve per query.
+
+    Returns
+    -------
+    tuple[list[list[str]], list[float]]
+        The retrieved node IDs and the latency in seconds of each query.
+    """
+    retrieved = []
+    latencies = []
+    for query_embedding in queries:
+        query = VectorStoreQuery(
+            query_embedding=query_embedding.tolist(), similarity_top_k=top_k
+        )
+        start = time.perf_counter()
+        result = store.query(query)
+        latencies.append(time.perf_counter() - start)
+        retrieved.append(result.ids or [])
+    return retrieved, latencies
+
+
+def recall(exact: list[list[str]], approximate: list[list[str]]) -> float:
+    """Computes the mean recall@k of approximate results.
+
+    Parameters
+    ----------
+    exact : list[list[str]]
+        The exact top k node IDs of each query.
+    approximate : list[list[str]]
+        The approximate top k node IDs of each query.
+
+    Returns
+    -------
+    float
+        The mean fraction of the exact top k retrieved.
+    """
+    return statistics.mean(
+        len(set(truth) & set(found)) / len(truth)
+        for truth, found in zip(exact, approximate)
+        if truth
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--nodes", type=int, default=50000, help="Number of nodes in the store.")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension.")
+    parser.add_argument("--clusters", type=int, default=500, help="Number of synthetic topic clusters.")
+    parser.add_argument(
+        "--spread", type=float, default=1.0, help="Spread of the embeddings around their cluster centers."
+    )
+    parser.add_argument("--queries", type=int, default=100, help="Number of queries.")
+    parser.add_argument("--top-k", type=int, default=10, help="Nodes retrieved per query.")
+    parser.add_argument(
+        "--nlist", type=int, nargs="+", default=[0], help="List counts to benchmark, 0 for the automatic count."
+    )
+    parser.add_argument(
+        "--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32], help="Probe counts to benchmark."
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Add the nodes in ten batches (training on the first) rather than all at once.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    parser.add_argument("--output", default=None, help="Optional JSON results path.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    centers, embeddings = clustered_embeddings(
+        args.nodes, args.dim, args.clusters, args.spread, rng
+    )
+    nodes = [
+        TextNode(id_=f"node-{i}", text="", embedding=embedding.tolist())
+        for i, embedding in enumerate(embeddings)
+    ]
+    del embeddings
+    queries = centers[rng.integers(0, args.clusters, args.queries)] + args.spread * rng.standard_normal(
+        (args.queries, args.dim), dtype=np.float32
+    )
+
+    exact_store = NumpyVectorStore()
+    exact_store.add(nodes)  # type: ignore
+    exact, exact_latencies = run_queries(exact_store, queries, args.top_k)
+    exact_ms = statistics.median(exact_latencies) * 1000
+    print(f"{args.nodes} nodes, dim {args.dim}, top {args.top_k}")
+    print(f"exact search: {exact_ms:.3f}ms median")
+    print(f"{'nlist':>8}{'nprobe':>8}{'build s':>10}{'recall':>10}{'median ms':>12}{'speedup':>10}")
+
+    results = []
+    for nlist in args.nlist:
+        store = IvfVectorStore(nlist=nlist or None, min_train_size=min(1024, args.nodes))
+        start = time.perf_counter()
+        if args.incremental:
+            batch_size = -(-args.nodes // 10)
+            for batch_start in range(0, args.nodes, batch_size):
+                store.add(nodes[batch_start : batch_start + batch_size])  # type: ignore
+        else:
+            store.add(nodes)  # type: ignore
+        build_seconds = time.perf_counter() - start
+        for nprobe in args.nprobe:
+            store.nprobe = nprobe
+            approximate, latencies = run_queries(store, queries, args.top_k)
+            median_ms = statistics.median(latencies) * 1000
+            result = {
+                "nlist": len(store.centroids) if store.centroids is not None else None,
+                "nprobe": nprobe,
+                "build_seconds": build_seconds,
+                "recall": recall(exact, approximate),
+                "query_ms_median": median_ms,
+                "speedup": exact_ms / median_ms,
+            }
+            results.append(result)
+            print(
+                f"{result['nlist']:>8}{nprobe:>8}{build_seconds:>10.2f}{result['recall']:>10.3f}"
+                f"{median_ms:>12.3f}{result['speedup']:>10.1f}"
+            )
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "settings": vars(args),
+                    "exact_query_ms_median": exact_ms,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+""" Compares the repository fetch throughput (files/sec) of the llama-index
+GithubRepositoryReader against the pooled, concurrent GithubLoader, both run
+against the local Github API stand-in.
+
+Run from the `rag/` directory:
+
+    python -m benchmarks.github_bench --files 2000 --latency 0.02
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from llama_index.readers.github import GithubClient, GithubRepositoryReader  # type: ignore
+from benchmarks.github_stand_in import GithubStandIn, OWNER, REPO, BRANCH
+from bcorag.github_api import DEFAULT_MAX_CONCURRENCY
+from bcorag.github_loader import GithubLoader
+
+
+def bench_reader(url: str) -> tuple[int, float]:
+    """Fetches the repository with the llama-index reader (one new connection
+    per request, fixed size request batches).
+
+    Parameters
+    ----------
+    url : str
+        The API base URL.
+
+    Returns
+    -------
+    tuple[int, float]
+        The number of files loaded and the seconds taken.
+    """
+    reader = GithubRepositoryReader(
+        github_client=GithubClient("stand-in", base_url=url),
+        owner=OWNER,
+        repo=REPO,
+        timeout=60,
+    )
+    start = time.perf_counter()
+    documents = reader.load_data(branch=BRANCH)
+    return len(documents), time.perf_counter() - start
+
+
+def bench_loader(url: str, cache_dir: str, max_concurrency: int) -> tuple[int, float, dict]:
+    """Fetches the repository with the GithubLoader.
+
+    Parameters
+    ----------
+    url : str
+        The API base URL.
+    cache_dir : str
+        The Github cache directory, an empty directory for a cold fetch.
+    max_concurrency : int
+        The cap on the number of requests in flight.
+
+    Returns
+    -------
+    tuple[int, float, dict]
+        The number of files loaded, the seconds taken and the loader stats.
+    """
+    loader = GithubLoader(
+        "stand-in",
+        owner=OWNER,
+        repo=REPO,
+        branch=BRANCH,
+        cache_dir=cache_dir,
+        namespace="bench",
+        base_url=url,
+        max_concurrency=max_concurrency,
+    )
+    start = time.perf_counter()
+    _, documents = loader.load()
+    return len(documents), time.perf_counter() - start, loader.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.02, help="Stand-in latency per request in seconds.")
+    parser.add_argument("--throttle-every", type=int, default=0, help="Rate limit every nth request.")
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY)
+    parser.add_argument("--skip-reader", action="store_true", help="Skip the llama-index reader baseline.")
+    parser.add_argument("--output", default=None, help="Optional JSON report path.")
+    args = parser.parse_args()
+
+    stand_in = GithubStandIn(
+        files=args.files, latency=args.latency, throttle_every=args.throttle_every
+    ).start()
+    results = {}
+    try:
+        if not args.skip_reader:
+            files, seconds = bench_reader(stand_in.url)
+            results["reader"] = {"files": files, "seconds": seconds}
+        with tempfile.TemporaryDirectory() as cache_dir:
+            files, seconds, stats = bench_loader(
+                stand_in.url, cache_dir, args.max_concurrency
+            )
+            results["loader"] = {"files": files, "seconds": seconds, **stats}
+    finally:
+        stand_in.stop()
+
+    print(f"{'client':<10}{'files':>8}{'seconds':>10}{'files/sec':>12}")
+    for client, result in results.items():
+        print(
+            f"{client:<10}{result['files']:>8}{result['seconds']:>10.2f}{result['files'] / result['seconds']:>12.1f}"
+        )
+    if "reader" in results:
+        print(f"speedup: {results['reader']['seconds'] / results['loader']['seconds']:.1f}x")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+""" Local stand-in for the Github REST API (branches, trees and blobs) serving a
+synthetic repository from memory, with configurable per request latency and
+rate limiting.
+
+Run from the `rag/` directory to serve it standalone:
+
+    python -m benchmarks.github_stand_in --port 8765 --files 2000
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+OWNER = "stand-in"
+REPO = "repo"
+BRANCH = "main"
+
+
+def _git_sha(kind: str, data: bytes) -> str:
+    return hashlib.sha1(f"{kind} {len(data)}\0".encode("utf-8") + data).hexdigest()
+
+
+class GithubStandIn:
+    """Serves a synthetic repository of text files spread over directories, under
+    any owner and repository name.
+    """
+
+    def __init__(
+        self,
+        files: int = 2000,
+        directories: int = 20,
+        file_size: int = 2048,
+        latency: float = 0.02,
+        throttle_every: int = 0,
+        port: int = 0,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+        files : int (default: 2000)
+            The number of files in the repository.
+        directories : int (default: 20)
+            The number of directories the files are spread over.
+        file_size : int (default: 2048)
+            The approximate size of each file in bytes.
+        latency : float (default: 0.02)
+            The artificial latency of each request in seconds.
+        throttle_every : int (default: 0)
+            Rate limit every nth request with a 429 and a `Retry-After` header,
+            0 disables rate limiting.
+        port : int (default: 0)
+            The port to listen on, 0 picks a free port.
+        """
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.blobs: dict[str, bytes] = {}
+        self.trees: dict[str, list[dict]] = {}
+        root_entries = []
+        for dir_idx in range(directories):
+            entries = []
+            for file_idx in range(dir_idx, files, directories):
+                line = f"def function_{file_idx}(value):\n    return value * {file_idx}\n"
+                data = (line * (file_size // len(line) + 1))[:file_size].encode("utf-8")
+                blob_sha = _git_sha("blob", data)
+                self.blobs[blob_sha] = data
+                entries.append(
+                    {
+                        "path": f"module_{file_idx}.py",
+                        "mode": "100644",
+                        "type": "blob",
+                        "sha": blob_sha,
+                        "url": "",
+                        "size": len(data),
+                    }
+                )
+            tree_sha = self._add_tree(entries)
+            root_entries.append(
+                {
+                    "path": f"package_{dir_idx}",
+                    "mode": "040000",
+                    "type": "tree",
+                    "sha": tree_sha,
+                    "url": "",
+                }
+            )
+        self.root_tree = self._add_tree(root_entries)
+        self.commit_sha = _git_sha("commit", self.root_tree.encode("utf-8"))
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> "GithubStandIn":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _add_tree(self, entries: list[dict]) -> str:
+        tree_sha = _git_sha("tree", json.dumps(entries, sort_keys=True).encode("utf-8"))
+        self.trees[tree_sha] = entries
+        return tree_sha
+
+    def _flatten(self, tree_sha: str, prefix: str = "") -> list[dict]:
+        entries = []
+        for entry in self.trees[tree_sha]:
+            entries.append({**entry, "path": f"{prefix}{entry['path']}"})
+            if entry["type"] == "tree":
+                entries.extend(self._flatten(entry["sha"], f"{prefix}{entry['path']}/"))
+        return entries
+
+    def _route(self, path: str) -> tuple[int, dict]:
+        if match := re.fullmatch(r"/repos/[^/]+/[^/]+/branches/([^/?]+)", path):
+            return 200, {
+                "name": match[1],
+                "commit": {"sha": self.commit_sha, "commit": {"tree": {"sha": self.root_tree}}},
+                "_links": {"self": "", "html": ""},
+            }
+        if match := re.fullmatch(r"/repos/[^/]+/[^/]+/git/trees/(\w+)(\?recursive=1)?", path):
+            if match[1] not in self.trees:
+                return 404, {"message": "Not Found"}
+            entries = self._flatten(match[1]) if match[2] else self.trees[match[1]]
+            return 200, {"sha": match[1], "url": "", "tree": entries, "truncated": False}
+        if match := re.fullmatch(r"/repos/[^/]+/[^/]+/git/blobs/(\w+)", path):
+            if match[1] not in self.blobs:
+                return 404, {"message": "Not Found"}
+            data = self.blobs[match[1]]
+            return 200, {
+                "sha": match[1],
+                "content": base64.b64encode(data).decode("ascii"),
+                "encoding": "base64",
+                "size": len(data),
+                "url": "",
+                "node_id": "",
+            }
+        return 404, {"message": "Not Found"}
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, so pooled connections are reused
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with stand_in._lock:
+                    stand_in.requests += 1
+                    throttled = (
+                        stand_in.throttle_every > 0
+                        and stand_in.requests % stand_in.throttle_every == 0
+                    )
+                time.sleep(stand_in.latency)
+                if throttled:
+                    status, body = 429, {"message": "secondary rate limit"}
+                else:
+                    status, body = stand_in._route(self.path)
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                if throttled:
+                    self.send_header("Retry-After", "1")
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--throttle-every", type=int, default=0)
+    args = parser.parse_args()
+    stand_in = GithubStandIn(
+        files=args.files,
+        latency=args.latency,
+        throttle_every=args.throttle_every,
+        port=args.port,
+    ).start()
+    print(f"Serving `{OWNER}/{REPO}` branch `{BRANCH}` at {stand_in.url}")
+    try:
+        stand_in._thread.join()
+    except KeyboardInterrupt:
+        stand_in.stop()
+
+
+if __name__ == "__main__":
+    main()
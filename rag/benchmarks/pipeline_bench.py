@@ -0,0 +1,217 @@
+""" Offline pipeline benchmark. Runs BcoRag over the papers with the local
+stand-in embedding model and LLM for each chunking strategy in the
+configuration file and reports the per stage timings, the peak memory and the
+node count of each run as JSON.
+
+Run from the `rag/` directory:
+
+    python -m benchmarks.pipeline_bench --output bench.json
+    python -m benchmarks.pipeline_bench --baseline bench.json --output new.json
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from bcorag import misc_functions as misc_fns
+from bcorag import batch
+
+STAGES = ["load", "chunk", "embed", "index", "retrieve", "synthesize", "write"]
+# stages recorded once per domain, summed across the domains of a run
+DOMAIN_STAGES = ["retrieve", "synthesize", "write"]
+
+
+def run_once(paper: tuple[str, str], chunking_config: str, settings: dict) -> dict:
+    """Benchmarks a single paper and chunking strategy. Meant to be run in a
+    fresh process so the peak memory is specific to the run.
+
+    Parameters
+    ----------
+    paper : tuple[str, str]
+        The paper name and path.
+    chunking_config : str
+        The chunking strategy.
+    settings : dict
+        The benchmark settings (stand-in latencies, output tokens, top k).
+
+    Returns
+    -------
+    dict
+        The run results.
+    """
+    from benchmarks.stand_ins import StandInEmbedding, StandInLLM
+    from bcorag.bcorag import BcoRag, DOMAIN_MAP
+
+    logger = logging.getLogger("bcorag")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    result: dict = {
+        "paper": paper[0],
+        "chunking_config": chunking_config,
+        "status": "success",
+        "error": None,
+    }
+    selections = batch.build_selections(
+        {
+            "chunking_config": chunking_config,
+            "similarity_top_k": settings["similarity_top_k"],
+            "mode": "production",
+        }
+    )
+    selections.update({"filename": paper[0], "filepath": paper[1]})
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            start = time.perf_counter()
+            bco_rag = BcoRag(
+                selections,
+                output_dir=tmp_dir,
+                cache_dir=os.path.join(tmp_dir, "cache"),
+                max_repair_attempts=0,
+                llm=StandInLLM(
+                    output_tokens=settings["output_tokens"],
+                    latency=settings["llm_latency"],
+                    token_latency=settings["token_latency"],
+                ),
+                embed_model=StandInEmbedding(latency=settings["embed_latency"]),
+            )
+            for domain in DOMAIN_MAP:
+                bco_rag.perform_query(domain)
+            result["total"] = time.perf_counter() - start
+            result["timings"] = _stage_timings(bco_rag.timings)
+            result["node_count"] = len(bco_rag.index.docstore.docs)
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = repr(e)
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+def compare(baseline: dict, current: dict, tolerance: float, min_seconds: float) -> list[str]:
+    """Compares the stage timings of two benchmark results.
+
+    Parameters
+    ----------
+    baseline : dict
+        The baseline benchmark results.
+    current : dict
+        The current benchmark results.
+    tolerance : float
+        The allowed relative slowdown per stage (e.g. 0.2 for 20%).
+    min_seconds : float
+        Absolute slowdowns below this are ignored as noise.
+
+    Returns
+    -------
+    list[str]
+        A description of each regression.
+    """
+    baseline_runs = {
+        (run["paper"], run["chunking_config"]): run for run in baseline["runs"]
+    }
+    regressions = []
+    for run in current["runs"]:
+        baseline_run = baseline_runs.get((run["paper"], run["chunking_config"]))
+        if baseline_run is None or "timings" not in baseline_run or "timings" not in run:
+            continue
+        for stage in STAGES:
+            old, new = baseline_run["timings"][stage], run["timings"][stage]
+            if new - old > min_seconds and new > old * (1 + tolerance):
+                regressions.append(
+                    f"{run['paper']} [{run['chunking_config']}] {stage}: {old:.3f}s -> {new:.3f}s"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--papers", nargs="*", default=None, help="Paper paths, defaults to the papers directory.")
+    parser.add_argument("--chunking-configs", nargs="*", default=None, help="Chunking strategies, defaults to all.")
+    parser.add_argument("--similarity-top-k", default="3")
+    parser.add_argument("--output-tokens", type=int, default=256)
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--embed-latency", type=float, default=0.0)
+    parser.add_argument("--output", default=None, help="JSON results path.")
+    parser.add_argument("--baseline", default=None, help="Baseline JSON results to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--min-seconds", type=float, default=0.05)
+    args = parser.parse_args()
+
+    presets = misc_fns.load_json(batch.CONF_PATH)
+    papers = (
+        [(os.path.basename(path), path) for path in args.papers]
+        if args.papers
+        else batch.collect_papers(presets["paper_directory"])
+    )
+    chunking_configs = args.chunking_configs or presets["options"]["chunking_config"]["list"]
+    settings = {
+        "similarity_top_k": args.similarity_top_k,
+        "output_tokens": args.output_tokens,
+        "llm_latency": args.llm_latency,
+        "token_latency": args.token_latency,
+        "embed_latency": args.embed_latency,
+    }
+
+    runs = []
+    context = multiprocessing.get_context("spawn")
+    for paper in papers:
+        for chunking_config in chunking_configs:
+            # one fresh process per run so peak memory doesn't carry over
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                run = executor.submit(run_once, paper, chunking_config, settings).result()
+            runs.append(run)
+            if run["status"] == "success":
+                stage_str = " ".join(
+                    f"{stage}={run['timings'][stage]:.3f}s" for stage in STAGES
+                )
+                print(
+                    f"{paper[0]} [{chunking_config}] nodes={run['node_count']} peak={run['peak_rss_mb']:.0f}MB {stage_str}"
+                )
+            else:
+                print(f"{paper[0]} [{chunking_config}] failed: {run['error']}")
+
+    results = {
+        "settings": settings,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": runs,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        regressions = compare(
+            misc_fns.load_json(args.baseline), results, args.tolerance, args.min_seconds
+        )
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+def _stage_timings(timings: dict[str, float]) -> dict[str, float]:
+    stage_timings = {stage: timings.get(stage, 0.0) for stage in STAGES}
+    for stage in DOMAIN_STAGES:
+        stage_timings[stage] = sum(
+            seconds for key, seconds in timings.items() if key.endswith(f"_{stage}")
+        )
+    return stage_timings
+
+
+def _peak_rss_mb() -> float:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+""" Compares the query prompt token counts with the full top level schema
+supplement against the sliced and minified schema prompts, and reports the
+tokens of the retrieval queries embedded in place of the query prompt.
+
+Run from the `rag/` directory:
+
+    python -m benchmarks.schema_tokens [--model gpt-4] [--output report.json]
+"""
+
+import argparse
+import json
+from bcorag.bcorag import DOMAIN_MAP
+from bcorag.schema_slicer import (
+    split_domain_prompt,
+    slice_top_level_schema,
+    token_report,
+    _collect_refs,
+    _TOP_LEVEL_REF_PREFIX,
+)
+
+
+def check_slices() -> None:
+    """Checks every top level reference in each domain schema resolves in the
+    sliced schema, so slicing never drops information the domain needs.
+    """
+    for domain, domain_info in DOMAIN_MAP.items():
+        _, domain_schema = split_domain_prompt(domain_info["prompt"])
+        sliced_schema = slice_top_level_schema(domain_schema)
+        for ref in _collect_refs(domain_schema):
+            if not ref.startswith(_TOP_LEVEL_REF_PREFIX):
+                continue
+            definition = ref[len(_TOP_LEVEL_REF_PREFIX) :]
+            if definition not in sliced_schema["definitions"]:
+                raise AssertionError(
+                    f"Reference `{ref}` in the {domain} domain is missing from the sliced schema."
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--model", default="gpt-4", help="Tokenizer model.")
+    parser.add_argument("--output", default=None, help="Optional JSON report path.")
+    args = parser.parse_args()
+
+    check_slices()
+    report = token_report(DOMAIN_MAP, args.model)
+
+    print(f"{'domain':<12}{'full':>8}{'sliced':>8}{'saved':>8}{'saved %':>9}{'retrieval':>11}")
+    for domain, counts in report.items():
+        saved_pct = 100 * counts["saved"] / counts["full"]
+        print(
+            f"{domain:<12}{counts['full']:>8}{counts['sliced']:>8}{counts['saved']:>8}{saved_pct:>8.1f}%"
+            f"{counts['retrieval']:>11}"
+        )
+    full_total = sum(counts["full"] for counts in report.values())
+    sliced_total = sum(counts["sliced"] for counts in report.values())
+    retrieval_total = sum(counts["retrieval"] for counts in report.values())
+    print(
+        f"{'total':<12}{full_total:>8}{sliced_total:>8}{full_total - sliced_total:>8}{100 * (full_total - sliced_total) / full_total:>8.1f}%"
+        f"{retrieval_total:>11}"
+    )
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"model": args.model, "domains": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
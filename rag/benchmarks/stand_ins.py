@@ -0,0 +1,138 @@
+""" Deterministic local stand-ins for the OpenAI embedding model and LLM, so the
+pipeline can be benchmarked offline. Both have configurable artificial latency.
+"""
+
+import asyncio
+import hashlib
+import math
+import re
+import time
+from typing import Any, Sequence
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.llms import (
+    CustomLLM,
+    ChatMessage,
+    ChatResponse,
+    CompletionResponse,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+class StandInEmbedding(BaseEmbedding):
+    """Hashed bag of words embedding. Texts sharing words get similar vectors,
+    so retrieval over the stand-in embeddings is still meaningful.
+    """
+
+    embed_dim: int = Field(default=256, description="The embedding dimension.")
+    latency: float = Field(
+        default=0.0, description="Artificial latency in seconds per API call (batch)."
+    )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "stand_in_embedding"
+
+    def _embed(self, text: str) -> list[float]:
+        vector = [0.0] * self.embed_dim
+        for word in _WORD_PATTERN.findall(text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.embed_dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        time.sleep(self.latency)
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        await asyncio.sleep(self.latency)
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        time.sleep(self.latency)
+        return self._embed(text)
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+
+class StandInLLM(CustomLLM):
+    """LLM that returns a fixed size JSON response after an artificial delay
+    made of a fixed time to first token plus a per output token time.
+    """
+
+    output_tokens: int = Field(default=256, description="Words in each response.")
+    latency: float = Field(
+        default=0.0, description="Artificial time to first token in seconds."
+    )
+    token_latency: float = Field(
+        default=0.0, description="Artificial time per output token in seconds."
+    )
+    context_window: int = Field(default=128000, description="Context window size.")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "stand_in_llm"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(
+            context_window=self.context_window,
+            num_output=self.output_tokens,
+            model_name="stand-in",
+        )
+
+    def _response_tokens(self, prompt: str) -> list[str]:
+        seed = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        words = " ".join(f"w{seed}{idx}" for idx in range(self.output_tokens))
+        return ['{"stand_in": "', *words.split(" "), '"}']
+
+    @llm_completion_callback()
+    def complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        tokens = self._response_tokens(prompt)
+        time.sleep(self.latency + self.token_latency * len(tokens))
+        return CompletionResponse(text=" ".join(tokens))
+
+    @llm_completion_callback()
+    async def acomplete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        tokens = self._response_tokens(prompt)
+        await asyncio.sleep(self.latency + self.token_latency * len(tokens))
+        return CompletionResponse(text=" ".join(tokens))
+
+    @llm_chat_callback()
+    async def achat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponse:
+        prompt = self.messages_to_prompt(messages)
+        response = await self.acomplete(prompt, formatted=True)
+        return ChatResponse(
+            message=ChatMessage(role="assistant", content=response.text)
+        )
+
+    @llm_completion_callback()
+    def stream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseGen:
+        tokens = self._response_tokens(prompt)
+        time.sleep(self.latency)
+
+        def gen() -> CompletionResponseGen:
+            text = ""
+            for token in tokens:
+                time.sleep(self.token_latency)
+                delta = token if not text else f" {token}"
+                text += delta
+                yield CompletionResponse(text=text, delta=delta)
+
+        return gen()
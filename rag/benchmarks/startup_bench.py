@@ -0,0 +1,140 @@
+""" CLI startup benchmark. Measures the time to the first menu (interpreter
+startup, the `main.py` imports, argument parsing and loading the configuration
+file) in fresh interpreters with `-X importtime`, and fails if it regresses past
+a threshold or if any of the heavy dependencies are imported before the first
+menu.
+
+Run from the `rag/` directory:
+
+    python -m benchmarks.startup_bench
+    python -m benchmarks.startup_bench --max-seconds 0.5 --output startup.json
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# everything main.py does before showing the paper picker
+FIRST_MENU_SNIPPET = """
+import sys
+import main
+from bcorag import misc_functions as misc_fns
+sys.argv = ["main.py"]
+main.parse_args()
+misc_fns.load_json("./bcorag/conf.json")
+"""
+# packages that must not be imported before the first menu
+DEFERRED_PACKAGES = [
+    "llama_index",
+    "openai",
+    "tiktoken",
+    "httpx",
+    "pypdf",
+    "jsonschema",
+    "numpy",
+]
+
+
+def measure_once() -> dict:
+    """Runs the first menu snippet in a fresh interpreter.
+
+    Returns
+    -------
+    dict
+        The wall clock seconds, the cumulative import seconds of main.py and of
+        each of its direct imports, and the self import seconds of every
+        imported module.
+    """
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", FIRST_MENU_SNIPPET],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    seconds = time.perf_counter() - start
+    main_imports: dict[str, float] = {}
+    modules: dict[str, float] = {}
+    # nested imports are listed before the module importing them
+    pending: dict[str, float] = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        module = name.strip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules[module] = int(self_us) / 1e6
+        if depth == 1:
+            pending[module] = int(cumulative_us) / 1e6
+        elif depth == 0:
+            if module == "main":
+                main_imports = {"main": int(cumulative_us) / 1e6, **pending}
+            pending = {}
+    return {"seconds": seconds, "main_imports": main_imports, "modules": modules}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Number of fresh interpreters to time.")
+    parser.add_argument(
+        "--max-seconds",
+        type=float,
+        default=1.0,
+        help="Fail if the median time to the first menu exceeds this many seconds.",
+    )
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to report.")
+    parser.add_argument("--output", default=None, help="Optional JSON report path.")
+    args = parser.parse_args()
+
+    runs = [measure_once() for _ in range(args.repeat)]
+    median_seconds = statistics.median(run["seconds"] for run in runs)
+    last = runs[-1]
+    slowest = sorted(
+        last["main_imports"].items(), key=lambda item: item[1], reverse=True
+    )
+    deferred = sorted(
+        module
+        for module in last["modules"]
+        if module.split(".")[0] in DEFERRED_PACKAGES
+    )
+
+    print(f"time to first menu: {median_seconds:.3f}s (median of {args.repeat})")
+    print(f"{'import':<40}{'seconds':>10}")
+    for module, seconds in slowest[: args.top]:
+        print(f"{module:<40}{seconds:>10.3f}")
+
+    failures = []
+    if median_seconds > args.max_seconds:
+        failures.append(
+            f"time to first menu {median_seconds:.3f}s exceeds {args.max_seconds:.3f}s"
+        )
+    if deferred:
+        packages = sorted({module.split(".")[0] for module in deferred})
+        failures.append(f"imported before the first menu: {', '.join(packages)}")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "settings": vars(args),
+                    "seconds": [run["seconds"] for run in runs],
+                    "median_seconds": median_seconds,
+                    "main_imports": dict(slowest),
+                    "deferred_imported": deferred,
+                    "failures": failures,
+                },
+                f,
+                indent=2,
+            )
+
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
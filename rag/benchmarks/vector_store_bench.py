@@ -0,0 +1,208 @@
+""" Compares the llama-index SimpleVectorStore against the NumpyVectorStore on
+synthetic embeddings: the time to add the nodes, persist and load the store,
+the memory used by the loaded store, the query latency and whether both
+stores return the same top k.
+
+Run from the `rag/` directory:
+
+    python -m benchmarks.vector_store_bench --nodes 2000 --dim 1536
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from bcorag.numpy_vector_store import NumpyVectorStore
+
+STORES = {
+    "SimpleVectorStore": SimpleVectorStore,
+    "NumpyVectorStore": NumpyVectorStore,
+}
+
+
+def synthetic_nodes(count: int, dim: int, seed: int) -> list[TextNode]:
+    """Builds nodes with random embeddings.
+
+    Parameters
+    ----------
+    count : int
+        The number of nodes.
+    dim : int
+        The embedding dimension.
+    seed : int
+        The random seed.
+
+    Returns
+    -------
+    list[TextNode]
+        The nodes.
+    """
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((count, dim), dtype=np.float32)
+    return [
+        TextNode(
+            id_=f"node-{i}",
+            text="",
+            embedding=embedding.tolist(),
+            metadata={"file_name": f"doc-{i % 10}.pdf"},
+        )
+        for i, embedding in enumerate(embeddings)
+    ]
+
+
+def build_store(name: str, nodes: list[TextNode], persist_path: str) -> dict:
+    """Adds the nodes to an empty store and persists it.
+
+    Parameters
+    ----------
+    name : str
+        The vector store class name.
+    nodes : list[TextNode]
+        The nodes to add.
+    persist_path : str
+        The path to persist the store to.
+
+    Returns
+    -------
+    dict
+        The add and persist timings and the persisted size.
+    """
+    store = STORES[name]()
+    start = time.perf_counter()
+    store.add(nodes)  # type: ignore
+    add_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    store.persist(persist_path)
+    persist_seconds = time.perf_counter() - start
+    persist_dir = os.path.dirname(persist_path)
+    persisted_bytes = sum(
+        entry.stat().st_size
+        for entry in os.scandir(persist_dir)
+        if entry.name.startswith(name)
+    )
+    return {
+        "add_seconds": add_seconds,
+        "persist_seconds": persist_seconds,
+        "persisted_mb": persisted_bytes / 2**20,
+    }
+
+
+def load_and_query(
+    name: str, persist_path: str, queries: np.ndarray, top_k: int
+) -> tuple[dict, list[list[str]]]:
+    """Loads a persisted store and runs the queries. Run in a fresh process so
+    the memory used by the load is specific to the store.
+
+    Parameters
+    ----------
+    name : str
+        The vector store class name.
+    persist_path : str
+        The persisted store path.
+    queries : np.ndarray
+        The query embeddings, one row each.
+    top_k : int
+        The number of nodes to retrieve per query.
+
+    Returns
+    -------
+    tuple[dict, list[list[str]]]
+        The timings and memory, and the retrieved node IDs of each query.
+    """
+    baseline_rss = _peak_rss_mb()
+    start = time.perf_counter()
+    store = STORES[name].from_persist_path(persist_path)
+    load_seconds = time.perf_counter() - start
+    latencies = []
+    retrieved = []
+    for query_embedding in queries:
+        query = VectorStoreQuery(
+            query_embedding=query_embedding.tolist(), similarity_top_k=top_k
+        )
+        start = time.perf_counter()
+        result = store.query(query)
+        latencies.append(time.perf_counter() - start)
+        retrieved.append(result.ids or [])
+    return {
+        "load_seconds": load_seconds,
+        "query_ms_median": statistics.median(latencies) * 1000,
+        "query_ms_max": max(latencies) * 1000,
+        # peak resident memory added by loading and querying the store
+        "rss_mb": _peak_rss_mb() - baseline_rss,
+    }, retrieved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--nodes", type=int, default=2000, help="Number of nodes in the store.")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension.")
+    parser.add_argument("--queries", type=int, default=20, help="Number of queries to time.")
+    parser.add_argument("--top-k", type=int, default=5, help="Nodes retrieved per query.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    parser.add_argument("--output", default=None, help="Optional JSON results path.")
+    args = parser.parse_args()
+
+    nodes = synthetic_nodes(args.nodes, args.dim, args.seed)
+    queries = np.random.default_rng(args.seed + 1).standard_normal(
+        (args.queries, args.dim), dtype=np.float32
+    )
+    results = {}
+    retrieved = {}
+    spawn = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in STORES:
+            persist_path = os.path.join(tmp_dir, f"{name}.json")
+            results[name] = build_store(name, nodes, persist_path)
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                load_results, retrieved[name] = executor.submit(
+                    load_and_query, name, persist_path, queries, args.top_k
+                ).result()
+            results[name].update(load_results)
+    matching = sum(
+        simple == numpy
+        for simple, numpy in zip(
+            retrieved["SimpleVectorStore"], retrieved["NumpyVectorStore"]
+        )
+    )
+
+    metrics = list(results["SimpleVectorStore"].keys())
+    print(f"{args.nodes} nodes, dim {args.dim}, top {args.top_k}")
+    print(f"{'':<20}" + "".join(f"{name:>20}" for name in results))
+    for metric in metrics:
+        print(
+            f"{metric:<20}"
+            + "".join(f"{results[name][metric]:>20.3f}" for name in results)
+        )
+    print(f"identical top k: {matching}/{args.queries} queries")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "settings": vars(args),
+                    "results": results,
+                    "identical_top_k": matching,
+                },
+                f,
+                indent=2,
+            )
+
+
+def _peak_rss_mb() -> float:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,143 @@
+import argparse
 from bcorag import misc_functions as misc_fns
 from bcorag import option_picker as op
-from bcorag.bcorag import BcoRag
+from bcorag import batch
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="BioCompute Object RAG assistant.")
+    parser.add_argument(
+        "--domains",
+        nargs="+",
+        default=None,
+        help='Domains (names or short codes) to generate concurrently after the option selections, or "all". Exits when done.',
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=None,
+        help="Maximum number of domains generated at once (default: 3).",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream each single domain response to the terminal and its txt file as it is generated.",
+    )
+    parser.add_argument(
+        "--no-response-cache",
+        action="store_true",
+        help="Bypass the LLM response cache lookups and always call the LLM.",
+    )
+    batch_group = parser.add_argument_group(
+        "batch mode", "Non-interactive processing of a whole papers directory."
+    )
+    batch_group.add_argument(
+        "--batch", action="store_true", help="Run in non-interactive batch mode."
+    )
+    batch_group.add_argument(
+        "--config",
+        default=None,
+        help="JSON file with the batch selections, keyed by option name (plus optional `repo`, `domains`, `paper_directory` and `workers` keys).",
+    )
+    batch_group.add_argument(
+        "--paper-directory", default=None, help="Overrides the papers directory."
+    )
+    batch_group.add_argument(
+        "--workers", type=int, default=None, help="Number of worker processes."
+    )
+    batch_group.add_argument(
+        "--repo",
+        nargs="+",
+        default=None,
+        help="Github repository URLs to include in the indexing.",
+    )
+    presets = misc_fns.load_json(batch.CONF_PATH)
+    for option, option_info in presets["options"].items():
+        batch_group.add_argument(
+            f"--{option.replace('_', '-')}",
+            dest=option,
+            default=None,
+            choices=option_info["list"],
+        )
+    return parser.parse_args()
+
+def run_batch(args: argparse.Namespace):
+    presets = misc_fns.load_json(batch.CONF_PATH)
+    config = misc_fns.load_json(args.config) if args.config is not None else {}
+    cli_overrides = {
+        key: getattr(args, key)
+        for key in [*presets["options"].keys(), "repo", "paper_directory", "workers"]
+        if getattr(args, key) is not None
+    }
+    if args.domains is not None:
+        cli_overrides["domains"] = args.domains
+    config.update(cli_overrides)
+
+    selections = batch.build_selections(config)
+    papers = batch.collect_papers(
+        config.get("paper_directory", presets["paper_directory"])
+    )
+    summaries = batch.run_batch(
+        selections,
+        papers,
+        domains=config.get("domains", "all"),
+        max_workers=config.get("workers"),
+        max_concurrency=args.max_concurrency,
+        bypass_response_cache=args.no_response_cache,
+    )
+    failed = [summary["paper"] for summary in summaries if summary["status"] == "failed"]
+    partial = [summary["paper"] for summary in summaries if summary["status"] == "partial"]
+    print(f"Processed {len(summaries)} papers, {len(failed)} failed, {len(partial)} with failed domains.")
+    if failed:
+        print(f"Failed papers: {', '.join(failed)}")
+    if partial:
+        print(f"Papers with failed domains: {', '.join(partial)}")
+
+def report_domains(results: dict[str, str], domain_errors: dict[str, str]):
+    if results:
+        print(f"Successfully generated the {', '.join(results.keys())} domains.")
+    failed = [domain for domain in domain_errors if domain not in results]
+    if failed:
+        print(f"Failed to generate the {', '.join(failed)} domains, see the log for details.")
+    print()
 
 def main():
 
+    args = parse_args()
+
     logger = misc_fns.setup_root_logger("./logs/bcorag.log")
     logger.info('################################## RUN START ##################################')
-    
+
+    if args.batch:
+        run_batch(args)
+        misc_fns.graceful_exit()
+
     # get the user choices
     user_choices = op.initialize_picker()
     if user_choices is None:
         misc_fns.graceful_exit()
 
-    # handle domain generation
-    bco_rag = BcoRag(user_choices) # type: ignore
+    # handle domain generation, llama-index is only imported once the menus are done
+    from bcorag.bcorag import BcoRag, DEFAULT_MAX_CONCURRENCY
+
+    max_concurrency = (
+        args.max_concurrency
+        if args.max_concurrency is not None
+        else DEFAULT_MAX_CONCURRENCY
+    )
+    bco_rag = BcoRag(user_choices, bypass_response_cache=args.no_response_cache) # type: ignore
+    if args.domains is not None:
+        results = bco_rag.generate_domains(args.domains, max_concurrency)
+        report_domains(results, bco_rag.domain_errors)
+        misc_fns.graceful_exit()
     while True:
         domain = bco_rag.choose_domain()
         if domain is None:
             misc_fns.graceful_exit()
-        _ = bco_rag.perform_query(domain) # type: ignore
+        if domain == "all":
+            results = bco_rag.generate_domains("all", max_concurrency)
+            report_domains(results, bco_rag.domain_errors)
+            continue
+        _ = bco_rag.perform_query(domain, stream=args.stream) # type: ignore
         print(f"Successfully generated the {domain} domain.\n")
 
 if __name__ == "__main__":
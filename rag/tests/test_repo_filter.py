@@ -0,0 +1,83 @@
+import base64
+import json
+import os
+from bcorag.repo_filter import RepoFilter, prepare_text
+
+CONF_PATH = os.path.join(os.path.dirname(__file__), "..", "bcorag", "conf.json")
+
+
+def _notebook(image_bytes: int) -> str:
+    image = base64.b64encode(os.urandom(image_bytes)).decode()
+    # nbformat wraps the base64 image data in 76 character lines
+    image_lines = [f"{image[i : i + 76]}\n" for i in range(0, len(image), 76)]
+    return json.dumps(
+        {
+            "cells": [
+                {"cell_type": "markdown", "source": ["# Survival analysis\n"]},
+                {
+                    "cell_type": "code",
+                    "source": ["import matplotlib.pyplot as plt\n", "plt.plot(x, y)"],
+                    "outputs": [
+                        {
+                            "output_type": "display_data",
+                            "data": {"image/png": image_lines},
+                        }
+                    ],
+                },
+            ],
+            "metadata": {},
+            "nbformat": 4,
+            "nbformat_minor": 5,
+        }
+    )
+
+
+def test_notebook_with_image_outputs_is_kept():
+    repo_filter = RepoFilter.from_conf(CONF_PATH)
+    for image_bytes in (90_000, 4 * repo_filter.policy["max_file_bytes"]):
+        text = _notebook(image_bytes)
+        # compact JSON puts the whole notebook on one line
+        assert repo_filter.check_content(text) is not None
+        assert repo_filter.check_path("notebooks/analysis.ipynb", len(text)) is None
+        prepared = prepare_text("notebooks/analysis.ipynb", text)
+        assert "plt.plot(x, y)" in prepared
+        assert "image/png" not in prepared
+        assert repo_filter.check_content(prepared) is None
+
+
+def test_other_files_keep_the_size_and_minified_rules():
+    repo_filter = RepoFilter.from_conf(CONF_PATH)
+    max_file_bytes = repo_filter.policy["max_file_bytes"]
+    assert repo_filter.check_path("scripts/run.py", max_file_bytes + 1) == "too large"
+    minified = "var a=1;" * 500
+    assert repo_filter.check_content(prepare_text("static/app.js", minified)) == "generated"
+
+
+def test_loader_keeps_notebook_with_image_outputs(tmp_path):
+    import asyncio
+    from bcorag.github_loader import GithubLoader
+
+    repo_filter = RepoFilter.from_conf(CONF_PATH)
+    loader = GithubLoader(
+        None,
+        "owner",
+        "repo",
+        "main",
+        str(tmp_path),
+        "test",
+        repo_filter=repo_filter,
+    )
+    text = _notebook(90_000)
+    # served from the blob cache, no API requests are made
+    with open(loader._blob_path("notebook"), "w") as f:
+        json.dump({"text": text}, f)
+
+    async def _list_files(api, tree_sha):
+        return [("notebooks/analysis.ipynb", "notebook", len(text))]
+
+    loader._list_files = _list_files  # type: ignore
+    _, documents = asyncio.run(loader._aload(None))  # type: ignore
+    assert loader.exclusions == {}
+    assert len(documents) == 1
+    assert "plt.plot(x, y)" in documents[0].text
+    assert "image/png" not in documents[0].text